@@ -0,0 +1,251 @@
+import os
+import time
+from datetime import datetime
+
+import psutil
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# cgroup v2 collector
+#
+# Purpose:
+# Inside a container psutil reports the host: virtual_memory() is the
+# node's RAM and cpu_percent() is every core on the node. What matters
+# is usage against the container's own limits. cgroup v2 exposes both
+# usage and limits as small text files.
+#
+# Flow:
+# target cgroups: the agent's own ("self"), every cgroup next to it
+#                 ("siblings", e.g. all containers on a node when
+#                 /sys/fs/cgroup of the host is mounted), or a list
+# ↓
+# per cgroup: cpu.stat usage_usec, cpu.max, memory.current, memory.max,
+#             memory.stat inactive_file, io.stat rbytes/wbytes
+# ↓
+# cpu  = Δusage_usec / (Δwall_usec × CPUs allowed by cpu.max) × 100
+# mem  = (memory.current − inactive_file) / memory.max × 100
+#        (same working-set figure `docker stats` shows)
+# io   = Δbytes / Δwall, read and write
+# ↓
+# one snapshot per cgroup, same shape as get_live_snapshot()
+#
+# Targets and limits are re-read every `rediscover` seconds, so new
+# containers and changed limits are picked up.
+#
+# Unlimited cpu.max / memory.max fall back to the node's cores / RAM.
+# Counters are cumulative, so each cycle only needs the previous
+# reading; nothing blocks waiting for a measurement window. A cgroup
+# discovered mid-run has no previous reading: its first cycle only
+# records the baseline and produces no snapshot, rather than a cpu=0
+# sample that would be scored and stored as real. "disk"
+# stays the filesystem usage of "/", since cgroups have no notion of
+# filesystem capacity. With several targets every snapshot carries the
+# same node-wide figure, so they are tagged "disk_host": <hostname> and
+# disk forecasts (analysis/disk_forecast.py) keep one series for the
+# host instead of one per container.
+#
+# "siblings" needs the host's cgroup namespace (docker run
+# --cgroupns=host, compose `cgroup: host`). In a private namespace,
+# docker's default, the agent's own cgroup reads as "/" and its real
+# siblings are not visible; discover() refuses that case.
+
+
+def own_cgroup(proc_file="/proc/self/cgroup"):
+    # the v2 entry is the one with hierarchy id 0: "0::/path"
+    with open(proc_file, "r") as f:
+        for line in f:
+            parts = line.strip().split(":", 2)
+            if len(parts) == 3 and parts[0] == "0":
+                return parts[2]
+    raise OSError("no cgroup v2 entry in /proc/self/cgroup")
+
+
+def _read_keyed(path):
+    values = {}
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                values[parts[0]] = parts[1]
+    return values
+
+
+def read_cpu_limit(path):
+    """CPUs allowed by cpu.max, or None when unlimited."""
+    try:
+        with open(os.path.join(path, "cpu.max"), "r") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return int(quota) / int(period)
+
+
+def read_memory_limit(path):
+    try:
+        with open(os.path.join(path, "memory.max"), "r") as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    if value == "max":
+        return None
+    return int(value)
+
+
+def read_io_bytes(path):
+    # "8:0 rbytes=... wbytes=... rios=... wios=..." per device
+    read = write = 0
+    try:
+        with open(os.path.join(path, "io.stat"), "r") as f:
+            for line in f:
+                for field in line.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "rbytes":
+                        read += int(value)
+                    elif key == "wbytes":
+                        write += int(value)
+    except OSError:
+        pass
+    return read, write
+
+
+def read_usage(path):
+    usage_usec = int(_read_keyed(os.path.join(path, "cpu.stat"))["usage_usec"])
+
+    with open(os.path.join(path, "memory.current"), "r") as f:
+        memory = int(f.read())
+    try:
+        stat = _read_keyed(os.path.join(path, "memory.stat"))
+        memory -= int(stat.get("inactive_file", 0))
+    except OSError:
+        pass
+
+    read, write = read_io_bytes(path)
+    return usage_usec, max(memory, 0), read, write
+
+
+class CgroupCollector:
+
+    def __init__(self, root=CGROUP_ROOT, targets="self", rediscover=60):
+        self.root = root
+        self.targets = targets
+        self.rediscover = rediscover
+        self._discovered_at = None
+        self.host_cpus = psutil.cpu_count() or 1
+        self.host_memory = psutil.virtual_memory().total
+        # cgroup path -> (usage_usec, memory, read bytes, write bytes,
+        #                 monotonic time) from the previous cycle
+        self._previous = {}
+        # cgroup path -> (cpu limit, memory limit), re-read on discover()
+        self._limits = {}
+        self._paths = []
+        self.discover()
+        # baseline, so the first collect() already has deltas
+        self._previous = self._sample()
+
+    @property
+    def paths(self):
+        """Target cgroups as of the last discover()."""
+        return list(self._paths)
+
+    def _path(self, cgroup):
+        return os.path.join(self.root, cgroup.lstrip("/"))
+
+    def discover(self):
+        """Resolve the target cgroups; call again to pick up new ones."""
+        if self.targets == "self":
+            paths = [own_cgroup()]
+        elif self.targets == "siblings":
+            own = own_cgroup()
+            if own == "/":
+                raise OSError(
+                    "cgroup targets 'siblings' needs the host cgroup "
+                    "namespace (e.g. docker --cgroupns=host); this "
+                    "process sees its own cgroup as '/'"
+                )
+            parent = os.path.dirname(own)
+            base = self._path(parent)
+            paths = sorted(
+                "/" + os.path.relpath(os.path.join(base, name), self.root)
+                for name in os.listdir(base)
+                if os.path.isfile(os.path.join(base, name, "cpu.stat"))
+            )
+        else:
+            paths = list(self.targets)
+
+        self._paths = paths
+        self._discovered_at = time.monotonic()
+        self._limits = {
+            cgroup: (
+                read_cpu_limit(self._path(cgroup)),
+                read_memory_limit(self._path(cgroup)),
+            )
+            for cgroup in paths
+        }
+        return paths
+
+    def _sample(self):
+        now = time.monotonic()
+        readings = {}
+        for cgroup in self._paths:
+            try:
+                readings[cgroup] = read_usage(self._path(cgroup)) + (now,)
+            except (OSError, KeyError, ValueError):
+                # cgroup removed (container stopped) or not readable
+                continue
+        return readings
+
+    def collect(self, hostname):
+        """One snapshot per target cgroup, usage relative to its limits."""
+        if time.monotonic() - self._discovered_at >= self.rediscover:
+            self.discover()
+
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+        disk = psutil.disk_usage("/").percent
+        readings = self._sample()
+        snapshots = []
+        per_host = self.targets == "self"
+
+        for cgroup, (usage, memory, read, write, now) in readings.items():
+            previous = self._previous.get(cgroup)
+            if previous is None or now <= previous[4]:
+                # new cgroup: this reading is its baseline
+                continue
+            cpu_limit, memory_limit = self._limits.get(cgroup, (None, None))
+
+            elapsed = now - previous[4]
+            cpus = cpu_limit or self.host_cpus
+            cpu = 100.0 * (usage - previous[0]) / (elapsed * 1e6 * cpus)
+            read_bps = (read - previous[2]) / elapsed
+            write_bps = (write - previous[3]) / elapsed
+
+            name = os.path.basename(cgroup) or "root"
+            snapshots.append({
+                "timestamp": timestamp,
+                "cpu": round(min(max(cpu, 0.0), 100.0), 1),
+                "mem": round(
+                    100.0 * memory / (memory_limit or self.host_memory), 1
+                ),
+                "disk": disk,
+                "server": hostname if per_host else f"{hostname}/{name}",
+                "cgroup": cgroup,
+                "io_read_bps": round(max(read_bps, 0.0)),
+                "io_write_bps": round(max(write_bps, 0.0)),
+            })
+            if not per_host:
+                snapshots[-1]["disk_host"] = hostname
+
+        self._previous = readings
+        return snapshots
+
+
+def collector_from_config(config):
+    section = config["cgroups"]
+    return CgroupCollector(
+        root=section["root"],
+        targets=section["targets"],
+        rediscover=section["rediscover"],
+    )
@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from datetime import datetime
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+METRICS = ("cpu", "mem", "disk")
+
+# Incident coalescing
+#
+# Purpose:
+# During a sustained incident every 5-second sample is anomalous.
+# Writing each one to anomaly_events.jsonl floods the file and every
+# consumer downstream of it.
+#
+# Consecutive anomalous samples for a server are folded into a single
+# incident instead:
+#
+# normal ──anomaly──> OPEN ──anomaly──> (UPDATE every `realert` s)
+#                      │
+#                      └──normal for `cooldown` s──> CLOSE
+#
+# Only the open / update / close transitions produce records. Peak
+# values, sample count and duration are carried on each record, plus
+# the lowest anomaly score seen when snapshots carry one.
+#
+# Open incidents live in memory only. At most `max_open` are kept;
+# beyond that the least recently seen incident is closed early.
+
+
+def parse_timestamp(value):
+    return datetime.strptime(value, TIMESTAMP_FORMAT).timestamp()
+
+
+class IncidentTracker:
+
+    def __init__(self, realert=300, cooldown=60, max_open=1024):
+        self.realert = realert
+        self.cooldown = cooldown
+        self.max_open = max_open
+        self._open = OrderedDict()
+
+    def _start(self, snapshot, t):
+        return {
+            "incident_id": f"{snapshot['server']}-{int(t)}",
+            "server": snapshot["server"],
+            "started_at": snapshot["timestamp"],
+            "start_t": t,
+            "last_seen": snapshot["timestamp"],
+            "last_seen_t": t,
+            "last_emit_t": t,
+            "samples": 1,
+            "peak": {m: snapshot[m] for m in METRICS},
+            "score": snapshot.get("score"),
+        }
+
+    def _record(self, incident, event, timestamp):
+        record = {
+            "timestamp": timestamp,
+            "event": event,
+            "incident_id": incident["incident_id"],
+            "server": incident["server"],
+            "started_at": incident["started_at"],
+            "last_seen": incident["last_seen"],
+            "duration": int(incident["last_seen_t"] - incident["start_t"]),
+            "samples": incident["samples"],
+            "peak": dict(incident["peak"]),
+        }
+        if incident["score"] is not None:
+            record["score"] = incident["score"]
+        return record
+
+    def _close(self, server, timestamp, reason):
+        incident = self._open.pop(server)
+        record = self._record(incident, "incident_close", timestamp)
+        record["reason"] = reason
+        return record
+
+    # Feed one scored snapshot. Returns the (possibly empty) list of
+    # incident records to write.
+    def observe(self, snapshot, anomalous):
+        server = snapshot["server"]
+        t = parse_timestamp(snapshot["timestamp"])
+        incident = self._open.get(server)
+        records = []
+
+        if anomalous:
+            if incident is None:
+                incident = self._start(snapshot, t)
+                self._open[server] = incident
+                record = self._record(incident, "incident_open",
+                                      snapshot["timestamp"])
+                record["snapshot"] = snapshot
+                records.append(record)
+
+                while len(self._open) > self.max_open:
+                    oldest = next(iter(self._open))
+                    records.append(
+                        self._close(oldest, snapshot["timestamp"], "evicted")
+                    )
+                return records
+
+            self._open.move_to_end(server)
+            incident["samples"] += 1
+            incident["last_seen"] = snapshot["timestamp"]
+            incident["last_seen_t"] = t
+            for m in METRICS:
+                if snapshot[m] > incident["peak"][m]:
+                    incident["peak"][m] = snapshot[m]
+            score = snapshot.get("score")
+            if score is not None and (
+                incident["score"] is None or score < incident["score"]
+            ):
+                incident["score"] = score
+
+            if t - incident["last_emit_t"] >= self.realert:
+                incident["last_emit_t"] = t
+                record = self._record(incident, "incident_update",
+                                      snapshot["timestamp"])
+                if "processes" in snapshot:
+                    record["processes"] = snapshot["processes"]
+                records.append(record)
+            return records
+
+        if incident is not None and t - incident["last_seen_t"] >= self.cooldown:
+            records.append(
+                self._close(server, snapshot["timestamp"], "recovered")
+            )
+
+        return records
+
+    # Close everything still open, e.g. on shutdown.
+    def flush(self, timestamp):
+        return [
+            self._close(server, timestamp, "shutdown")
+            for server in list(self._open)
+        ]
+
+    def is_open(self, server):
+        return server in self._open
+
+    def open_count(self):
+        return len(self._open)
+
+
+def tracker_from_config(config):
+    section = config["incidents"]
+    return IncidentTracker(
+        realert=section["realert"],
+        cooldown=section["cooldown"],
+        max_open=section["max_open"],
+    )
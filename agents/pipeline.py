@@ -0,0 +1,109 @@
+import time
+from datetime import datetime
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Detection pipeline
+#
+# Purpose:
+# Everything that happens to a snapshot after it has been scored
+# lives here, so the live agent and the replay/backtest entry point
+# run exactly the same code.
+#
+# Flow:
+# (snapshot, anomalous)
+# ↓
+# IncidentTracker (if enabled) ── open/update/close ──> emit
+#   or raw anomalous snapshot ─────────────────────────> emit
+# ↓
+# DiskForecaster (if enabled) ── disk_forecast ────────> emit
+#
+# Clocks:
+# The pipeline never reads the wall clock directly. SystemClock is
+# used live; ReplayClock follows the data being replayed and turns
+# sleep() into a no-op.
+
+
+class SystemClock:
+
+    def timestamp(self):
+        return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class ReplayClock:
+
+    def __init__(self):
+        self.current = None
+        self.skipped = 0.0
+
+    def advance(self, timestamp):
+        self.current = timestamp
+
+    def timestamp(self):
+        return self.current
+
+    def sleep(self, seconds):
+        self.skipped += seconds
+
+
+def log_incident(record):
+    peak = record["peak"]
+    logger.warning(
+        "INCIDENT %s | %s samples=%s duration=%ss peak CPU=%s MEM=%s DISK=%s",
+        record["event"].split("_", 1)[1].upper(), record["incident_id"],
+        record["samples"], record["duration"],
+        peak["cpu"], peak["mem"], peak["disk"]
+    )
+
+
+class EventPipeline:
+
+    # emit(record) persists/forwards one event record.
+    # quiet=True suppresses the per-event WARNING lines (replay).
+    def __init__(self, emit, tracker=None, forecaster=None,
+                 clock=None, quiet=False):
+        self.emit = emit
+        self.tracker = tracker
+        self.forecaster = forecaster
+        self.clock = clock or SystemClock()
+        self.quiet = quiet
+
+    def handle(self, snap, anomaly):
+        if self.tracker is not None:
+            for record in self.tracker.observe(snap, anomaly):
+                if not self.quiet:
+                    log_incident(record)
+                self.emit(record)
+        elif anomaly:
+            if not self.quiet:
+                logger.warning(
+                    "ANOMALY DETECTED | CPU=%s MEM=%s DISK=%s score=%s",
+                    snap["cpu"], snap["mem"], snap["disk"], snap.get("score")
+                )
+            self.emit(snap)
+
+        if self.forecaster is not None:
+            for event in self.forecaster.update(snap):
+                if not self.quiet:
+                    logger.warning(
+                        "DISK FORECAST | %s full in ~%ss (at %s)",
+                        event["mount"], event["eta_seconds"],
+                        event["predicted_full_at"]
+                    )
+                self.emit(event)
+
+    # Close whatever is still open (incidents), stamped with the clock.
+    def close(self):
+        if self.tracker is None:
+            return
+        for record in self.tracker.flush(self.clock.timestamp()):
+            if not self.quiet:
+                log_incident(record)
+            self.emit(record)
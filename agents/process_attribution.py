@@ -0,0 +1,155 @@
+import time
+
+import psutil
+
+# Per-process attribution
+#
+# Purpose:
+# A flagged sample only says "CPU 97%". The top processes at that
+# moment say who did it.
+#
+# Flow:
+# sample flagged, or score within `margin` of its threshold
+# ↓
+# psutil.process_iter()  (psutil keeps Process objects between calls,
+#                         so only new pids are constructed)
+# ↓
+# per process: name / cpu_times / memory_info / io_counters in one
+#              oneshot() (a single /proc read on Linux)
+# ↓
+# CPU% and IO rate = delta against the previous capture, kept per pid
+# ↓
+# top N by CPU, by RSS and by IO → attached to the event record
+#
+# Rates need two readings. Near-threshold samples are captured as
+# well, so by the time a sample is flagged the baseline is usually one
+# interval old. Without a recent baseline (older than `max_age`) one is
+# taken first and the rates are measured over `settle` seconds.
+#
+# Cost is bounded: at most `max_processes` processes are read, and the
+# scan stops once `budget` seconds have been spent. Both cases set
+# "truncated" on the result.
+
+SKIP = (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess)
+
+
+def _read(proc):
+    with proc.oneshot():
+        name = proc.name()
+        cpu = proc.cpu_times()
+        rss = proc.memory_info().rss
+        try:
+            io = proc.io_counters()
+            io_bytes = io.read_bytes + io.write_bytes
+        except (psutil.AccessDenied, AttributeError):
+            # io_counters needs privileges for other users' processes
+            # and does not exist on macOS
+            io_bytes = None
+        return name, proc.create_time(), cpu.user + cpu.system, rss, io_bytes
+
+
+class ProcessSampler:
+
+    def __init__(self, top_n=5, max_processes=2000, budget=0.2,
+                 settle=0.2, max_age=30):
+        self.top_n = top_n
+        self.max_processes = max_processes
+        self.budget = budget
+        self.settle = settle
+        self.max_age = max_age
+        # pid -> (create_time, cpu seconds, io bytes, monotonic time)
+        self._previous = {}
+        self._last_scan = None
+
+    def _scan(self, deadline):
+        now = time.monotonic()
+        current = {}
+        rows = []
+        truncated = False
+
+        for count, proc in enumerate(psutil.process_iter()):
+            if count >= self.max_processes or time.perf_counter() > deadline:
+                truncated = True
+                break
+            try:
+                name, created, cpu, rss, io_bytes = _read(proc)
+            except SKIP:
+                continue
+
+            pid = proc.pid
+            current[pid] = (created, cpu, io_bytes, now)
+
+            previous = self._previous.get(pid)
+            # same pid reused by a new process: no usable baseline
+            if previous is None or previous[0] != created:
+                continue
+            elapsed = now - previous[3]
+            if elapsed <= 0:
+                continue
+
+            io_rate = None
+            if io_bytes is not None and previous[2] is not None:
+                io_rate = (io_bytes - previous[2]) / elapsed
+
+            rows.append({
+                "pid": pid,
+                "name": name,
+                "cpu": round(100.0 * (cpu - previous[1]) / elapsed, 1),
+                "rss_mb": round(rss / (1024 * 1024), 1),
+                "io_mb_s": None if io_rate is None
+                else round(io_rate / (1024 * 1024), 2),
+            })
+
+        # a truncated scan only refreshes what it reached
+        if truncated:
+            self._previous.update(current)
+        else:
+            self._previous = current
+        self._last_scan = now
+        return rows, truncated
+
+    def _top(self, rows):
+        chosen = {}
+        for key in ("cpu", "rss_mb", "io_mb_s"):
+            ranked = sorted(
+                (r for r in rows if r[key] is not None),
+                key=lambda r: r[key], reverse=True
+            )
+            for row in ranked[:self.top_n]:
+                chosen[row["pid"]] = row
+        return sorted(chosen.values(), key=lambda r: r["cpu"], reverse=True)
+
+    def capture(self):
+        """Return the top-N process breakdown for this moment."""
+        started = time.perf_counter()
+        deadline = started + self.budget
+
+        stale = (
+            self._last_scan is None
+            or time.monotonic() - self._last_scan > self.max_age
+        )
+        truncated = False
+        if stale:
+            _, truncated = self._scan(deadline)
+            time.sleep(self.settle)
+            # the settle wait does not count against the scan budget
+            deadline = time.perf_counter() + self.budget
+
+        rows, cut = self._scan(deadline)
+        return {
+            "top": self._top(rows),
+            "processes": len(rows),
+            "truncated": truncated or cut,
+            "capture_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+
+def sampler_from_config(config):
+    section = config["attribution"]
+    return ProcessSampler(
+        top_n=section["top_n"],
+        max_processes=section["max_processes"],
+        budget=section["budget"],
+        settle=section["settle"],
+        max_age=section["max_age"],
+    )
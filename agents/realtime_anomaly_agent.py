@@ -1,18 +1,44 @@
 import psutil
-import json
+import logging
 import time
 from datetime import datetime
 import joblib
 import warnings
 import os
-from utils.config_loader import load_config
-from utils.logger import setup_logger
+import queue
+import signal
+import threading
+from utils.config_loader import (
+    ConfigError,
+    ConfigWatcher,
+    load_config,
+    validate_config
+)
+from utils.logger import setup_logger, configure_logging
+from utils.durable_log import log_from_config, recover
+from utils.sqlite_store import StoreLog, store_from_config
+from utils.timeseries import buffer_from_config
 from analysis.bootstrap import (
     history_exists,
     model_exists,
     bootstrap_history,
     bootstrap_model
 )
+from analysis.disk_forecast import forecaster_from_config
+from agents.incidents import tracker_from_config
+from utils.notifier import notifier_from_config
+from utils.metrics import MetricsRegistry, start_metrics_server
+from utils.profiler import Tracer, profiler_from_config
+from agents.pipeline import EventPipeline, SystemClock
+from agents.sampling import scheduler_from_config
+from agents.process_attribution import sampler_from_config
+from agents.cgroup_collector import collector_from_config
+from analysis.model_format import (
+    compact_path_for, export_forest, load_forest, model_fingerprint
+)
+from analysis.threshold_calibration import ThresholdFile
+from analysis.drift import load_reference, monitor_from_config, reference_path_for
+from analysis.anomaly_training import train_from_history
 logger = setup_logger()
 
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -30,41 +56,132 @@ def create_snapshot(cpu, mem, disk, name):
         "server": name
     }
 
+# Usage percent for every mounted partition, keyed by mount point.
+# Pseudo and unreadable mounts are skipped.
+def get_partition_usage():
+    usage = {}
+    for part in psutil.disk_partitions(all=False):
+        if part.mountpoint in usage:
+            continue
+        try:
+            usage[part.mountpoint] = psutil.disk_usage(part.mountpoint).percent
+        except OSError:
+            continue
+    return usage
+
 def get_live_snapshot(server_name):
     cpu = psutil.cpu_percent(interval=1)
     mem = psutil.virtual_memory().percent
     disk = psutil.disk_usage("/").percent
-    return create_snapshot(cpu,mem, disk, server_name)
+    snapshot = create_snapshot(cpu,mem, disk, server_name)
+    snapshot["disks"] = get_partition_usage()
+    return snapshot
 
-#Load the trained model
+#Load the trained model (.forest = compact mmap format, else joblib)
 def load_model(path):
+    if path.endswith(".forest"):
+        return load_forest(path)
     model = joblib.load(path)
     return model
 
-#Predict anomaly for a single snapshot
-def is_anomaly(model, snapshot):
+#Resolve which model file the agent loads, converting an existing
+#pickle to the compact format on first use
+def resolve_model_path(model_path, model_format):
+    if model_format != "compact":
+        return model_path
+
+    compact_path = compact_path_for(model_path)
+    if not os.path.exists(compact_path):
+        logger.info("Converting %s to compact format", model_path)
+        export_forest(joblib.load(model_path), compact_path)
+    return compact_path
+
+#Continuous anomaly score for a single snapshot
+#(decision_function: lower = more anomalous, < 0 = model's own cutoff)
+def score_snapshot(model, snapshot):
     features = [[
         snapshot["cpu"],
         snapshot["mem"],
         snapshot["disk"]
     ]]
-    pred = model.predict(features)[0]  # 1 = normal, -1 = anomaly
-    return pred == -1
-
-#Optional: log anomalies to a file
-def log_anomaly(snapshot, filename):
-    with open(filename, "a") as f:
-        f.write(json.dumps(snapshot) + "\n")
+    return float(model.decision_function(features)[0])
 
-#Function to update live snapshot into history
-def append_snapshot_to_history(snapshot, filename):
-    with open(filename, "a") as f:
-        f.write(json.dumps(snapshot) + "\n")
+#Predict anomaly for a single snapshot
+def is_anomaly(model, snapshot, threshold=0.0):
+    return score_snapshot(model, snapshot) < threshold
+
+#Log one drift check; every decision is kept, retrains at WARNING
+def log_drift_decision(decision):
+    level = logging.WARNING if decision["retrain"] else logging.INFO
+    psi = decision.get("psi")
+    if psi is None:
+        logger.log(level, "Drift check | retrain=%s (%s)",
+                   decision["retrain"], decision["reason"])
+        return
+    logger.log(
+        level,
+        "Drift check | PSI cpu=%s mem=%s disk=%s anomaly_rate=%s "
+        "(expected %s) | retrain=%s (%s)",
+        psi["cpu"], psi["mem"], psi["disk"], decision["anomaly_rate"],
+        decision["expected_rate"], decision["retrain"], decision["reason"]
+    )
+
+#Re-read config.yaml when it changed (or on SIGHUP) and apply the
+#fields that are safe to change live. Returns the config to run with.
+def reload_config(watcher, config, tracker=None, forecaster=None,
+                  schedulers=(), sampler=None, drift=None, tracer=None):
+    try:
+        result = watcher.poll()
+    except ConfigError as e:
+        logger.error("Config reload rejected, keeping running config: %s", e)
+        return config
+    if result is None:
+        return config
+
+    new_config, applied, rejected = result
+    for key, old, new in rejected:
+        logger.warning(
+            "Config change %s: %r -> %r requires a restart, ignored",
+            key, old, new
+        )
+    if not applied:
+        return new_config
+
+    configure_logging(new_config)
+    if tracker is not None:
+        for key in ("realert", "cooldown", "max_open"):
+            setattr(tracker, key, new_config["incidents"][key])
+    if forecaster is not None:
+        for key in ("window", "min_samples", "horizon", "realert", "capacity"):
+            setattr(forecaster, key, new_config["forecast"][key])
+    for scheduler in schedulers:
+        for key in ("min_interval", "max_interval", "volatility_scale",
+                    "backoff", "margin_scale"):
+            setattr(scheduler, key, new_config["sampling"][key])
+    if drift is not None:
+        for key in ("check_every", "psi_threshold", "rate_factor", "cooldown"):
+            setattr(drift, key, new_config["drift"][key])
+    if sampler is not None:
+        for key in ("top_n", "max_processes", "budget"):
+            setattr(sampler, key, new_config["attribution"][key])
+    if tracer is not None:
+        tracer.enabled = new_config["profiling"]["spans"]
+
+    for key, old, new in applied:
+        logger.info("Config change applied: %s %r -> %r", key, old, new)
+    return new_config
 
 #Main loop — real-time anomaly detection
-def main():
+def main(clock=None):
+    clock = clock or SystemClock()
     config = load_config()
-    logger.info(f"Configuration loaded: {config}")
+    try:
+        validate_config(config)
+    except ConfigError as e:
+        logger.error("%s", e)
+        return
+    configure_logging(config)
+    logger.info("Configuration loaded: %s", config)
 
     BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
@@ -72,12 +189,84 @@ def main():
     LOG_DIR = os.path.join(BASE_DIR, config["paths"]["logs_dir"])
     HISTORY_FILE = os.path.join(BASE_DIR, config["paths"]["history_file"])
     ANOMALY_FILE = os.path.join(BASE_DIR, config["paths"]["anomaly_file"])
+    DATABASE = os.path.join(BASE_DIR, config["storage"]["database"])
 
     # ensure logs directory exists
     os.makedirs(LOG_DIR, exist_ok=True)
 
     logger.info("Real-time anomaly detector started")
 
+    registry = MetricsRegistry()
+    collect_latency = registry.histogram(
+        "iclim_collect_seconds", "Time spent collecting a live snapshot."
+    )
+    inference_latency = registry.histogram(
+        "iclim_inference_seconds", "Time spent scoring a snapshot."
+    )
+    write_latency = registry.histogram(
+        "iclim_write_seconds", "Time spent appending history and event records."
+    )
+    loop_overrun = registry.histogram(
+        "iclim_loop_overrun_seconds",
+        "Time a cycle ran past the configured interval."
+    )
+    samples_total = registry.counter(
+        "iclim_samples_total", "Snapshots collected."
+    )
+    anomalies_total = registry.counter(
+        "iclim_anomalies_total", "Snapshots flagged as anomalous."
+    )
+    errors_total = registry.counter(
+        "iclim_errors_total", "Errors raised inside the main loop."
+    )
+    retrains_total = registry.counter(
+        "iclim_retrains_total", "Model trainings performed by the agent."
+    )
+    attribution_latency = registry.histogram(
+        "iclim_attribution_seconds",
+        "Time spent capturing the per-process breakdown."
+    )
+
+    # Per-phase spans are no-ops unless profiling.spans is set or a
+    # profiling session (SIGUSR2 or /profile) is running.
+    profiler = None
+    tracer = Tracer()
+    if config["profiling"]["enabled"]:
+        profiler, tracer = profiler_from_config(config, BASE_DIR)
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(
+                signal.SIGUSR2, lambda signum, frame: profiler.start()
+            )
+
+    # recent metrics in memory (compressed), served as /range
+    # on the metrics endpoint
+    recent = None
+    if config["buffer"]["enabled"]:
+        recent = buffer_from_config(config)
+        registry.gauge(
+            "iclim_buffer_bytes",
+            "Compressed size of the in-memory recent metrics.",
+            source=lambda: recent.stats()["bytes"]
+        )
+
+    if config["metrics"]["enabled"]:
+        try:
+            start_metrics_server(
+                registry,
+                host=config["metrics"]["host"],
+                port=config["metrics"]["port"],
+                profiler=profiler,
+                recent=recent,
+            )
+        except OSError as e:
+            logger.error("Metrics endpoint failed to start: %s", e)
+
+    # A crash mid-write leaves a torn last record; cut it off before
+    # anything (bootstrap training included) reads the history.
+    if config["durability"]["recover"]:
+        for path in (HISTORY_FILE, ANOMALY_FILE):
+            recover(path)
+
     # Bootstrap startup validation
 
     if not history_exists(HISTORY_FILE):
@@ -105,53 +294,321 @@ def main():
         )
 
         bootstrap_model(HISTORY_FILE, MODEL_PATH)
+        retrains_total.inc()
 
     try:
-        model = load_model(MODEL_PATH)
+        model = load_model(
+            resolve_model_path(MODEL_PATH, config["model"]["format"])
+        )
         logger.info("Model loaded successfully")
     except Exception as e:
-        logger.error(f"Model loading failed: {str(e)}")
+        logger.error("Model loading failed: %s", e)
         return
 
+    forecaster = None
+    if config["forecast"]["enabled"]:
+        forecaster = forecaster_from_config(config)
+
+    tracker = None
+    if config["incidents"]["enabled"]:
+        tracker = tracker_from_config(config)
+        registry.gauge(
+            "iclim_incidents_open", "Incidents currently open.",
+            source=tracker.open_count
+        )
+
+    notifier = None
+    if config["notifier"]["enabled"]:
+        notifier = notifier_from_config(config, BASE_DIR)
+        logger.info(
+            "Notifier started with sinks: %s",
+            [s.name for s in notifier.sinks]
+        )
+        registry.gauge(
+            "iclim_notifier_queue_depth", "Records waiting in the notifier queue.",
+            source=lambda: notifier.metrics()["queue_depth"]
+        )
+        registry.gauge(
+            "iclim_notifier_latency_seconds_avg",
+            "Average enqueue-to-delivery latency of notifications.",
+            source=lambda: notifier.metrics()["latency_avg"]
+        )
+        registry.gauge(
+            "iclim_notifier_spilled", "Notifications spilled to disk.",
+            source=lambda: notifier.metrics()["spilled"]
+        )
+
+    # thresholds calibrated for another model are ignored
+    thresholds = ThresholdFile(
+        os.path.join(BASE_DIR, config["scoring"]["thresholds_file"]),
+        model_fingerprint(model)
+    )
+    if thresholds.table.hosts:
+        logger.info(
+            "Score thresholds loaded for %s host(s)",
+            len(thresholds.table.hosts)
+        )
+
+    collector = None
+    if config["cgroups"]["enabled"]:
+        try:
+            collector = collector_from_config(config)
+            logger.info("Collecting cgroup metrics for %s", collector.paths)
+        except OSError as e:
+            logger.error("cgroup collector unavailable: %s", e)
+            return
+
+    # one adaptive scheduler per monitored series (host or cgroup);
+    # the cycle runs at the shortest interval any of them asks for
+    adaptive = config["sampling"]["adaptive"]
+    schedulers = {}
     interval = config["app"]["interval"]
+    if adaptive:
+        registry.gauge(
+            "iclim_sampling_interval_seconds",
+            "Seconds until the next snapshot (adaptive sampling).",
+            source=lambda: interval
+        )
+
+    sampler = None
+    if config["attribution"]["enabled"]:
+        sampler = sampler_from_config(config)
+
+    drift = None
+    retrain_thread = None
+    if config["drift"]["enabled"]:
+        drift = monitor_from_config(config, MODEL_PATH)
+        if drift.reference is None:
+            logger.info(
+                "No drift reference for %s; the first %s samples become it",
+                MODEL_PATH, drift.window
+            )
+
+    # Retrain off the sampling thread, on the whole history with the
+    # unflagged samples of the drift window mixed in. The loop picks the
+    # result up at its next cycle and swaps the model in there, so the
+    # model, the drift state and the metrics are only ever changed by
+    # the loop. Too few samples to train on leaves the model in place.
+    retrained = queue.SimpleQueue()
+
+    def retrain(reason, since, table):
+        started = time.perf_counter()
+        try:
+            if store is not None:
+                store.flush()
+            train_from_history(
+                HISTORY_FILE if store is None else DATABASE, MODEL_PATH,
+                recent_since=since,
+                recent_share=config["drift"]["recent_share"],
+                thresholds=table,
+                min_samples=config["drift"]["min_samples"]
+            )
+            new_model = load_model(
+                resolve_model_path(MODEL_PATH, config["model"]["format"])
+            )
+        except Exception as e:
+            logger.error("Drift retrain failed: %s", e)
+            return
+        retrained.put((new_model, reason, time.perf_counter() - started))
+
+    # Appends go through durable logs (one write per record, group
+    # commit fsync; see utils/durable_log.py) or, with the sqlite
+    # backend, batched inserts into one database.
+    store = None
+    if config["storage"]["backend"] == "sqlite":
+        store = store_from_config(DATABASE, config)
+        history_log = StoreLog(store, "snapshots")
+        events_log = StoreLog(store, "events")
+        logger.info("Storing snapshots and events in %s", DATABASE)
+    else:
+        history_log = log_from_config(HISTORY_FILE, config)
+        events_log = log_from_config(ANOMALY_FILE, config)
+
+    def emit(record):
+        with tracer.span("write"), write_latency.time():
+            events_log.append(record)
+            if notifier is not None:
+                notifier.notify(record)
+
+    pipeline = EventPipeline(
+        emit, tracker=tracker, forecaster=forecaster, clock=clock
+    )
+
+    watcher = None
+    if config["app"]["reload"]:
+        watcher = ConfigWatcher(config)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, watcher.request_reload)
+
     first_run = True
     while True:
+        cycle_start = time.perf_counter()
         try:
+            while not retrained.empty():
+                model, reason, seconds = retrained.get()
+                drift.set_reference(
+                    load_reference(reference_path_for(MODEL_PATH))
+                )
+                drift.reset()
+                # the old model's thresholds no longer apply
+                thresholds.fingerprint = model_fingerprint(model)
+                retrains_total.inc()
+                logger.info(
+                    "Drift retrain finished in %.1fs, model swapped (%s)",
+                    seconds, reason
+                )
+
+            if watcher is not None:
+                config = reload_config(
+                    watcher, config, tracker, forecaster,
+                    schedulers.values(), sampler, drift, tracer
+                )
+                if not adaptive:
+                    interval = config["app"]["interval"]
+                HISTORY_FILE = os.path.join(
+                    BASE_DIR, config["paths"]["history_file"]
+                )
+                ANOMALY_FILE = os.path.join(
+                    BASE_DIR, config["paths"]["anomaly_file"]
+                )
+                # the database path is restart-only
+                if store is None and history_log.path != HISTORY_FILE:
+                    history_log.close()
+                    history_log = log_from_config(HISTORY_FILE, config)
+                if store is None and events_log.path != ANOMALY_FILE:
+                    events_log.close()
+                    events_log = log_from_config(ANOMALY_FILE, config)
+
             import socket
             if config["app"]["hostname"] == "auto":
                 HOSTNAME = socket.gethostname()
             else:
                 HOSTNAME = config["app"]["hostname"]
 
-            snap = get_live_snapshot(HOSTNAME)
-
-            anomaly = is_anomaly(model, snap)
-
-            append_snapshot_to_history(snap, HISTORY_FILE)
-            logger.info(f"Snapshot stored | CPU={snap['cpu']} MEM={snap['mem']} DISK={snap['disk']}")
-
-            if first_run:
-                logger.info(f"First snapshot collected: CPU={snap['cpu']} MEM={snap['mem']} DISK={snap['disk']}")
-                first_run = False
-
-            if anomaly:
-                logger.warning(
-                    f"ANOMALY DETECTED | CPU={snap['cpu']} MEM={snap['mem']} DISK={snap['disk']}"
-                )
-                log_anomaly(snap, ANOMALY_FILE)
-            else:
-                logger.info(
-                    f"System Normal | CPU={snap['cpu']} MEM={snap['mem']} DISK={snap['disk']}"
+            with tracer.span("collect"), collect_latency.time():
+                if collector is not None:
+                    snaps = collector.collect(HOSTNAME)
+                else:
+                    snaps = [get_live_snapshot(HOSTNAME)]
+
+            # Score everything first: with adaptive sampling the cycle
+            # interval (stored on each sample) depends on all of them.
+            scored = []
+            for snap in snaps:
+                samples_total.inc()
+                with tracer.span("score"), inference_latency.time():
+                    score = score_snapshot(model, snap)
+                threshold = thresholds.current().threshold(
+                    snap["server"], int(snap["timestamp"][11:13])
                 )
-
-            time.sleep(interval)
+                anomaly = score < threshold
+                snap["score"] = round(score, 6)
+                if anomaly:
+                    anomalies_total.inc()
+
+                if adaptive:
+                    scheduler = schedulers.get(snap["server"])
+                    if scheduler is None:
+                        scheduler = schedulers[snap["server"]] = (
+                            scheduler_from_config(config)
+                        )
+                    scheduler.update(
+                        snap, anomaly,
+                        tracker is not None and tracker.is_open(snap["server"]),
+                        margin=score - threshold
+                    )
+                scored.append((snap, score, threshold, anomaly))
+
+            if adaptive and schedulers:
+                interval = min(s.interval for s in schedulers.values())
+
+            for snap, score, threshold, anomaly in scored:
+                # seconds this sample stands for (training weight)
+                snap["interval"] = round(interval, 2)
+
+                with tracer.span("write"), write_latency.time():
+                    history_log.append(snap)
+                if recent is not None:
+                    recent.append(snap)
+
+                with tracer.span("log"):
+                    logger.info(
+                        "Snapshot stored | CPU=%s MEM=%s DISK=%s",
+                        snap["cpu"], snap["mem"], snap["disk"]
+                    )
+
+                    if first_run:
+                        logger.info(
+                            "First snapshot collected: CPU=%s MEM=%s DISK=%s",
+                            snap["cpu"], snap["mem"], snap["disk"]
+                        )
+                        first_run = False
+
+                    if not anomaly:
+                        logger.info(
+                            "System Normal | CPU=%s MEM=%s DISK=%s",
+                            snap["cpu"], snap["mem"], snap["disk"]
+                        )
+                    elif tracker is not None:
+                        logger.info(
+                            "Anomalous sample | CPU=%s MEM=%s DISK=%s "
+                            "score=%s",
+                            snap["cpu"], snap["mem"], snap["disk"],
+                            snap["score"]
+                        )
+
+                # Top processes for flagged and near-threshold samples.
+                # Only flagged ones keep it (on the event, not in
+                # history); near-threshold captures keep the rate
+                # baseline fresh.
+                if (sampler is not None
+                        and score < threshold + config["attribution"]["margin"]):
+                    with attribution_latency.time():
+                        breakdown = sampler.capture()
+                    if anomaly:
+                        snap["processes"] = breakdown
+
+                pipeline.handle(snap, anomaly)
+
+                if drift is not None:
+                    decision = drift.observe(snap, anomaly, time.monotonic())
+                    if decision is not None:
+                        busy = (retrain_thread is not None
+                                and retrain_thread.is_alive())
+                        if decision["retrain"] and busy:
+                            decision["retrain"] = False
+                            decision["reason"] += "; retrain already running"
+                        log_drift_decision(decision)
+                        if decision["retrain"]:
+                            retrain_thread = threading.Thread(
+                                target=retrain,
+                                args=(decision["reason"], drift.window_start(),
+                                      thresholds.current()),
+                                name="iclim-retrain", daemon=True
+                            )
+                            retrain_thread.start()
+                            drift.retrain_started(time.monotonic())
+
+            # Sleep only for what is left of the interval so the cadence
+            # stays at `interval`; anything beyond it is an overrun.
+            elapsed = time.perf_counter() - cycle_start
+            loop_overrun.observe(max(elapsed - interval, 0.0))
+            clock.sleep(max(interval - elapsed, 0.0))
 
         except KeyboardInterrupt:
             logger.info("Monitoring stopped by user")
+            pipeline.close()
+            if notifier is not None:
+                notifier.close()
+            history_log.close()
+            events_log.close()
+            if store is not None:
+                store.close()
             break
 
         except Exception as e:
-            logger.error(f"Error in main loop: {str(e)}")
+            errors_total.inc()
+            logger.error("Error in main loop: %s", e)
         
 
 if __name__ == "__main__":
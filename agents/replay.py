@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from agents.incidents import tracker_from_config
+from agents.pipeline import EventPipeline, ReplayClock
+from agents.realtime_anomaly_agent import load_model
+from analysis.model_format import compact_path_for, model_fingerprint
+from analysis.parallel_ingest import load_history_parallel
+from analysis.disk_forecast import backfill_events, backfill_forecasts
+from analysis.threshold_calibration import load_thresholds
+from utils.config_loader import load_config
+from utils.logger import setup_logger, configure_logging
+from utils.sqlite_store import history_source
+
+logger = setup_logger()
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+# Replay / backtest
+#
+# Purpose:
+# Run the detector over stored history as fast as the CPU allows,
+# instead of waiting for live traffic, so thresholds and incident
+# settings can be tuned against known data.
+#
+# Flow:
+# snapshot_history.jsonl / .parquet
+# ↓
+# model.decision_function in fixed-size chunks (vectorised scoring;
+#   sklearn's pickle rather than the compact form when both exist,
+#   since its compiled traversal is the faster one for bulk batches)
+# ↓
+# score < per-host / per-hour threshold (thresholds.json, if present)
+# ↓
+# EventPipeline (same tracker and event records as main())
+#   driven by a ReplayClock: no sleeping, time follows the data
+# ↓
+# disk forecasts via the vectorised backfill
+# ↓
+# events JSONL + detection summary
+#
+# Only samples that can change incident state are pushed through the
+# pipeline: anomalous samples, and normal samples for servers that
+# currently have an open incident. Everything else is a no-op in
+# main() as well, so the output is identical.
+#
+# Not replayed:
+# - drift monitoring and drift retrains: the whole history is scored
+#   with one model
+# - adaptive sampling: samples are taken at the rate they were stored,
+#   not rescheduled
+# - live forecasting: disk forecasts come from the backfill over the
+#   whole frame (analysis/disk_forecast.py), computed after the
+#   pipeline rather than interleaved with it; it uses the live window
+#   bounds and re-alert throttle, so the events are the same
+#
+# Labels:
+# Optional JSONL of {"server", "start", "end"} anomaly episodes (the
+# format benchmarks/workload.py writes). For each episode the first
+# flagged sample inside it gives the detection latency.
+
+
+def load_frame(path):
+    if path.endswith(".parquet"):
+        # needs pyarrow or fastparquet
+        df = pd.read_parquet(path)
+    else:
+        df = load_history_parallel(path)
+
+    if not df.empty and not pd.api.types.is_string_dtype(df["timestamp"]):
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+    return df
+
+
+def score_frame(model, df, chunk_size=100_000):
+    features = df[["cpu", "mem", "disk"]].to_numpy(dtype=float)
+    scores = np.empty(len(features), dtype=np.float64)
+    for begin in range(0, len(features), chunk_size):
+        end = begin + chunk_size
+        scores[begin:end] = model.decision_function(features[begin:end])
+    return scores
+
+
+def flag_frame(df, scores, thresholds=None):
+    if thresholds is None:
+        return scores < 0
+    hours = df["timestamp"].str.slice(11, 13).astype(int).to_numpy()
+    return scores < thresholds.thresholds(df["server"].to_numpy(), hours)
+
+
+def replay(df, model, config, emit, chunk_size=100_000, thresholds=None):
+    """Replay a history frame through the detection pipeline."""
+    clock = ReplayClock()
+    tracker = None
+    if config["incidents"]["enabled"]:
+        tracker = tracker_from_config(config)
+
+    pipeline = EventPipeline(emit, tracker=tracker, clock=clock, quiet=True)
+
+    started = time.perf_counter()
+    scores = score_frame(model, df, chunk_size)
+    flags = flag_frame(df, scores, thresholds)
+    scored = time.perf_counter()
+
+    timestamps = df["timestamp"].tolist()
+    servers = df["server"].tolist()
+    cpu = df["cpu"].tolist()
+    mem = df["mem"].tolist()
+    disk = df["disk"].tolist()
+    score = scores.round(6).tolist()
+
+    for i, flag in enumerate(flags.tolist()):
+        if not flag and (tracker is None or not tracker.is_open(servers[i])):
+            continue
+        snap = {
+            "timestamp": timestamps[i],
+            "cpu": cpu[i],
+            "mem": mem[i],
+            "disk": disk[i],
+            "server": servers[i],
+            "score": score[i],
+        }
+        clock.advance(timestamps[i])
+        pipeline.handle(snap, flag)
+
+    if timestamps:
+        clock.advance(timestamps[-1])
+    pipeline.close()
+
+    if config["forecast"]["enabled"]:
+        section = config["forecast"]
+        forecasts = backfill_forecasts(
+            df,
+            window=section["window"],
+            min_samples=section["min_samples"],
+            capacity=section["capacity"],
+        )
+        for event in backfill_events(
+            forecasts, horizon=section["horizon"], realert=section["realert"]
+        ):
+            emit(event)
+
+    finished = time.perf_counter()
+    return flags, {
+        "rows": len(df),
+        "flagged": int(flags.sum()),
+        "scoring_seconds": round(scored - started, 3),
+        "total_seconds": round(finished - started, 3),
+        "rows_per_sec": round(len(df) / max(finished - started, 1e-9), 1),
+    }
+
+
+def load_labels(path):
+    labels = pd.read_json(path, lines=True)
+    if labels.empty:
+        return labels
+    labels["start"] = pd.to_datetime(labels["start"])
+    labels["end"] = pd.to_datetime(labels["end"])
+    return labels
+
+
+def detection_report(df, flags, labels):
+    """Per-episode detection latency and flagged-sample precision."""
+    samples = pd.DataFrame({
+        "ts": pd.to_datetime(df["timestamp"]),
+        "server": df["server"].to_numpy(),
+    })
+    flagged = samples[flags].sort_values("ts")
+    episodes = labels.sort_values("start")
+
+    if episodes.empty:
+        return {"episodes": 0}
+
+    # first flagged sample at or after each episode start
+    first_hit = pd.merge_asof(
+        episodes, flagged, left_on="start", right_on="ts",
+        by="server", direction="forward"
+    )
+    detected = first_hit["ts"].notna() & (first_hit["ts"] <= first_hit["end"])
+    latency = (
+        first_hit.loc[detected, "ts"] - first_hit.loc[detected, "start"]
+    ).dt.total_seconds()
+
+    # fraction of flagged samples that fall inside some episode
+    inside = pd.merge_asof(
+        flagged, episodes, left_on="ts", right_on="start",
+        by="server", direction="backward"
+    )
+    in_episode = inside["end"].notna() & (inside["ts"] <= inside["end"])
+
+    report = {
+        "episodes": int(len(episodes)),
+        "detected": int(detected.sum()),
+        "recall": round(float(detected.mean()), 4),
+        "flagged_in_episode": round(float(in_episode.mean()), 4)
+        if len(inside) else 0.0,
+    }
+    if len(latency):
+        report["latency_seconds"] = {
+            "mean": round(float(latency.mean()), 2),
+            "p50": round(float(latency.quantile(0.5)), 2),
+            "p95": round(float(latency.quantile(0.95)), 2),
+            "max": round(float(latency.max()), 2),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay stored history through the anomaly detector."
+    )
+    parser.add_argument("--history",
+                        help="JSONL, .parquet or SQLite store (default: config)")
+    parser.add_argument("--model", help="model path (default: config)")
+    parser.add_argument("--thresholds",
+                        help="calibrated thresholds JSON (default: config)")
+    parser.add_argument("--labels", help="JSONL of labelled anomaly episodes")
+    parser.add_argument("--output", default=os.path.join(
+        BASE_DIR, "logs", "replay_events.jsonl"))
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    args = parser.parse_args()
+
+    config = load_config()
+    configure_logging(config)
+
+    history_file = args.history or history_source(config, BASE_DIR)
+    model_path = args.model or os.path.join(
+        BASE_DIR, config["paths"]["model_path"]
+    )
+
+    df = load_frame(history_file)
+    if df.empty:
+        logger.warning("Nothing to replay.")
+        return
+
+    # a compact model is scored through the pickle it was exported from
+    pickle_path = os.path.join(BASE_DIR, config["paths"]["model_path"])
+    if (os.path.abspath(model_path)
+            == os.path.abspath(compact_path_for(pickle_path))
+            and os.path.exists(pickle_path)):
+        model_path = pickle_path
+    model = load_model(model_path)
+    thresholds = load_thresholds(args.thresholds or os.path.join(
+        BASE_DIR, config["scoring"]["thresholds_file"]
+    ), model_fingerprint(model))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    counts = {}
+    with open(args.output, "w") as out:
+        def emit(record):
+            kind = record.get("event", "anomaly")
+            counts[kind] = counts.get(kind, 0) + 1
+            out.write(json.dumps(record) + "\n")
+
+        flags, stats = replay(
+            df, model, config, emit, args.chunk_size, thresholds
+        )
+
+    summary = {"replay": stats, "events": counts}
+    if args.labels:
+        summary["detection"] = detection_report(
+            df, flags, load_labels(args.labels)
+        )
+
+    logger.info("Replay finished, events written to %s", args.output)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
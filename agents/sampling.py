@@ -0,0 +1,92 @@
+METRICS = ("cpu", "mem", "disk")
+
+# Adaptive sampling interval
+#
+# Purpose:
+# A fixed 5-second interval writes the same flat line over and over on
+# quiet hosts, and is too coarse while something is going wrong.
+#
+# Flow:
+# scored snapshot, margin = score - threshold (> 0: normal)
+# ↓
+# volatility = EWMA of the largest per-sample change in cpu/mem/disk
+# closeness  = 1 at the threshold, 0 once the margin is margin_scale
+# ↓
+# anomalous or incident open  → min_interval (immediately)
+# otherwise                   → between min and max by the larger of
+#                               volatility and closeness, growing by
+#                               at most `backoff`x per sample
+# ↓
+# interval until the next sample (stored on the snapshot as "interval")
+#
+# Shrinking is immediate so an incident is sampled at full resolution
+# from its first flagged sample; growing is gradual so one quiet
+# sample after a burst does not jump straight to max_interval.
+# Closeness samples a host faster as its score drifts towards the
+# threshold, before it is flagged, even when its metrics move slowly.
+#
+# Every history record carries the interval it was followed by, i.e.
+# the number of seconds it stands for. Training uses it as a sample
+# weight so idle periods are not under-represented once they are
+# sampled less often.
+
+
+class AdaptiveInterval:
+
+    def __init__(self, min_interval=1, max_interval=30, initial=5,
+                 volatility_scale=5.0, smoothing=0.3, backoff=1.5,
+                 margin_scale=0.05):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.volatility_scale = volatility_scale
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.margin_scale = margin_scale
+        self.interval = self._clamp(initial)
+        self.volatility = 0.0
+        self._previous = None
+
+    def _clamp(self, value):
+        return min(max(value, self.min_interval), self.max_interval)
+
+    def _observe_change(self, snapshot):
+        if self._previous is not None:
+            change = max(
+                abs(snapshot[m] - self._previous[m]) for m in METRICS
+            )
+            self.volatility += self.smoothing * (change - self.volatility)
+        self._previous = {m: snapshot[m] for m in METRICS}
+
+    # Feed one scored snapshot; returns the seconds to wait before the
+    # next one. margin is score - threshold, when known.
+    def update(self, snapshot, anomalous, incident_open=False, margin=None):
+        self._observe_change(snapshot)
+
+        if anomalous or incident_open:
+            self.interval = self.min_interval
+            return self.interval
+
+        activity = min(self.volatility / self.volatility_scale, 1.0)
+        if margin is not None:
+            closeness = 1.0 - min(max(margin, 0.0) / self.margin_scale, 1.0)
+            activity = max(activity, closeness)
+        target = self.max_interval - activity * (
+            self.max_interval - self.min_interval
+        )
+        if target > self.interval:
+            target = min(target, self.interval * self.backoff)
+
+        self.interval = self._clamp(target)
+        return self.interval
+
+
+def scheduler_from_config(config):
+    section = config["sampling"]
+    return AdaptiveInterval(
+        min_interval=section["min_interval"],
+        max_interval=section["max_interval"],
+        initial=config["app"]["interval"],
+        volatility_scale=section["volatility_scale"],
+        backoff=section["backoff"],
+        margin_scale=section["margin_scale"],
+    )
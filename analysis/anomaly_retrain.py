@@ -4,12 +4,23 @@ import pandas as pd
 from sklearn.ensemble import IsolationForest
 import joblib
 
+from analysis.anomaly_training import get_sample_weights
+from analysis.drift import save_reference
+from analysis.model_format import compact_path_for, export_forest
+from analysis.reservoir import reservoir_sample
+
 HISTORY_FILE = "snapshot_history.jsonl"
 MODEL_FILE = "anomaly_model.pkl"
 KNOWN_ANOMALIES_FILE = "known_anomalies.jsonl"
 
-# How many most recent snapshots to use for training (None = use all)
-RECENT_LIMIT = 500
+# Size of the time-stratified sample drawn from the whole history
+# (see analysis/reservoir.py)
+SAMPLE_SIZE = 100_000
+
+# How many most recent snapshots to use for training (None = use all).
+# Superseded by the stratified sample, which covers every hour of the
+# week instead of only the latest hours.
+RECENT_LIMIT = None
 
 # Whether to skip known anomalies from training if the file exists
 SKIP_KNOWN_ANOMALIES = True
@@ -100,19 +111,26 @@ def get_features(df):
     return df[["cpu", "mem", "disk"]]
 
 
-def train_model(features, contamination=0.05):
+def train_model(features, contamination=0.05, sample_weight=None):
     model = IsolationForest(
         n_estimators=200,
         contamination=contamination,
         random_state=42
     )
-    model.fit(features)
+    model.fit(features, sample_weight=sample_weight)
     return model
 
 
 def main():
-    print(f"Loading history from {HISTORY_FILE} ...")
-    df = load_history(HISTORY_FILE)
+    print(f"Sampling history from {HISTORY_FILE} ...")
+    df = reservoir_sample(HISTORY_FILE, SAMPLE_SIZE)
+
+    if df.attrs["bad_lines"] > 0:
+        print(
+            f"Warning: skipped {df.attrs['bad_lines']} invalid JSON line(s) "
+            f"in {HISTORY_FILE}"
+        )
+    print(f"Sampled {len(df)} of {df.attrs['seen']} snapshot(s).")
 
     if df.empty:
         print("No data available to train on. Exiting.")
@@ -131,7 +149,9 @@ def main():
     features = get_features(df)
 
     print("Training IsolationForest on historical data...")
-    model = train_model(features, contamination=0.05)
+    model = train_model(
+        features, contamination=0.05, sample_weight=get_sample_weights(df)
+    )
 
     # quick sanity check: see how many anomalies it thinks exist in training data
     preds = model.predict(features)
@@ -142,6 +162,12 @@ def main():
     joblib.dump(model, MODEL_FILE)
     print(f"✅ Updated model saved to {MODEL_FILE}")
 
+    compact_path = export_forest(model, compact_path_for(MODEL_FILE))
+    print(f"✅ Compact model saved to {compact_path}")
+
+    reference_path = save_reference(model, features, MODEL_FILE)
+    print(f"✅ Drift reference saved to {reference_path}")
+
 
 if __name__ == "__main__":
     main()
@@ -3,21 +3,46 @@ from sklearn.ensemble import IsolationForest
 import json
 import joblib
 import os
+from analysis.model_format import compact_path_for, export_forest
+from analysis.drift import save_reference
+from analysis.reservoir import reservoir_sample
+from utils.sqlite_store import is_database, load_snapshots
 from utils.logger import setup_logger
 
 logger = setup_logger()
 
+# Training uses a time-stratified sample of at most this many
+# snapshots, so retraining cost stays flat as the history grows.
+# Histories smaller than this are used whole.
+SAMPLE_SIZE = 100_000
+
 
 # Historical JSONL data is converted into a
 # pandas dataframe so it can be processed by
 # scikit-learn.
 
 #Function to load & prepare history data
+#(blank and undecodable lines, e.g. a torn last record, are skipped;
+# a .db/.sqlite path is read from the SQLite store)
 def load_history(filename):
+    if is_database(filename):
+        return load_snapshots(filename)
     records = []
+    bad_lines = 0
     with open(filename, "r") as f:
         for line in f:
-            records.append(json.loads(line.strip()))
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                bad_lines += 1
+
+    if bad_lines > 0:
+        logger.warning(
+            "Skipped %s invalid JSON line(s) in %s", bad_lines, filename
+        )
     return pd.DataFrame(records)
 
 def prepare_df(df):
@@ -33,19 +58,44 @@ def prepare_df(df):
 def get_features(df):
     return df[["cpu", "mem", "disk"]]
 
+# With adaptive sampling each snapshot records the interval it was
+# followed by. Quiet periods are sampled less often, so every sample
+# is weighted by the time it stands for. Records written before
+# adaptive sampling get the median interval.
+# Rows from the stratified sample also carry stratum_weight, the
+# number of history rows each one stands for.
+# Note: with the pinned scikit-learn (1.4.2) IsolationForest accepts
+# sample_weight but scores by unweighted path lengths, so these weights
+# barely change the model there; they are not a full correction for
+# uneven sampling.
+
+#Function to derive per-sample training weights (None = uniform)
+def get_sample_weights(df):
+    weight = None
+    if "interval" in df.columns:
+        interval = pd.to_numeric(df["interval"], errors="coerce")
+        if not interval.isna().all():
+            weight = interval.fillna(interval.median())
+    if "stratum_weight" in df.columns:
+        stratum = df["stratum_weight"]
+        weight = stratum if weight is None else weight * stratum
+    if weight is None:
+        return None
+    return (weight / weight.mean()).to_numpy()
+
 # Isolation Forest learns normal system behavior
 # using CPU, Memory and Disk usage.
 # Later, realtime metrics are compared against
 # this baseline to identify unusual patterns.
 
 #Function to Train IsolationForest
-def train_model(features):
+def train_model(features, sample_weight=None):
     model = IsolationForest(
         n_estimators=200,
         contamination=0.05, #Approx % anomalies expected
         random_state=42
     )
-    model.fit(features)
+    model.fit(features, sample_weight=sample_weight)
     return model
 
 #Function to Predict anomalies
@@ -62,20 +112,95 @@ def save_model(model, model_path):
 
     joblib.dump(model, model_path)
 
-    logger.info(f"Model saved at: {model_path}")
+    logger.info("Model saved at: %s", model_path)
+
+    # Compact, mmap-able copy used by the realtime agent
+    compact_path = export_forest(model, compact_path_for(model_path))
+
+    logger.info("Compact model saved at: %s", compact_path)
+
+# A drift retrain keeps the whole history as the baseline and mixes in
+# the recent window (recent_since on) as `recent_share` of the sample,
+# so a new regime is learned without the old one being forgotten.
+# Recent rows the live model flagged (stored score below the cutoff)
+# are left out, so an ongoing incident is not learned as normal.
+
+#Function to drop snapshots flagged when they were scored
+#(thresholds: ThresholdTable, None = the model's own cutoff 0)
+def drop_flagged(df, thresholds=None):
+    if df.empty or "score" not in df.columns:
+        return df
+    score = pd.to_numeric(df["score"], errors="coerce").to_numpy(dtype=float)
+    if thresholds is None:
+        cutoff = 0.0
+    else:
+        cutoff = thresholds.thresholds(
+            df["server"].to_numpy(),
+            pd.to_datetime(df["timestamp"]).dt.hour.to_numpy()
+        )
+    return df[~(score < cutoff)]
+
+#Function to sample the training set for train_from_history
+def sample_history(history_file, sample_size=SAMPLE_SIZE, recent_since=None,
+                   recent_share=0.25, thresholds=None):
+    if recent_since is None:
+        return reservoir_sample(history_file, sample_size)
+
+    recent_size = max(int(sample_size * recent_share), 1)
+    older = reservoir_sample(
+        history_file, sample_size - recent_size, until=recent_since
+    )
+    recent = reservoir_sample(history_file, recent_size, since=recent_since)
+    kept = drop_flagged(recent, thresholds)
+    if len(kept) < len(recent):
+        logger.info(
+            "Left %s flagged snapshot(s) since %s out of training",
+            len(recent) - len(kept), recent_since
+        )
+    # stratum weights are relative within each part; rescale them so
+    # the parts weigh in by their row counts
+    parts = [
+        part.assign(
+            stratum_weight=part["stratum_weight"] / part["stratum_weight"].mean()
+        )
+        for part in (older, kept) if not part.empty
+    ]
+    df = pd.concat(parts, ignore_index=True) if parts else older
+    df.attrs["seen"] = older.attrs["seen"] + recent.attrs["seen"]
+    df.attrs["bad_lines"] = older.attrs["bad_lines"]
+    return df
 
 #Function to train from history
-def train_from_history(history_file, model_path):
+#(recent_since: drift retrain, see sample_history; min_samples: refuse
+# to train, and so to replace the model, on fewer snapshots)
+def train_from_history(history_file, model_path, sample_size=SAMPLE_SIZE,
+                       recent_since=None, recent_share=0.25, thresholds=None,
+                       min_samples=1):
 
     # Complete training pipeline:
-    # Load history -> Prepare data -> Train model -> Save model
-    
-    df = load_history(history_file)
+    # Sample history -> Prepare data -> Train model -> Save model
+
+    df = sample_history(
+        history_file, sample_size, recent_since, recent_share, thresholds
+    )
+    if df.attrs["bad_lines"] > 0:
+        logger.warning(
+            "Skipped %s invalid JSON line(s) in %s",
+            df.attrs["bad_lines"], history_file
+        )
+    if len(df) < max(min_samples, 1):
+        raise ValueError(
+            f"Only {len(df)} snapshot(s) to train on in {history_file}, "
+            f"need {max(min_samples, 1)}"
+        )
+    logger.info(
+        "Training on %s of %s snapshot(s)", len(df), df.attrs["seen"]
+    )
     df = prepare_df(df)
 
     features = get_features(df)
 
-    model = train_model(features)
+    model = train_model(features, get_sample_weights(df))
 
     df = detect_anomalies(
         model,
@@ -85,6 +210,10 @@ def train_from_history(history_file, model_path):
 
     save_model(model, model_path)
 
+    # Feature distribution the drift monitor compares live data with,
+    # from the same training set
+    save_reference(model, features, model_path)
+
     return model
 
 #Main logic
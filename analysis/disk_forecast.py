@@ -0,0 +1,401 @@
+import argparse
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from analysis.anomaly_retrain import load_history
+from utils.config_loader import load_config
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Disk-full forecasting
+#
+# Purpose:
+# Disk percent is a slow, mostly monotonic signal. The outages it
+# causes are predictable long before IsolationForest sees anything
+# unusual, so each (server, mount point) series gets its own
+# least-squares line over a sliding time window:
+#
+#   slope = (n*Sty - St*Sy) / (n*Stt - St^2)
+#
+# The sums are maintained incrementally (add on arrival, subtract on
+# eviction), so every sample costs O(1) and the whole history costs
+# O(n) in backfill mode.
+#
+# Flow:
+# Snapshot (disk + disks)
+# ↓
+# Update per-mount running sums
+# ↓
+# Extrapolate fitted level to capacity
+# ↓
+# disk_forecast event (anomaly_events.jsonl)
+
+
+def parse_timestamp(value):
+    return datetime.strptime(value, TIMESTAMP_FORMAT).timestamp()
+
+
+# Old history rows only carry the root filesystem in "disk".
+# Newer rows also carry "disks": {mount point: percent}.
+# Series owner for a snapshot's disks: cgroup snapshots of one node all
+# carry the node's "/" and name it in disk_host, so they share a series.
+def disk_server(snapshot):
+    return snapshot.get("disk_host") or snapshot["server"]
+
+
+def snapshot_disks(snapshot):
+    disks = snapshot.get("disks")
+    if isinstance(disks, dict) and disks:
+        return disks
+    return {"/": snapshot["disk"]}
+
+
+class DiskForecaster:
+
+    def __init__(self, window=21600, min_samples=12, horizon=86400,
+                 realert=3600, capacity=100):
+        self.window = window
+        self.min_samples = min_samples
+        self.horizon = horizon
+        self.realert = realert
+        self.capacity = capacity
+        self._series = {}
+
+    # Times are stored relative to an anchor inside the window so the
+    # squared sums stay small. The anchor moves (and the sums are
+    # rebuilt from the deque) once per window's worth of evictions,
+    # which keeps the update amortised O(1) and bounds float drift.
+    def _new_state(self, t):
+        return {
+            "points": deque(),
+            "anchor": t,
+            "n": 0, "st": 0.0, "sy": 0.0, "stt": 0.0, "sty": 0.0,
+            "evicted": 0,
+            "last_alert": None,
+        }
+
+    def _add(self, state, t, y):
+        x = t - state["anchor"]
+        state["n"] += 1
+        state["st"] += x
+        state["sy"] += y
+        state["stt"] += x * x
+        state["sty"] += x * y
+
+    def _remove(self, state, t, y):
+        x = t - state["anchor"]
+        state["n"] -= 1
+        state["st"] -= x
+        state["sy"] -= y
+        state["stt"] -= x * x
+        state["sty"] -= x * y
+
+    def _rebuild(self, state):
+        points = state["points"]
+        state["anchor"] = points[0][0] if points else state["anchor"]
+        state["n"] = 0
+        state["st"] = state["sy"] = state["stt"] = state["sty"] = 0.0
+        for t, y in points:
+            self._add(state, t, y)
+        state["evicted"] = 0
+
+    def _fit(self, state, t_now):
+        n = state["n"]
+        if n < self.min_samples:
+            return None
+
+        denom = n * state["stt"] - state["st"] ** 2
+        if denom <= 0:
+            return None
+
+        slope = (n * state["sty"] - state["st"] * state["sy"]) / denom
+        intercept = (state["sy"] - slope * state["st"]) / n
+        level = intercept + slope * (t_now - state["anchor"])
+        return slope, level
+
+    def observe(self, server, mount, t, y):
+        key = (server, mount)
+        state = self._series.get(key)
+        if state is None:
+            state = self._new_state(t)
+            self._series[key] = state
+
+        points = state["points"]
+        points.append((t, y))
+        self._add(state, t, y)
+
+        while points and points[0][0] < t - self.window:
+            old_t, old_y = points.popleft()
+            self._remove(state, old_t, old_y)
+            state["evicted"] += 1
+
+        if state["evicted"] >= max(len(points), 1):
+            self._rebuild(state)
+
+        return self._fit(state, t)
+
+    # Feed one live snapshot and return any disk_forecast events.
+    def update(self, snapshot):
+        t = parse_timestamp(snapshot["timestamp"])
+        server = disk_server(snapshot)
+        events = []
+
+        for mount, percent in snapshot_disks(snapshot).items():
+            state = self._series.get((server, mount))
+            if (state is not None and state["points"]
+                    and state["points"][-1][0] >= t):
+                # already fed this cycle by another cgroup of the host
+                continue
+            fit = self.observe(server, mount, t, float(percent))
+            if fit is None:
+                continue
+
+            slope, level = fit
+            if slope <= 0:
+                continue
+
+            eta = max(self.capacity - level, 0.0) / slope
+            if eta > self.horizon:
+                continue
+
+            state = self._series[(server, mount)]
+            last = state["last_alert"]
+            if last is not None and t - last < self.realert:
+                continue
+            state["last_alert"] = t
+
+            events.append(
+                build_event(snapshot["timestamp"], server, mount,
+                            percent, slope, eta)
+            )
+
+        return events
+
+
+def build_event(timestamp, server, mount, percent, slope, eta):
+    full_at = (
+        datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+        + timedelta(seconds=float(eta))
+    )
+    return {
+        "timestamp": timestamp,
+        "event": "disk_forecast",
+        "server": server,
+        "mount": mount,
+        "disk": float(percent),
+        "slope_per_hour": round(float(slope) * 3600, 4),
+        "eta_seconds": int(eta),
+        "predicted_full_at": full_at.strftime(TIMESTAMP_FORMAT),
+    }
+
+
+def forecaster_from_config(config):
+    section = config["forecast"]
+    return DiskForecaster(
+        window=section["window"],
+        min_samples=section["min_samples"],
+        horizon=section["horizon"],
+        realert=section["realert"],
+        capacity=section["capacity"],
+    )
+
+
+# Backfill helpers
+#
+# Purpose:
+# Compute the same forecast for every row of an existing history in
+# one vectorised pass. Rolling sums are taken per (server, mount)
+# over the same time window the live forecaster uses: [t - window, t],
+# both ends included, as observe() only evicts points older than
+# t - window. Alerts go through the live re-alert throttle, so the
+# backfill emits the events the live forecaster would have.
+
+def explode_disks(df):
+    frames = []
+    servers = df["server"]
+    if "disk_host" in df.columns:
+        servers = df["disk_host"].where(df["disk_host"].notna(), servers)
+
+    if "disks" in df.columns:
+        has_disks = df["disks"].map(lambda d: isinstance(d, dict) and bool(d))
+    else:
+        has_disks = pd.Series(False, index=df.index)
+
+    if has_disks.any():
+        wide = pd.DataFrame(
+            df.loc[has_disks, "disks"].tolist(),
+            index=df.index[has_disks]
+        )
+        stacked = wide.stack()
+        stacked.index.names = ["row", "mount"]
+        stacked = stacked.rename("disk").reset_index()
+        rows = stacked["row"].to_numpy()
+        stacked["timestamp"] = df["timestamp"].to_numpy()[
+            df.index.get_indexer(rows)
+        ]
+        stacked["server"] = servers.to_numpy()[
+            df.index.get_indexer(rows)
+        ]
+        frames.append(stacked[["timestamp", "server", "mount", "disk"]])
+
+    legacy = df.loc[~has_disks, ["timestamp", "disk"]].copy()
+    legacy["server"] = servers[~has_disks]
+    legacy["mount"] = "/"
+    frames.append(legacy[["timestamp", "server", "mount", "disk"]])
+
+    long = pd.concat(frames, ignore_index=True)
+    long["timestamp"] = pd.to_datetime(long["timestamp"])
+    long["disk"] = long["disk"].astype(float)
+    # one point per host and time, however many cgroups reported it
+    return long.drop_duplicates(["server", "mount", "timestamp"])
+
+
+def backfill_forecasts(df, window=21600, min_samples=12, capacity=100):
+    long = explode_disks(df)
+    long = long.sort_values(["server", "mount", "timestamp"],
+                            kind="mergesort").reset_index(drop=True)
+
+    # Seconds relative to each series' first sample.
+    epoch = (
+        (long["timestamp"] - pd.Timestamp(0)).dt.total_seconds().to_numpy()
+    )
+    first = long.groupby(["server", "mount"])["timestamp"].transform("min")
+    x = (long["timestamp"] - first).dt.total_seconds().to_numpy()
+    y = long["disk"].to_numpy()
+
+    sums = pd.DataFrame({
+        "timestamp": long["timestamp"],
+        "server": long["server"],
+        "mount": long["mount"],
+        "n": np.ones(len(long)),
+        "st": x,
+        "sy": y,
+        "stt": x * x,
+        "sty": x * y,
+    }).set_index("timestamp")
+
+    rolled = (
+        sums.groupby(["server", "mount"], sort=True)[
+            ["n", "st", "sy", "stt", "sty"]
+        ]
+        .rolling(f"{int(window)}s", closed="both")
+        .sum()
+    )
+
+    n = rolled["n"].to_numpy()
+    st = rolled["st"].to_numpy()
+    sy = rolled["sy"].to_numpy()
+    stt = rolled["stt"].to_numpy()
+    sty = rolled["sty"].to_numpy()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denom = n * stt - st * st
+        slope = (n * sty - st * sy) / denom
+        intercept = (sy - slope * st) / n
+        level = intercept + slope * x
+        eta = np.maximum(capacity - level, 0.0) / slope
+
+    valid = (n >= min_samples) & (denom > 0) & (slope > 0)
+
+    long["epoch"] = epoch
+    long["slope_per_hour"] = np.where(valid, slope * 3600, np.nan)
+    long["eta_seconds"] = np.where(valid, eta, np.nan)
+    return long
+
+
+# Pick alert rows from a backfill frame. As live: a series alerts,
+# then stays quiet until `realert` seconds after that alert.
+def backfill_events(forecasts, horizon=86400, realert=3600):
+    alerts = forecasts[forecasts["eta_seconds"] <= horizon]
+    picked = []
+    for _, series in alerts.groupby(["server", "mount"], sort=False):
+        epochs = series["epoch"].to_numpy()
+        i = 0
+        while i < len(epochs):
+            picked.append(series.index[i])
+            # next candidate at least `realert` seconds later
+            i = max(
+                i + 1, int(np.searchsorted(epochs, epochs[i] + realert))
+            )
+    alerts = alerts.loc[picked]
+
+    events = []
+    for row in alerts.itertuples(index=False):
+        events.append(
+            build_event(
+                row.timestamp.strftime(TIMESTAMP_FORMAT),
+                row.server,
+                row.mount,
+                row.disk,
+                row.slope_per_hour / 3600,
+                row.eta_seconds,
+            )
+        )
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Backfill disk-full forecasts over snapshot history."
+    )
+    parser.add_argument("--history", help="history JSONL (default: config)")
+    parser.add_argument("--output", help="events JSONL (default: config)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report events without writing them")
+    args = parser.parse_args()
+
+    config = load_config()
+    section = config["forecast"]
+    BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+    history_file = args.history or os.path.join(
+        BASE_DIR, config["paths"]["history_file"]
+    )
+    output_file = args.output or os.path.join(
+        BASE_DIR, config["paths"]["anomaly_file"]
+    )
+
+    df = load_history(history_file)
+    if df.empty:
+        logger.warning("No history available for disk forecast backfill.")
+        return
+
+    forecasts = backfill_forecasts(
+        df,
+        window=section["window"],
+        min_samples=section["min_samples"],
+        capacity=section["capacity"],
+    )
+    events = backfill_events(
+        forecasts,
+        horizon=section["horizon"],
+        realert=section["realert"],
+    )
+
+    logger.info(
+        "Disk forecast backfill: %s points, %s events",
+        len(forecasts), len(events)
+    )
+
+    if args.dry_run:
+        for event in events:
+            print(json.dumps(event))
+        return
+
+    with open(output_file, "a") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+    logger.info("Disk forecast events appended to %s", output_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import json
+import os
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+METRICS = ("cpu", "mem", "disk")
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Drift monitoring
+#
+# Purpose:
+# Retrain when the data has moved away from what the model was
+# trained on, instead of on a fixed schedule or never.
+#
+# Flow:
+# training → reference: per-metric fixed-bin histogram (0-100 %) and
+#            the share of training samples the model flags
+#            (saved as <model>.reference.json)
+# ↓
+# live samples → sliding window of the last `window` samples; bin
+#                counts are updated incrementally (one add, one
+#                remove per sample)
+# ↓
+# every `check_every` samples:
+#   PSI(reference, window) per metric
+#   anomaly rate in the window vs. the training rate
+# ↓
+# retrain if max PSI ≥ psi_threshold, at most once per `cooldown`
+# seconds after the last retrain started; every check is logged
+#
+# A high anomaly rate (≥ rate_factor × training rate) alone is reported
+# but does not retrain: that is what a sustained incident looks like,
+# and retraining on it would teach the model the incident is normal.
+#
+# PSI (population stability index) = Σ (p − q) · ln(p / q) over bins.
+# Rule of thumb: < 0.1 stable, 0.1 – 0.25 moderate, > 0.25 shifted.
+#
+# Without a reference file (model trained before this existed) the
+# first full window is taken as the reference.
+#
+# After a drift retrain:
+# the new model is trained on the whole history with the unflagged
+# samples since window_start() mixed in (analysis/anomaly_training.py),
+# its reference comes from that same training set, and reset() empties
+# the live window, so the next check compares only samples scored by
+# the new model against the new reference.
+
+
+def reference_path_for(model_path):
+    return os.path.splitext(model_path)[0] + ".reference.json"
+
+
+def bin_indices(values, bins):
+    values = np.asarray(values, dtype=float)
+    index = (values * bins / 100.0).astype(int)
+    return np.clip(index, 0, bins - 1)
+
+
+def histogram(values, bins):
+    return np.bincount(bin_indices(values, bins), minlength=bins)
+
+
+def psi(reference, current, smoothing=0.5):
+    # additive smoothing keeps empty bins finite
+    p = np.asarray(reference, dtype=float) + smoothing
+    q = np.asarray(current, dtype=float) + smoothing
+    p /= p.sum()
+    q /= q.sum()
+    return float(np.sum((p - q) * np.log(p / q)))
+
+
+def build_reference(features, flags, bins=20):
+    """Reference distribution of a training set (features: DataFrame)."""
+    return {
+        "bins": bins,
+        "histograms": {
+            m: histogram(features[m].to_numpy(), bins).tolist()
+            for m in METRICS
+        },
+        "anomaly_rate": float(np.mean(flags)) if len(flags) else 0.0,
+        "samples": int(len(features)),
+        "created_at": datetime.now().strftime(TIMESTAMP_FORMAT),
+    }
+
+
+def save_reference(model, features, model_path, bins=20):
+    """Write <model>.reference.json for a freshly trained model."""
+    flags = model.predict(features) == -1
+    path = reference_path_for(model_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(build_reference(features, flags, bins), f)
+    os.replace(tmp, path)
+    return path
+
+
+def load_reference(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class DriftMonitor:
+
+    def __init__(self, reference=None, bins=20, window=720, check_every=60,
+                 psi_threshold=0.25, rate_factor=3.0, min_rate=0.01,
+                 cooldown=3600):
+        self.bins = bins
+        self.window = window
+        self.check_every = check_every
+        self.psi_threshold = psi_threshold
+        self.rate_factor = rate_factor
+        # floor for the training anomaly rate, so a model that flagged
+        # nothing in training does not retrain on the first anomaly
+        self.min_rate = min_rate
+        self.cooldown = cooldown
+        self._samples = deque()
+        self._counts = {m: np.zeros(bins, dtype=np.int64) for m in METRICS}
+        self._anomalies = 0
+        self._since_check = 0
+        self._last_retrain = None
+        self.set_reference(reference)
+
+    def set_reference(self, reference):
+        if reference is not None and reference.get("bins") != self.bins:
+            # histogram resolution changed; rebuild from live data
+            reference = None
+        self.reference = reference
+
+    def _reference_from_window(self):
+        rate = self._anomalies / max(len(self._samples), 1)
+        return {
+            "bins": self.bins,
+            "histograms": {m: self._counts[m].tolist() for m in METRICS},
+            "anomaly_rate": rate,
+            "samples": len(self._samples),
+            "created_at": datetime.now().strftime(TIMESTAMP_FORMAT),
+        }
+
+    def window_start(self):
+        """Timestamp of the oldest sample in the live window, or None."""
+        return self._samples[0][2] if self._samples else None
+
+    def reset(self):
+        """Empty the live window (after a model swap)."""
+        self._samples.clear()
+        for counts in self._counts.values():
+            counts[:] = 0
+        self._anomalies = 0
+        self._since_check = 0
+
+    def _bin(self, value):
+        return min(max(int(value * self.bins / 100.0), 0), self.bins - 1)
+
+    # Feed one scored sample. Returns a decision dict when a check ran,
+    # otherwise None.
+    def observe(self, snapshot, anomalous, now):
+        entry = (
+            tuple(self._bin(snapshot[m]) for m in METRICS),
+            bool(anomalous),
+            snapshot.get("timestamp"),
+        )
+        self._samples.append(entry)
+        for m, index in zip(METRICS, entry[0]):
+            self._counts[m][index] += 1
+        self._anomalies += entry[1]
+
+        if len(self._samples) > self.window:
+            old_bins, old_flag, _ = self._samples.popleft()
+            for m, index in zip(METRICS, old_bins):
+                self._counts[m][index] -= 1
+            self._anomalies -= old_flag
+
+        self._since_check += 1
+        if len(self._samples) < self.window:
+            return None
+        if self.reference is None:
+            self.reference = self._reference_from_window()
+            return {"retrain": False, "reason": "reference taken from live data"}
+        if self._since_check < self.check_every:
+            return None
+        self._since_check = 0
+        return self.check(now)
+
+    def check(self, now):
+        scores = {
+            m: round(psi(self.reference["histograms"][m], self._counts[m]), 4)
+            for m in METRICS
+        }
+        rate = self._anomalies / max(len(self._samples), 1)
+        expected = max(self.reference["anomaly_rate"], self.min_rate)
+
+        reasons = []
+        worst = max(scores, key=scores.get)
+        shifted = scores[worst] >= self.psi_threshold
+        if shifted:
+            reasons.append(f"{worst} PSI {scores[worst]} >= {self.psi_threshold}")
+        if rate >= self.rate_factor * expected:
+            reasons.append(
+                f"anomaly rate {rate:.3f} >= {self.rate_factor} x {expected:.3f}"
+            )
+
+        decision = {
+            "psi": scores,
+            "anomaly_rate": round(rate, 4),
+            "expected_rate": round(expected, 4),
+            "retrain": False,
+        }
+        if not reasons:
+            decision["reason"] = "within thresholds"
+        elif not shifted:
+            decision["reason"] = (
+                reasons[0] + " without a distribution shift; not retraining"
+            )
+        elif (self._last_retrain is not None
+              and now - self._last_retrain < self.cooldown):
+            decision["reason"] = "cooldown: " + "; ".join(reasons)
+        else:
+            decision["retrain"] = True
+            decision["reason"] = "; ".join(reasons)
+        return decision
+
+    def retrain_started(self, now):
+        """Start the cooldown; call when a retrain actually starts."""
+        self._last_retrain = now
+
+
+def monitor_from_config(config, model_path):
+    section = config["drift"]
+    return DriftMonitor(
+        reference=load_reference(reference_path_for(model_path)),
+        bins=section["bins"],
+        window=section["window"],
+        check_every=section["check_every"],
+        psi_threshold=section["psi_threshold"],
+        rate_factor=section["rate_factor"],
+        min_rate=section["min_rate"],
+        cooldown=section["cooldown"],
+    )
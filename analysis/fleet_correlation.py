@@ -0,0 +1,436 @@
+import argparse
+import json
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from analysis.parallel_ingest import load_history_parallel
+from analysis.model_format import model_fingerprint
+from analysis.threshold_calibration import (
+    fill_scores, load_thresholds, model_written_at
+)
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+METRICS = ("cpu", "mem", "disk")
+
+# Fleet-wide correlated anomalies
+#
+# Purpose:
+# Each host is scored on its own, so one flaky VM and a bad deploy
+# hitting 300 hosts at once look the same in anomaly_events.jsonl.
+# This looks across hosts for anomalies that happen together.
+#
+# Flow:
+# history (all servers), anomalous = score < threshold(server, hour)
+# ↓
+# optional since/until cut, then the span is processed in chunks of
+# `chunk_bins` bins, each overlapping the next by `window` bins so
+# every sliding window lies wholly inside one chunk:
+# ↓
+# host × time matrices per chunk, time cut into `step`-second bins:
+#   metrics: mean per bin (NaN where the host reported nothing)
+#   flags:   any anomalous sample in the bin
+#   (np.bincount over flat host*T+bin indices; no per-host loops)
+# ↓
+# sliding windows of `window` bins, every `stride` bins:
+#   active[h, w] = host anomalous anywhere in the window
+#   (cumulative sums along time, one subtraction for all windows)
+# ↓
+# per window with at least min_hosts active hosts:
+#   fleet:   active share ≥ fleet_fraction, and more active hosts than
+#            expected → one incident, all active
+#   cluster: otherwise, correlation of the active hosts' metric series
+#            within the window (z-scored, one matrix product per
+#            metric; series that barely move are left out); hosts
+#            linked when any metric correlates ≥ corr_threshold;
+#            connected components of ≥ min_hosts hosts
+# ↓
+# clusters in consecutive windows that share hosts are merged into one
+# incident; records go to fleet_incidents.jsonl
+#
+# "Expected" is the mean number of active hosts per window over the
+# whole period, scaled by excess_factor: background flakiness across a
+# big fleet stays below it, a simultaneous event does not. It takes a
+# first pass over the chunks on the flag matrices alone. Clusters
+# rely on correlation instead, so `window` should span enough bins
+# (20 by default) for chance correlations ≥ corr_threshold to be rare.
+#
+# Memory is hosts × chunk bins × 4 bytes per metric, whatever the
+# length of the history: 2 000 hosts and a one-day chunk at step 30 is
+# about 70 MB for all three metrics. The results do not depend on
+# chunk_bins.
+
+MAX_LISTED_HOSTS = 50
+
+# Correlation is scale-free: two disks filling by 0.01 % an hour
+# correlate perfectly. A series has to move by at least this much
+# (standard deviation in percentage points within the window) to take
+# part.
+MIN_MOVEMENT = 1.0
+
+# Bins per chunk (a day at the default step of 30 s).
+CHUNK_BINS = 2880
+
+
+def between(df, flags=None, since=None, until=None):
+    """Rows (and their flags, if given) with since <= timestamp < until."""
+    if flags is not None:
+        flags = np.asarray(flags, dtype=bool)
+    if since is None and until is None:
+        return df, flags
+    timestamps = pd.to_datetime(df["timestamp"])
+    keep = np.ones(len(df), dtype=bool)
+    if since is not None:
+        keep &= (timestamps >= pd.Timestamp(since)).to_numpy()
+    if until is not None:
+        keep &= (timestamps < pd.Timestamp(until)).to_numpy()
+    return df[keep], None if flags is None else flags[keep]
+
+
+def _binned(df, flags, step):
+    # rows sorted by bin, so a chunk is one searchsorted slice
+    codes, hosts = pd.factorize(df["server"], sort=True)
+    seconds = (
+        pd.to_datetime(df["timestamp"]).to_numpy("datetime64[s]")
+        .astype(np.int64)
+    )
+    bins = seconds // step
+    order = np.argsort(bins, kind="stable")
+    return {
+        "hosts": np.asarray(hosts),
+        "codes": codes[order].astype(np.int64),
+        "bins": bins[order],
+        "flags": np.asarray(flags, dtype=float)[order],
+        "values": {
+            metric: df[metric].to_numpy(dtype=float)[order]
+            for metric in METRICS
+        },
+    }
+
+
+def _matrices(binned, first, n_bins, metrics=True):
+    """(metric matrices or None, flag matrix, present matrix) for bins
+    [first, first + n_bins)."""
+    lo, hi = np.searchsorted(binned["bins"], [first, first + n_bins])
+    n_hosts = len(binned["hosts"])
+    flat = binned["codes"][lo:hi] * n_bins + (binned["bins"][lo:hi] - first)
+
+    size = n_hosts * n_bins
+    counts = np.bincount(flat, minlength=size)
+    present = (counts > 0).reshape(n_hosts, n_bins)
+    flagged = np.bincount(
+        flat, weights=binned["flags"][lo:hi], minlength=size
+    )
+    flag_matrix = (flagged > 0).reshape(n_hosts, n_bins)
+    if not metrics:
+        return None, flag_matrix, present
+
+    matrices = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for metric in METRICS:
+            sums = np.bincount(
+                flat, weights=binned["values"][metric][lo:hi], minlength=size
+            )
+            matrices[metric] = (sums / counts).astype(np.float32).reshape(
+                n_hosts, n_bins
+            )
+    return matrices, flag_matrix, present
+
+
+def align(df, flags, step=60, since=None, until=None):
+    """Host × time-bin matrices from a history frame, over the whole
+    span (or since/until); detect() builds them a chunk at a time.
+
+    Returns (hosts, bin start epochs, {metric: float32 matrix},
+    flag matrix (bool), present matrix (bool)).
+    """
+    df, flags = between(df, flags, since, until)
+    binned = _binned(df, flags, step)
+    first = binned["bins"][0]
+    n_bins = int(binned["bins"][-1] - first) + 1
+    matrices, flag_matrix, present = _matrices(binned, first, n_bins)
+    epochs = (first + np.arange(n_bins)) * step
+    return binned["hosts"], epochs, matrices, flag_matrix, present
+
+
+def window_activity(flag_matrix, present, window, stride):
+    """active (hosts × windows) and reporting (hosts × windows) masks."""
+    n_bins = flag_matrix.shape[1]
+    starts = np.arange(0, max(n_bins - window, 0) + 1, stride)
+    ends = np.minimum(starts + window, n_bins)
+
+    def per_window(matrix):
+        csum = np.zeros((matrix.shape[0], n_bins + 1), dtype=np.int32)
+        np.cumsum(matrix, axis=1, out=csum[:, 1:])
+        return csum[:, ends] - csum[:, starts]
+
+    return starts, ends, per_window(flag_matrix) > 0, per_window(present) > 0
+
+
+def _zscore(values):
+    # rows: hosts; missing bins take the host's window mean
+    mean = np.nanmean(values, axis=1, keepdims=True)
+    values = np.where(np.isnan(values), mean, values)
+    values = values - values.mean(axis=1, keepdims=True)
+    std = values.std(axis=1, keepdims=True)
+    return np.divide(
+        values, std, out=np.zeros_like(values), where=std >= MIN_MOVEMENT
+    )
+
+
+def correlate(matrices, rows, start, end):
+    """Pairwise correlation of `rows` per metric within [start, end)."""
+    result = {}
+    with np.errstate(invalid="ignore"):
+        for metric in METRICS:
+            z = _zscore(matrices[metric][rows, start:end].astype(np.float64))
+            result[metric] = z @ z.T / max(end - start, 1)
+    return result
+
+
+def find_clusters(matrices, active_rows, start, end, corr_threshold,
+                  min_hosts):
+    """Groups of active hosts whose metrics moved together."""
+    corr = correlate(matrices, active_rows, start, end)
+    linked = np.zeros((len(active_rows), len(active_rows)), dtype=bool)
+    for values in corr.values():
+        linked |= values >= corr_threshold
+    np.fill_diagonal(linked, False)
+
+    n, labels = connected_components(csr_matrix(linked), directed=False)
+    sizes = np.bincount(labels, minlength=n)
+    clusters = []
+    for label in np.flatnonzero(sizes >= min_hosts):
+        members = np.flatnonzero(labels == label)
+        # the metric that ties the cluster together best
+        strength = {
+            metric: float(values[np.ix_(members, members)][
+                ~np.eye(len(members), dtype=bool)
+            ].mean())
+            for metric, values in corr.items()
+        }
+        metric = max(strength, key=strength.get)
+        clusters.append((
+            active_rows[members], metric, round(strength[metric], 3)
+        ))
+    return clusters
+
+
+def _format(epoch):
+    return pd.Timestamp(int(epoch), unit="s").strftime(TIMESTAMP_FORMAT)
+
+
+def _record(incident, hosts):
+    # most persistent hosts first; one-window members are often
+    # unrelated flaky hosts that happened to overlap
+    order = sorted(
+        incident["hosts"],
+        key=lambda h: (-incident["participation"][h], h)
+    )
+    members = hosts[order]
+    record = {
+        "timestamp": _format(incident["end"]),
+        "event": "fleet_incident",
+        "incident_id": f"fleet-{int(incident['start'])}-{len(members)}",
+        "scope": incident["scope"],
+        "started_at": _format(incident["start"]),
+        "ended_at": _format(incident["end"]),
+        "duration": int(incident["end"] - incident["start"]),
+        "size": len(members),
+        "peak_size": incident["peak_size"],
+        "peak_fraction": round(float(incident["peak_fraction"]), 4),
+        "windows": incident["windows"],
+        "hosts": members[:MAX_LISTED_HOSTS].tolist(),
+    }
+    if len(members) > MAX_LISTED_HOSTS:
+        record["hosts_truncated"] = True
+    if incident["metric"] is not None:
+        record["metric"] = incident["metric"]
+        record["correlation"] = incident["correlation"]
+    return record
+
+
+def _chunks(binned, window, stride, chunk_bins):
+    """(first bin, bins, first window index, windows) per chunk.
+
+    Chunks start on a multiple of `stride` and run `window` bins past
+    their last window start, so their windows are exactly the ones of
+    the unchunked span.
+    """
+    first = binned["bins"][0]
+    n_bins = int(binned["bins"][-1] - first) + 1
+    n_windows = max(n_bins - window, 0) // stride + 1
+    per_chunk = max(chunk_bins // stride, 1)
+    for w0 in range(0, n_windows, per_chunk):
+        count = min(per_chunk, n_windows - w0)
+        begin = w0 * stride
+        span = min((count - 1) * stride + window, n_bins - begin)
+        yield first + begin, span, w0, count
+
+
+def detect(df, flags, step=30, window=20, stride=10, min_hosts=3,
+           corr_threshold=0.8, fleet_fraction=0.2, excess_factor=3.0,
+           since=None, until=None, chunk_bins=CHUNK_BINS):
+    """Cluster-level incident records for a multi-host history frame."""
+    df, flags = between(df, flags, since, until)
+    if df.empty:
+        return []
+
+    binned = _binned(df, flags, step)
+    hosts = binned["hosts"]
+
+    # pass 1: active hosts per window, for the fleet-wide expectation
+    n_active = []
+    for first, span, _, count in _chunks(binned, window, stride, chunk_bins):
+        _, flag_matrix, present = _matrices(binned, first, span, False)
+        _, _, active, _ = window_activity(flag_matrix, present, window, stride)
+        n_active.append(active[:, :count].sum(axis=0))
+    n_active = np.concatenate(n_active)
+    expected = n_active.mean() if len(n_active) else 0.0
+    fleet_floor = max(min_hosts, excess_factor * expected)
+
+    # pass 2: incidents, chunk by chunk
+    # a gap of up to one window still continues an incident
+    gap = max(window // stride, 1)
+    incidents = []
+    for first, span, w0, count in _chunks(binned, window, stride, chunk_bins):
+        if not (n_active[w0:w0 + count] >= min_hosts).any():
+            continue
+        matrices, flag_matrix, present = _matrices(binned, first, span)
+        epochs = (first + np.arange(span)) * step
+        starts, ends, active, reporting = window_activity(
+            flag_matrix, present, window, stride
+        )
+        n_reporting = np.maximum(reporting.sum(axis=0), 1)
+
+        for local in np.flatnonzero(n_active[w0:w0 + count] >= min_hosts):
+            w = w0 + local
+            rows = np.flatnonzero(active[:, local])
+            fraction = len(rows) / n_reporting[local]
+            start, end = starts[local], ends[local]
+            if fraction >= fleet_fraction and len(rows) >= fleet_floor:
+                found = [(rows, None, None, "fleet")]
+            else:
+                found = [
+                    (members, metric, strength, "cluster")
+                    for members, metric, strength in find_clusters(
+                        matrices, rows, start, end, corr_threshold, min_hosts
+                    )
+                ]
+
+            # continue recent incidents that share at least half the hosts
+            for members, metric, strength, scope in found:
+                members = set(members.tolist())
+                match = next(
+                    (i for i in reversed(incidents)
+                     if i["last_window"] >= w - gap
+                     and len(i["hosts"] & members) * 2
+                     >= min(len(i["hosts"]), len(members))),
+                    None
+                )
+                if match is None:
+                    match = {
+                        "start": epochs[start], "hosts": set(), "windows": 0,
+                        "participation": Counter(), "peak_size": 0,
+                        "peak_fraction": 0.0, "scope": scope,
+                        "metric": metric, "correlation": strength,
+                    }
+                    incidents.append(match)
+                match["hosts"] |= members
+                match["participation"].update(members)
+                match["end"] = epochs[end - 1] + step
+                match["last_window"] = w
+                match["windows"] += 1
+                match["peak_size"] = max(match["peak_size"], len(members))
+                match["peak_fraction"] = max(
+                    match["peak_fraction"],
+                    len(members) / n_reporting[local]
+                )
+                if scope == "fleet":
+                    match["scope"] = "fleet"
+
+    return [_record(i, hosts) for i in incidents]
+
+
+def anomaly_flags(df, thresholds):
+    hours = pd.to_datetime(df["timestamp"]).dt.hour.to_numpy()
+    cutoff = thresholds.thresholds(df["server"].to_numpy(), hours)
+    return df["score"].to_numpy() < cutoff
+
+
+def detector_from_config(config):
+    section = config["fleet"]
+    return dict(
+        step=section["step"],
+        window=section["window"],
+        stride=section["stride"],
+        min_hosts=section["min_hosts"],
+        corr_threshold=section["corr_threshold"],
+        fleet_fraction=section["fleet_fraction"],
+        excess_factor=section["excess_factor"],
+    )
+
+
+def main():
+    from agents.realtime_anomaly_agent import load_model
+    from utils.config_loader import load_config
+    from utils.sqlite_store import history_source
+
+    config = load_config()
+
+    parser = argparse.ArgumentParser(
+        description="Find anomalies that hit many hosts at once."
+    )
+    parser.add_argument("--history", default=history_source(config, BASE_DIR),
+                        help="JSONL history or SQLite store")
+    parser.add_argument("--model", default=os.path.join(
+        BASE_DIR, config["paths"]["model_path"]),
+        help="scores the rows it did not score itself")
+    parser.add_argument("--thresholds", default=os.path.join(
+        BASE_DIR, config["scoring"]["thresholds_file"]))
+    parser.add_argument("--output", default=os.path.join(
+        BASE_DIR, config["fleet"]["output_file"]))
+    parser.add_argument("--since", help="first timestamp to analyse")
+    parser.add_argument("--until", help="analyse up to this timestamp")
+    parser.add_argument("--chunk-bins", type=int, default=CHUNK_BINS,
+                        help="time bins held in memory at once")
+    args = parser.parse_args()
+
+    df = load_history_parallel(args.history)
+    if not df.empty:
+        df, _ = between(df, since=args.since, until=args.until)
+    if df.empty:
+        print("No history to analyse.")
+        return
+    model = load_model(args.model)
+    df = fill_scores(df, model, before=model_written_at(args.model))
+
+    flags = anomaly_flags(
+        df, load_thresholds(args.thresholds, model_fingerprint(model))
+    )
+    records = detect(
+        df, flags, chunk_bins=args.chunk_bins, **detector_from_config(config)
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    fleet = sum(r["scope"] == "fleet" for r in records)
+    print(
+        f"{df['server'].nunique()} host(s), {int(flags.sum())} anomalous "
+        f"sample(s): {fleet} fleet-wide and {len(records) - fleet} "
+        f"cluster incident(s) written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
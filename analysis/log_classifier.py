@@ -0,0 +1,233 @@
+import argparse
+import os
+import re
+import resource
+import sys
+import time
+from collections import Counter
+
+import joblib
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_FILE = os.path.join(BASE_DIR, "models", "log_classifier_sgd.joblib")
+
+LABELS = ("info", "warning", "error", "security")
+
+# Scalable log classifier
+#
+# Purpose:
+# The legacy classifier (archive/Legacy analysis/log_classifier.py)
+# fits TF-IDF + LogisticRegression on ~50 hard-coded lines. On real
+# logs its vocabulary, and the whole training set, has to sit in
+# memory. This trains on any amount of labelled log text with fixed
+# memory.
+#
+# Flow:
+# labelled files, one "<log line>\t<label>" per line
+# ↓
+# mini-batches of `batch_size` lines, cleaned as the legacy classifier
+# cleans them
+# ↓
+# HashingVectorizer: unigrams + bigrams hashed into `n_features`
+# columns; stateless, so nothing grows with the corpus
+# ↓
+# SGDClassifier.partial_fit (logistic loss) per batch, `epochs` passes
+# ↓
+# Pipeline(hash, clf) saved with joblib; predict() takes cleaned text
+# like the legacy pipeline
+#
+# Memory is one batch plus the model (n_features × labels float64
+# weights, 32 MB at the default 2**20 features and four labels),
+# whatever the corpus size. Training reports lines/sec, peak RSS and
+# model size.
+#
+# The rule-based security override and the line cleaning follow the
+# legacy classifier, with the regexes compiled once.
+
+SECURITY_PATTERN = re.compile(
+    r"failed password|authentication failure|connection reset by .*preauth"
+    r"|password check failed|failed to authenticate|invalid user",
+    re.I,
+)
+
+_PREFIX = re.compile(r"^[A-Za-z]{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}\s+\S+\s+")
+_PROCESS = re.compile(r"\b[A-Za-z0-9_\-./]+(?:\[[0-9]+\])?:\s*")
+_IP = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b")
+_NUMBER = re.compile(r"\b\d+\b")
+_SPACE = re.compile(r"\s+")
+
+
+def clean_log_line(line, remove_numbers=False):
+    """Strip syslog prefix, process[pid]:, IPs; lowercase."""
+    line = _PREFIX.sub("", line)
+    line = _PROCESS.sub("", line)
+    line = _IP.sub(" ", line)
+    if remove_numbers:
+        line = _NUMBER.sub(" ", line)
+    return _SPACE.sub(" ", line.lower()).strip()
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def build_model(n_features=2 ** 20, alpha=1e-6):
+    return Pipeline([
+        ("hash", HashingVectorizer(
+            n_features=n_features,
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            lowercase=False,
+        )),
+        ("clf", SGDClassifier(loss="log_loss", alpha=alpha, random_state=42)),
+    ])
+
+
+def iter_labelled(paths, batch_size=10_000):
+    """Yield (texts, labels) batches from "<line>\\t<label>" files."""
+    texts = []
+    labels = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                raw, sep, label = line.rstrip("\n").rpartition("\t")
+                if not sep or label not in LABELS:
+                    continue
+                texts.append(clean_log_line(raw))
+                labels.append(label)
+                if len(texts) >= batch_size:
+                    yield texts, labels
+                    texts = []
+                    labels = []
+    if texts:
+        yield texts, labels
+
+
+def train_streaming(paths, batch_size=10_000, n_features=2 ** 20, epochs=1):
+    """Train on labelled files in mini-batches. Returns (model, stats)."""
+    model = build_model(n_features)
+    vectorizer = model.named_steps["hash"]
+    clf = model.named_steps["clf"]
+
+    counts = Counter()
+    lines = 0
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        for texts, labels in iter_labelled(paths, batch_size):
+            clf.partial_fit(vectorizer.transform(texts), labels, classes=LABELS)
+            if epoch == 0:
+                counts.update(labels)
+            lines += len(texts)
+    seconds = time.perf_counter() - start
+
+    stats = {
+        "lines": lines,
+        "seconds": round(seconds, 3),
+        "lines_per_sec": round(lines / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "model_mb": round(
+            (clf.coef_.nbytes + clf.intercept_.nbytes) / (1024 * 1024), 1
+        ) if lines else 0.0,
+        "labels": dict(counts),
+    }
+    return model, stats
+
+
+def predict_labels(model, raw_lines):
+    """Labels for raw log lines (rule override, then one batched predict)."""
+    cleaned = [clean_log_line(raw) for raw in raw_lines]
+    labels = model.predict(cleaned).tolist() if cleaned else []
+    for i, raw in enumerate(raw_lines):
+        if SECURITY_PATTERN.search(raw):
+            labels[i] = "security"
+    return cleaned, labels
+
+
+def classify_logs(model, log_file, batch_size=10_000):
+    """Classify each line of log_file; same columns as the legacy one."""
+    if not os.path.exists(log_file):
+        raise FileNotFoundError(f"Log file not found: {log_file}")
+
+    frames = []
+    batch = []
+
+    def flush():
+        cleaned, labels = predict_labels(model, batch)
+        frames.append(pd.DataFrame(
+            {"raw": batch, "cleaned": cleaned, "label": labels}
+        ))
+
+    with open(log_file, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            raw = line.rstrip("\n")
+            if not raw:
+                continue
+            batch.append(raw)
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+    if batch:
+        flush()
+
+    if not frames:
+        print("[WARN] No valid log lines found.")
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def evaluate(model, paths, batch_size=10_000):
+    """Accuracy on labelled files (streamed)."""
+    correct = total = 0
+    for texts, labels in iter_labelled(paths, batch_size):
+        preds = model.predict(texts)
+        correct += sum(p == y for p, y in zip(preds, labels))
+        total += len(labels)
+    return correct / total if total else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train the hashing + SGD log classifier on labelled logs."
+    )
+    parser.add_argument("labelled", nargs="+",
+                        help='files of "<log line>\\t<label>" lines')
+    parser.add_argument("--model", default=MODEL_FILE)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--n-features", type=int, default=2 ** 20)
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--evaluate", nargs="*", default=[],
+                        help="held-out labelled files to report accuracy on")
+    args = parser.parse_args()
+
+    model, stats = train_streaming(
+        args.labelled, args.batch_size, args.n_features, args.epochs
+    )
+    if not stats["lines"]:
+        print("No labelled lines found. Exiting.")
+        return
+
+    print(
+        f"Trained on {stats['lines']} line(s) in {stats['seconds']}s "
+        f"({stats['lines_per_sec']} lines/sec), peak RSS "
+        f"{stats['peak_rss_mb']} MB, model {stats['model_mb']} MB"
+    )
+    print(f"Label counts: {stats['labels']}")
+
+    if args.evaluate:
+        print(f"Held-out accuracy: {evaluate(model, args.evaluate):.4f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.model)), exist_ok=True)
+    joblib.dump(model, args.model)
+    print(f"✅ Log classifier saved to {args.model}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import time
+from collections import Counter
+
+import joblib
+
+from analysis.log_classifier import MODEL_FILE, predict_labels
+from analysis.parallel_ingest import split_ranges
+
+# Parallel log classification
+#
+# Purpose:
+# classify_logs runs on one core over one file. A node's journal is
+# gigabytes a day; this spreads the work over every core, across many
+# files and within large ones.
+#
+# Flow:
+# files
+# ↓
+# byte ranges: small files whole, large ones cut every `chunk_bytes`
+# on line boundaries (parallel_ingest.split_ranges)
+# ↓
+# fork pool: the model is loaded once in the parent and inherited by
+# every worker (copy-on-write, never pickled); gc.freeze() first so
+# the collector does not touch, and copy, the model's pages
+# ↓
+# worker per range: decode, predict in batches of `batch_size`, count
+# ↓
+# parent: sum per-label counts, overall and per file
+#
+# Only counts (and one example line per label) come back, never the
+# rows, so the parent's memory and the IPC volume stay small whatever
+# the input size.
+
+DEFAULT_CHUNK_BYTES = 32 * 1024 * 1024
+
+# Below this total input, classify in-process; the pool costs more
+# than it saves.
+MIN_PARALLEL_BYTES = 4 * 1024 * 1024
+
+# set in the parent before the pool forks
+_MODEL = None
+
+
+def _classify_range(task):
+    path, start, end, batch_size = task
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    counts = Counter()
+    examples = {}
+    batch = []
+
+    def flush():
+        _, labels = predict_labels(_MODEL, batch)
+        counts.update(labels)
+        for raw, label in zip(batch, labels):
+            if label not in examples:
+                examples[label] = raw
+
+    for line in data.decode("utf-8", errors="ignore").split("\n"):
+        if not line:
+            continue
+        batch.append(line)
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+
+    return {"path": path, "counts": counts, "examples": examples}
+
+
+def plan_tasks(paths, chunk_bytes=DEFAULT_CHUNK_BYTES, batch_size=10_000):
+    tasks = []
+    for path in paths:
+        size = os.path.getsize(path)
+        chunks = max(-(-size // chunk_bytes), 1)
+        for start, end in split_ranges(path, chunks):
+            tasks.append((path, start, end, batch_size))
+    # largest ranges first, so one big tail chunk does not run alone
+    tasks.sort(key=lambda t: t[2] - t[1], reverse=True)
+    return tasks
+
+
+def classify_files(model, paths, workers=None,
+                   chunk_bytes=DEFAULT_CHUNK_BYTES, batch_size=10_000):
+    """Per-label counts over every line of `paths`, on all cores."""
+    global _MODEL
+
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Log file not found: {path}")
+
+    workers = workers or os.cpu_count() or 1
+    tasks = plan_tasks(paths, chunk_bytes, batch_size)
+    total_bytes = sum(t[2] - t[1] for t in tasks)
+
+    _MODEL = model
+    start = time.perf_counter()
+    try:
+        if workers == 1 or total_bytes < MIN_PARALLEL_BYTES:
+            parts = [_classify_range(task) for task in tasks]
+        else:
+            gc.freeze()
+            try:
+                ctx = multiprocessing.get_context("fork")
+                with ctx.Pool(workers) as pool:
+                    parts = list(pool.imap_unordered(_classify_range, tasks))
+            finally:
+                gc.unfreeze()
+    finally:
+        _MODEL = None
+    seconds = time.perf_counter() - start
+
+    counts = Counter()
+    files = {path: Counter() for path in paths}
+    examples = {}
+    for part in parts:
+        counts.update(part["counts"])
+        files[part["path"]].update(part["counts"])
+        for label, raw in part["examples"].items():
+            examples.setdefault(label, raw)
+
+    lines = sum(counts.values())
+    return {
+        "counts": dict(counts),
+        "files": {path: dict(c) for path, c in files.items()},
+        "examples": examples,
+        "lines": lines,
+        "bytes": total_bytes,
+        "tasks": len(tasks),
+        "workers": workers,
+        "seconds": round(seconds, 3),
+        "lines_per_sec": round(lines / seconds, 1) if seconds > 0 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Classify log files on all cores and count labels."
+    )
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--model", default=MODEL_FILE,
+                        help="trained with analysis.log_classifier")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-mb", type=int,
+                        default=DEFAULT_CHUNK_BYTES // (1024 * 1024))
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    result = classify_files(
+        model, args.logs, args.workers, args.chunk_mb * 1024 * 1024
+    )
+
+    print("\n=== Log Classification Summary ===")
+    for label, count in sorted(result["counts"].items(), key=lambda x: -x[1]):
+        print(f"{label.upper():<8}: {count} event(s)")
+    print("=================================")
+    print(
+        f"{result['lines']} line(s), {result['bytes'] / 1e6:.1f} MB in "
+        f"{result['seconds']}s on {result['workers']} worker(s) "
+        f"({result['lines_per_sec']} lines/sec)"
+    )
+    for label in ("security", "error"):
+        if label in result["examples"]:
+            print(f"[{label.upper()} EXAMPLE] {result['examples'][label]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import json
+import multiprocessing
+import os
+import secrets
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from utils.sqlite_store import is_database, load_snapshots
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Parallel history ingest
+#
+# Purpose:
+# Years of snapshot_history.jsonl take minutes to parse on one core.
+# This splits the file into newline-aligned byte ranges and parses
+# them in a process pool.
+#
+# Flow:
+# File
+# ↓
+# Byte ranges (each boundary moved forward to the next "\n")
+# ↓
+# Worker per range: decode lines (orjson if installed, else json)
+#                   → numeric columns in a SharedMemory block
+# ↓
+# Parent: attach blocks in range order, copy into final arrays, unlink
+# ↓
+# DataFrame (timestamp, cpu, mem, disk, server)
+#
+# Only small metadata (row count, server names, bad-line count) goes
+# through pickle; the column data never does.
+#
+# Bad lines:
+# Same accounting as anomaly_retrain.load_history: undecodable lines
+# are skipped, counted and reported once. Lines that decode but lack
+# a timestamp or server, or carry non-numeric metrics, are counted as
+# bad as well since they cannot be placed in the numeric columns.
+#
+# Only the core columns are returned, plus the OPTIONAL numeric
+# fields (adaptive sampling interval, anomaly score) when any record
+# carries them; older records get NaN. Other extra fields such as
+# "disks" are dropped.
+#
+# A .db/.sqlite path is read from the SQLite store instead (one query,
+# no pool) and returned in the same shape.
+
+COLUMNS = ("timestamp", "cpu", "mem", "disk", "server")
+
+OPTIONAL = ("interval", "score")
+
+# Files smaller than this are parsed in-process; the pool costs more
+# than it saves.
+MIN_PARALLEL_BYTES = 16 * 1024 * 1024
+
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+# Per-row layout of a worker's shared block:
+# int64 timestamp (ns) | float64 cpu | float64 mem | float64 disk
+# | float64 per OPTIONAL field | int32 server
+DTYPES = (
+    (np.int64, np.float64, np.float64, np.float64)
+    + (np.float64,) * len(OPTIONAL)
+    + (np.int32,)
+)
+ROW_BYTES = sum(np.dtype(dtype).itemsize for dtype in DTYPES)
+
+
+def split_ranges(path, chunks):
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    step = max(size // max(chunks, 1), 1)
+    bounds = [0]
+    with open(path, "rb") as f:
+        offset = step
+        while offset < size:
+            f.seek(offset)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+            offset = max(position, bounds[-1]) + step
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _views(buf, rows):
+    offset = 0
+    views = []
+    for dtype in DTYPES:
+        itemsize = np.dtype(dtype).itemsize
+        views.append(np.ndarray(rows, dtype=dtype, buffer=buf, offset=offset))
+        offset += rows * itemsize
+    return views
+
+
+def _parse_lines(data):
+    timestamps, cpu, mem, disk, codes = [], [], [], [], []
+    optional = [[] for _ in OPTIONAL]
+    vocab = {}
+    bad = 0
+
+    for line in data.split(b"\n"):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = _loads(line)
+            ts = record["timestamp"]
+            server = record["server"]
+            c = float(record["cpu"])
+            m = float(record["mem"])
+            d = float(record["disk"])
+            # optional fields may be missing or null
+            extra = [record.get(name) for name in OPTIONAL]
+            extra = [np.nan if v is None else float(v) for v in extra]
+        except (ValueError, KeyError, TypeError):
+            bad += 1
+            continue
+
+        code = vocab.get(server)
+        if code is None:
+            code = vocab[server] = len(vocab)
+
+        timestamps.append(ts)
+        cpu.append(c)
+        mem.append(m)
+        disk.append(d)
+        for values, value in zip(optional, extra):
+            values.append(value)
+        codes.append(code)
+
+    try:
+        ts_array = np.array(timestamps, dtype="datetime64[ns]")
+    except ValueError:
+        ts_array = pd.to_datetime(
+            pd.Series(timestamps), errors="coerce"
+        ).to_numpy("datetime64[ns]")
+
+    # timestamps that did not parse are bad lines too
+    valid = ~np.isnat(ts_array)
+    if not valid.all():
+        bad += int((~valid).sum())
+        ts_array = ts_array[valid]
+        keep = np.flatnonzero(valid).tolist()
+        cpu, mem, disk, codes = (
+            [values[i] for i in keep] for values in (cpu, mem, disk, codes)
+        )
+        optional = [[values[i] for i in keep] for values in optional]
+
+    return (
+        ts_array.view(np.int64), cpu, mem, disk, *optional, codes,
+        list(vocab), bad
+    )
+
+
+def _parse_range(task):
+    path, start, end, name = task
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    *columns, vocab, bad = _parse_lines(data)
+    rows = len(columns[-1])
+    if rows == 0:
+        return {"shm": None, "rows": 0, "vocab": vocab, "bad": bad}
+
+    block = shared_memory.SharedMemory(
+        name=name, create=True, size=rows * ROW_BYTES
+    )
+    for view, values in zip(_views(block.buf, rows), columns):
+        view[:] = values
+    block.close()
+    # Ownership passes to the parent, which unlinks after copying.
+    resource_tracker.unregister(block._name, "shared_memory")
+    return {"shm": name, "rows": rows, "vocab": vocab, "bad": bad}
+
+
+def _merge(parts):
+    total = sum(p["rows"] for p in parts)
+    ts = np.empty(total, dtype=np.int64)
+    cpu = np.empty(total, dtype=np.float64)
+    mem = np.empty(total, dtype=np.float64)
+    disk = np.empty(total, dtype=np.float64)
+    optional = [np.empty(total, dtype=np.float64) for _ in OPTIONAL]
+    codes = np.empty(total, dtype=np.int32)
+
+    vocab = {}
+    offset = 0
+    for part in parts:
+        rows = part["rows"]
+        if rows == 0:
+            continue
+
+        remap = np.array(
+            [vocab.setdefault(name, len(vocab)) for name in part["vocab"]],
+            dtype=np.int32,
+        )
+
+        if part["shm"] is None:
+            columns = part["columns"]
+        else:
+            block = shared_memory.SharedMemory(name=part["shm"])
+            columns = _views(block.buf, rows)
+
+        end = offset + rows
+        ts[offset:end] = columns[0]
+        cpu[offset:end] = columns[1]
+        mem[offset:end] = columns[2]
+        disk[offset:end] = columns[3]
+        for i, values in enumerate(optional):
+            values[offset:end] = columns[4 + i]
+        codes[offset:end] = remap[columns[-1]]
+
+        if part["shm"] is not None:
+            del columns
+            block.close()
+            block.unlink()
+        offset = end
+
+    names = np.array(list(vocab), dtype=object)
+    df = pd.DataFrame({
+        "timestamp": ts.view("datetime64[ns]"),
+        "cpu": cpu,
+        "mem": mem,
+        "disk": disk,
+        "server": names[codes] if total else np.array([], dtype=object),
+    })
+    for name, values in zip(OPTIONAL, optional):
+        if not np.isnan(values).all():
+            df[name] = values
+    return df
+
+
+def _unlink_blocks(names):
+    # _merge unlinks what it copied; this catches the rest after a
+    # failure (the workers unregistered them from the tracker)
+    for name in names:
+        try:
+            block = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        block.close()
+        block.unlink()
+
+
+def _parse_serial(path):
+    with open(path, "rb") as f:
+        *columns, vocab, bad = _parse_lines(f.read())
+    return {
+        "shm": None,
+        "rows": len(columns[-1]),
+        "vocab": vocab,
+        "bad": bad,
+        "columns": [
+            np.asarray(values, dtype=dtype)
+            for values, dtype in zip(columns, DTYPES)
+        ],
+    }
+
+
+def _load_database(filename):
+    df = load_snapshots(filename)
+    if df.empty:
+        return df
+    df["timestamp"] = pd.to_datetime(
+        df["timestamp"], format="%Y-%m-%d %H:%M:%S", errors="coerce"
+    ).astype("datetime64[ns]")
+    df["server"] = df["server"].astype(object)
+    valid = df.dropna(subset=list(COLUMNS))
+    if len(valid) < len(df):
+        print(
+            f"Warning: skipped {len(df) - len(valid)} incomplete row(s) "
+            f"in {filename}"
+        )
+    columns = list(COLUMNS) + [c for c in OPTIONAL if c in valid.columns]
+    return valid[columns].reset_index(drop=True)
+
+
+def load_history_parallel(filename, workers=None,
+                          chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Parse a snapshot history JSONL (or SQLite store) into a DataFrame
+    using all cores."""
+    if is_database(filename):
+        df = _load_database(filename)
+        if df.empty:
+            print("No valid records found in history database.")
+            return pd.DataFrame()
+        return df
+
+    size = os.path.getsize(filename)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or size < MIN_PARALLEL_BYTES:
+        parts = [_parse_serial(filename)]
+        df = _merge(parts)
+    else:
+        chunks = max(workers, -(-size // chunk_bytes))
+        # blocks are named up front so the parent can remove every one
+        # of them, whether or not its worker got to return the name
+        prefix = f"iclim{os.getpid()}{secrets.token_hex(4)}"
+        tasks = [
+            (filename, s, e, f"{prefix}_{i}")
+            for i, (s, e) in enumerate(split_ranges(filename, chunks))
+        ]
+        try:
+            ctx = multiprocessing.get_context("fork")
+            with ctx.Pool(workers) as pool:
+                # imap keeps range order, so rows come back in file order
+                parts = list(pool.imap(_parse_range, tasks))
+            df = _merge(parts)
+        finally:
+            _unlink_blocks(task[3] for task in tasks)
+
+    bad_lines = sum(p["bad"] for p in parts)
+    if bad_lines > 0:
+        print(f"Warning: skipped {bad_lines} invalid JSON line(s) in {filename}")
+
+    if df.empty:
+        print("No valid records found in history file.")
+        return pd.DataFrame()
+    return df
@@ -0,0 +1,229 @@
+import json
+import random
+import sqlite3
+from datetime import date
+
+import pandas as pd
+
+from utils.sqlite_store import is_database
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Streaming training-set sampler
+#
+# Purpose:
+# Training on "the last N rows" only sees the last few hours, and
+# loading the whole history first does not scale to a year of data.
+# This picks a fixed-size, time-of-week balanced sample in one pass
+# over the file with memory bounded by the sample size.
+#
+# Flow:
+# each line
+# ↓
+# stratum = day-of-week × hour-of-day (168 buckets), read from the
+#           timestamp text without decoding the JSON
+# ↓
+# per-stratum reservoir (uniform within the stratum), raw bytes only
+# ↓
+# survivors decoded once at the end → DataFrame + stratum_weight
+#
+# Allocation:
+# The `size` slots are shared. While the sample is not full every
+# line is kept. Once it is full, a stratum that still holds all of its
+# lines and is smaller than the largest reservoir takes a slot from
+# the largest one (a random eviction, which keeps that reservoir
+# uniform); otherwise classic reservoir sampling (Algorithm R) runs
+# within the stratum. Reservoirs converge to equal shares, and strata
+# with fewer lines than their share keep all of them, so a small file
+# comes back whole.
+#
+# stratum_weight = lines seen in the stratum / lines kept from it,
+# i.e. how many history rows each sampled row stands for. Training
+# multiplies it into the sample weights so the time-of-week balance
+# does not distort the overall distribution.
+#
+# Only lines that survive are ever JSON-decoded, so most of the file
+# costs a substring read and one random number per line.
+#
+# A SQLite store (utils/sqlite_store.py) is sampled the same way: the
+# stratum is computed in the query and rows are streamed off the cursor.
+#
+# `since` / `until` ("YYYY-MM-DD HH:MM:SS") keep only records in
+# [since, until), compared as text on the timestamp already read for
+# the stratum; drift retrains sample the recent window and the older
+# history separately.
+
+STRATA = 7 * 24
+
+TIMESTAMP_KEY = b'"timestamp": "'
+
+
+def _stamp(line):
+    start = line.find(TIMESTAMP_KEY)
+    if start >= 0:
+        start += len(TIMESTAMP_KEY)
+        return line[start:start + 19]
+    # other serialisations (e.g. no space after the colon)
+    try:
+        return _loads(line)["timestamp"].encode()
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def _stratum(stamp, weekdays):
+    day = stamp[:10]
+    weekday = weekdays.get(day)
+    try:
+        if weekday is None:
+            weekday = weekdays[day] = date(
+                int(day[:4]), int(day[5:7]), int(day[8:10])
+            ).weekday()
+        return weekday * 24 + int(stamp[11:13])
+    except ValueError:
+        return None
+
+
+class StratifiedReservoir:
+
+    def __init__(self, size, seed=42, since=None, until=None):
+        self.size = size
+        self.since = since.encode() if isinstance(since, str) else since
+        self.until = until.encode() if isinstance(until, str) else until
+        self.rng = random.Random(seed)
+        self.reservoirs = [[] for _ in range(STRATA)]
+        self.seen = [0] * STRATA
+        self.kept = 0
+        self.bad = 0
+        # "YYYY-MM-DD" -> weekday, so each date is parsed once
+        self._weekdays = {}
+
+    def _largest(self):
+        return max(range(STRATA), key=lambda s: len(self.reservoirs[s]))
+
+    def add(self, line):
+        stamp = _stamp(line)
+        s = None if stamp is None else _stratum(stamp, self._weekdays)
+        if s is None:
+            self.bad += 1
+            return
+        if self.since is not None and stamp < self.since:
+            return
+        if self.until is not None and stamp >= self.until:
+            return
+        self.offer(s, line)
+
+    def offer(self, s, item):
+        self.seen[s] += 1
+        reservoir = self.reservoirs[s]
+        complete = len(reservoir) == self.seen[s] - 1
+
+        if self.kept < self.size:
+            if complete:
+                reservoir.append(item)
+                self.kept += 1
+                return
+        elif complete:
+            largest = self.reservoirs[self._largest()]
+            if len(largest) > len(reservoir) + 1:
+                largest[self.rng.randrange(len(largest))] = largest[-1]
+                largest.pop()
+                reservoir.append(item)
+                return
+
+        # Algorithm R within the stratum
+        if reservoir:
+            j = self.rng.randrange(self.seen[s])
+            if j < len(reservoir):
+                reservoir[j] = item
+
+    def feed(self, lines):
+        for line in lines:
+            line = line.strip()
+            if line:
+                self.add(line)
+
+    def to_frame(self, decode=_loads):
+        rows = []
+        for s, reservoir in enumerate(self.reservoirs):
+            if not reservoir:
+                continue
+            weight = self.seen[s] / len(reservoir)
+            for item in reservoir:
+                try:
+                    record = decode(item)
+                    rows.append({
+                        "timestamp": record["timestamp"],
+                        "cpu": float(record["cpu"]),
+                        "mem": float(record["mem"]),
+                        "disk": float(record["disk"]),
+                        "server": record.get("server"),
+                        "interval": record.get("interval"),
+                        "score": record.get("score"),
+                        "stratum_weight": weight,
+                    })
+                except (ValueError, KeyError, TypeError):
+                    self.bad += 1
+
+        df = pd.DataFrame(rows)
+        for optional in ("interval", "score"):
+            if not df.empty and df[optional].isna().all():
+                df = df.drop(columns=optional)
+        return df
+
+
+DATABASE_QUERY = (
+    "SELECT CAST(strftime('%w', timestamp) AS INTEGER) * 24"
+    " + CAST(strftime('%H', timestamp) AS INTEGER),"
+    " timestamp, cpu, mem, disk, server, interval, score FROM snapshots"
+)
+
+DATABASE_FIELDS = (
+    "timestamp", "cpu", "mem", "disk", "server", "interval", "score"
+)
+
+
+def _sample_database(sampler, path):
+    clauses, params = [], []
+    if sampler.since is not None:
+        clauses.append("timestamp >= ?")
+        params.append(sampler.since.decode())
+    if sampler.until is not None:
+        clauses.append("timestamp < ?")
+        params.append(sampler.until.decode())
+    query = DATABASE_QUERY
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    conn = sqlite3.connect(path)
+    try:
+        for row in conn.execute(query, params):
+            if row[0] is None:
+                sampler.bad += 1
+                continue
+            sampler.offer(row[0], row[1:])
+    finally:
+        conn.close()
+    return sampler.to_frame(lambda row: dict(zip(DATABASE_FIELDS, row)))
+
+
+def reservoir_sample(filename, size=100_000, seed=42, since=None,
+                     until=None):
+    """Time-stratified sample of a history JSONL (or SQLite store) in one
+    streaming pass, optionally of the records in [since, until).
+
+    df.attrs carries "seen" (valid records read) and "bad_lines".
+    """
+    sampler = StratifiedReservoir(size, seed, since, until)
+    if is_database(filename):
+        df = _sample_database(sampler, filename)
+    else:
+        with open(filename, "rb") as f:
+            sampler.feed(f)
+        df = sampler.to_frame()
+
+    df.attrs["seen"] = sum(sampler.seen)
+    df.attrs["bad_lines"] = sampler.bad
+    return df
@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis.model_format import model_fingerprint
+from analysis.parallel_ingest import load_history_parallel
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+HOURS = 24
+
+# Score threshold calibration
+#
+# Purpose:
+# model.predict() only says normal/anomalous at the cutoff fixed when
+# the model was trained. The realtime path now stores the continuous
+# score (decision_function: lower = more anomalous, < 0 = beyond the
+# training contamination) with every snapshot, so the cutoff can be
+# tuned per host and per hour of day without refitting the model.
+#
+# Flow:
+# snapshot_history.jsonl (rows stored without "score" are scored here)
+# ↓
+# score quantile per (server, hour), and per server as a fallback
+# ↓
+# thresholds.json
+# ↓
+# agent: anomalous = score < threshold(server, hour)
+#
+# Buckets with fewer than `min_samples` scores are left out and fall
+# back to the host threshold, then to the default (0.0, the model's
+# own cutoff).
+#
+# Scores only compare within one model, so:
+# - rows stored before the model file was written were scored by an
+#   earlier model and are rescored, not mixed in;
+# - thresholds.json records the model's fingerprint (meta["model"]),
+#   and a file calibrated for another model (e.g. before a drift
+#   retrain) is ignored in favour of the default cutoff until the
+#   calibration is run again.
+
+
+class ThresholdTable:
+
+    def __init__(self, default=0.0, hosts=None, hours=None, meta=None):
+        self.default = default
+        # server -> threshold
+        self.hosts = hosts or {}
+        # server -> list of 24 thresholds (None = use the host threshold)
+        self.hours = hours or {}
+        self.meta = meta or {}
+        self._hour_series = None
+
+    def threshold(self, server, hour):
+        hours = self.hours.get(server)
+        if hours is not None and hours[hour] is not None:
+            return hours[hour]
+        return self.hosts.get(server, self.default)
+
+    # Vectorised lookup for whole frames (replay, offline analysis).
+    def thresholds(self, servers, hours):
+        if self._hour_series is None:
+            self._hour_series = pd.Series(
+                {
+                    (server, hour): value
+                    for server, values in self.hours.items()
+                    for hour, value in enumerate(values)
+                    if value is not None
+                },
+                dtype=float,
+            )
+        servers = pd.Series(np.asarray(servers, dtype=object))
+        keys = pd.MultiIndex.from_arrays([servers, np.asarray(hours)])
+        if len(self._hour_series):
+            by_hour = self._hour_series.reindex(keys).to_numpy()
+        else:
+            by_hour = np.full(len(servers), np.nan)
+        by_host = servers.map(self.hosts).astype(float).to_numpy()
+        return np.where(
+            np.isnan(by_hour),
+            np.where(np.isnan(by_host), self.default, by_host),
+            by_hour,
+        )
+
+    def to_dict(self):
+        return {
+            "default": self.default,
+            "hosts": self.hosts,
+            "hours": self.hours,
+            "meta": self.meta,
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp, path)
+        return path
+
+
+def load_thresholds(path, fingerprint=None):
+    """Load a calibration file; a missing file, or one calibrated for a
+    model other than `fingerprint`, gives the default cutoff."""
+    if not path or not os.path.exists(path):
+        return ThresholdTable()
+    with open(path, "r") as f:
+        data = json.load(f)
+    calibrated_for = (data.get("meta") or {}).get("model")
+    if fingerprint is not None and calibrated_for != fingerprint:
+        logger.warning(
+            "Ignoring %s: calibrated for model %s, current model is %s; "
+            "using the default cutoff until it is recalibrated",
+            path, calibrated_for, fingerprint
+        )
+        return ThresholdTable()
+    return ThresholdTable(
+        default=data.get("default", 0.0),
+        hosts=data.get("hosts"),
+        hours=data.get("hours"),
+        meta=data.get("meta"),
+    )
+
+
+class ThresholdFile:
+    """Thresholds that follow a calibration file as it is rewritten, and
+    the model it must have been calibrated for (set `fingerprint` when
+    the model is swapped)."""
+
+    def __init__(self, path, fingerprint=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self._stamp = None
+        self.table = ThresholdTable()
+        self.current()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def current(self):
+        stamp = (self._stat(), self.fingerprint)
+        if stamp != self._stamp:
+            self.table = load_thresholds(self.path, self.fingerprint)
+            self._stamp = stamp
+        return self.table
+
+
+def model_written_at(path):
+    """When a model file (or compact directory) was last written."""
+    return pd.Timestamp.fromtimestamp(os.path.getmtime(path))
+
+
+def fill_scores(df, model, chunk_size=100_000, before=None):
+    """Score rows written before scores were stored, and rows stored
+    before `before` (scored by an earlier model)."""
+    if "score" not in df.columns:
+        df["score"] = np.nan
+    stale = df["score"].isna().to_numpy(copy=True)
+    if before is not None:
+        stale |= (pd.to_datetime(df["timestamp"]) < before).to_numpy()
+    missing = np.flatnonzero(stale)
+    if len(missing) == 0:
+        return df
+
+    features = df[["cpu", "mem", "disk"]].to_numpy(dtype=float)[missing]
+    scores = np.empty(len(missing), dtype=np.float64)
+    for begin in range(0, len(missing), chunk_size):
+        end = begin + chunk_size
+        scores[begin:end] = model.decision_function(features[begin:end])
+    df.loc[df.index[missing], "score"] = scores
+    return df
+
+
+def calibrate(df, quantile=0.01, min_samples=50, fingerprint=None):
+    """Per-host and per-(host, hour) score quantiles in one pass."""
+    frame = pd.DataFrame({
+        "server": df["server"].to_numpy(),
+        "hour": pd.to_datetime(df["timestamp"]).dt.hour.to_numpy(),
+        "score": df["score"].to_numpy(dtype=float),
+    }).dropna(subset=["score"])
+
+    by_host = frame.groupby("server")["score"]
+    hosts = pd.DataFrame({
+        "threshold": by_host.quantile(quantile),
+        "size": by_host.size(),
+    })
+    hosts = hosts[hosts["size"] >= min_samples]
+
+    buckets = frame.groupby(["server", "hour"])["score"]
+    hourly = pd.DataFrame({
+        "threshold": buckets.quantile(quantile),
+        "size": buckets.size(),
+    })
+    hourly = hourly[hourly["size"] >= min_samples]
+
+    hours = {}
+    for (server, hour), threshold in hourly["threshold"].items():
+        hours.setdefault(server, [None] * HOURS)[int(hour)] = round(
+            float(threshold), 6
+        )
+
+    return ThresholdTable(
+        default=0.0,
+        hosts={
+            server: round(float(value), 6)
+            for server, value in hosts["threshold"].items()
+        },
+        hours=hours,
+        meta={
+            "quantile": quantile,
+            "min_samples": min_samples,
+            "samples": int(len(frame)),
+            "model": fingerprint,
+        },
+    )
+
+
+def main():
+    from agents.realtime_anomaly_agent import load_model
+    from utils.config_loader import load_config
+    from utils.sqlite_store import history_source
+
+    config = load_config()
+    section = config["scoring"]
+
+    parser = argparse.ArgumentParser(
+        description="Calibrate per-host, per-hour anomaly score thresholds."
+    )
+    parser.add_argument("--history", default=history_source(config, BASE_DIR),
+                        help="JSONL history or SQLite store")
+    parser.add_argument("--model", default=os.path.join(
+        BASE_DIR, config["paths"]["model_path"]),
+        help="model to calibrate for; rescores rows it did not score")
+    parser.add_argument("--output", default=os.path.join(
+        BASE_DIR, section["thresholds_file"]))
+    parser.add_argument("--quantile", type=float, default=section["quantile"])
+    parser.add_argument("--min-samples", type=int,
+                        default=section["min_samples"])
+    args = parser.parse_args()
+
+    df = load_history_parallel(args.history)
+    if df.empty:
+        print("No history to calibrate on.")
+        return
+
+    model = load_model(args.model)
+    df = fill_scores(df, model, before=model_written_at(args.model))
+
+    table = calibrate(
+        df, args.quantile, args.min_samples, model_fingerprint(model)
+    )
+    table.save(args.output)
+
+    hourly = sum(
+        value is not None for values in table.hours.values() for value in values
+    )
+    print(
+        f"Thresholds for {len(table.hosts)} host(s), {hourly} host-hour "
+        f"bucket(s) written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,691 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.workload import generate_history, generate_logs
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(BASE_DIR, "benchmarks")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results", "latest.json")
+LEGACY_LOG_CLASSIFIER = os.path.join(
+    BASE_DIR, "archive", "Legacy analysis", "log_classifier.py"
+)
+
+# End-to-end benchmark suite
+#
+# Purpose:
+# Give every performance change a number to beat.
+#
+# Flow:
+# Generate synthetic history + logs (benchmarks/workload.py)
+# ↓
+# Run each registered benchmark in a forked child
+# (so peak RSS is per benchmark, not cumulative)
+# ↓
+# benchmarks/results/latest.json
+# ↓
+# Compare against benchmarks/baseline_<preset>.json
+#
+# Usage:
+# python -m benchmarks.run_benchmarks                     # full run
+# python -m benchmarks.run_benchmarks --preset quick      # smoke run
+# python -m benchmarks.run_benchmarks --only train_model
+# python -m benchmarks.run_benchmarks --save-baseline
+#
+# Adding a benchmark:
+# Decorate a function taking the workload context dict with
+# @benchmark("name"). It returns {"seconds": ..., "items": ...} plus
+# any extra fields worth recording.
+
+PRESETS = {
+    "quick": {"snapshots": 100_000, "hosts": 100, "log_lines": 50_000},
+    "full": {"snapshots": 2_000_000, "hosts": 2_000, "log_lines": 200_000},
+}
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def load_legacy_log_classifier():
+    spec = importlib.util.spec_from_file_location(
+        "legacy_log_classifier", LEGACY_LOG_CLASSIFIER
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+# Benchmarks
+
+@benchmark("load_history")
+def bench_load_history(ctx):
+    from analysis.anomaly_training import load_history
+    df, seconds = timed(load_history, ctx["history"])
+    return {"seconds": seconds, "items": len(df)}
+
+
+@benchmark("load_history_tolerant")
+def bench_load_history_tolerant(ctx):
+    from analysis.anomaly_retrain import load_history
+    df, seconds = timed(load_history, ctx["history"])
+    return {"seconds": seconds, "items": len(df)}
+
+
+@benchmark("load_history_parallel")
+def bench_load_history_parallel(ctx):
+    from analysis.parallel_ingest import load_history_parallel
+    df, seconds = timed(load_history_parallel, ctx["history"])
+    return {"seconds": seconds, "items": len(df)}
+
+
+@benchmark("prepare_df")
+def bench_prepare_df(ctx):
+    from analysis.anomaly_training import load_history, prepare_df
+    df = load_history(ctx["history"])
+    df, seconds = timed(prepare_df, df)
+    return {"seconds": seconds, "items": len(df)}
+
+
+@benchmark("train_model")
+def bench_train_model(ctx):
+    from analysis.anomaly_training import (
+        get_features, load_history, prepare_df, train_model
+    )
+    features = get_features(prepare_df(load_history(ctx["history"])))
+    _, seconds = timed(train_model, features)
+    return {"seconds": seconds, "items": len(features)}
+
+
+@benchmark("model_load")
+def bench_model_load(ctx):
+    import joblib
+    from analysis.anomaly_training import (
+        get_features, load_history, prepare_df, train_model
+    )
+    from analysis.model_format import export_forest, load_forest
+
+    model = train_model(get_features(prepare_df(load_history(ctx["history"]))))
+    pickle_path = os.path.join(ctx["workdir"], "model.pkl")
+    forest_path = os.path.join(ctx["workdir"], "model.forest")
+    joblib.dump(model, pickle_path)
+    export_forest(model, forest_path)
+
+    _, joblib_seconds = timed(joblib.load, pickle_path)
+    _, seconds = timed(load_forest, forest_path)
+    return {"seconds": seconds, "items": 1, "joblib_seconds": joblib_seconds}
+
+
+@benchmark("is_anomaly_compact")
+def bench_is_anomaly_compact(ctx):
+    from analysis.anomaly_training import (
+        get_features, load_history, prepare_df, train_model
+    )
+    from analysis.model_format import export_forest, load_forest
+    from agents.realtime_anomaly_agent import is_anomaly
+
+    df = prepare_df(load_history(ctx["history"]))
+    forest_path = os.path.join(ctx["workdir"], "model.forest")
+    export_forest(train_model(get_features(df)), forest_path)
+    model = load_forest(forest_path)
+    samples = df.head(ctx["scoring_samples"]).to_dict("records")
+
+    start = time.perf_counter()
+    flagged = 0
+    for snap in samples:
+        flagged += bool(is_anomaly(model, snap))
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "items": len(samples), "flagged": flagged}
+
+
+@benchmark("is_anomaly")
+def bench_is_anomaly(ctx):
+    from analysis.anomaly_training import (
+        get_features, load_history, prepare_df, train_model
+    )
+    from agents.realtime_anomaly_agent import is_anomaly
+
+    df = prepare_df(load_history(ctx["history"]))
+    model = train_model(get_features(df))
+    samples = df.head(ctx["scoring_samples"]).to_dict("records")
+
+    start = time.perf_counter()
+    flagged = 0
+    for snap in samples:
+        flagged += bool(is_anomaly(model, snap))
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "items": len(samples), "flagged": flagged}
+
+
+@benchmark("history_append")
+def bench_history_append(ctx):
+    from utils.durable_log import AppendLog
+
+    snap = {
+        "timestamp": "2025-01-01 00:00:00", "cpu": 12.5, "mem": 40.1,
+        "disk": 55.0, "server": "host-0000",
+    }
+    target = os.path.join(ctx["workdir"], "append_bench.jsonl")
+    count = ctx["append_samples"]
+
+    # the agent's append path without fsync; history_append_durable
+    # covers the fsync policies
+    log = AppendLog(target)
+    start = time.perf_counter()
+    for _ in range(count):
+        log.append(snap)
+    seconds = time.perf_counter() - start
+    log.close()
+    os.remove(target)
+    return {"seconds": seconds, "items": count}
+
+
+@benchmark("history_append_durable")
+def bench_history_append_durable(ctx):
+    from utils.durable_log import AppendLog
+
+    snap = {
+        "timestamp": "2025-01-01 00:00:00", "cpu": 12.5, "mem": 40.1,
+        "disk": 55.0, "server": "host-0000",
+    }
+    target = os.path.join(ctx["workdir"], "append_durable.jsonl")
+    count = ctx["append_samples"]
+
+    def run(fsync_interval, records):
+        log = AppendLog(target, fsync_interval=fsync_interval)
+        start = time.perf_counter()
+        for _ in range(records):
+            log.append(snap)
+        log.close()
+        seconds = time.perf_counter() - start
+        os.remove(target)
+        return seconds, log.stats["fsyncs"]
+
+    # Headline number: the agent's default group commit (1s).
+    seconds, fsyncs = run(1, count)
+    no_fsync, _ = run(None, count)
+    # fsync per record is far slower; time a slice and scale it
+    each = max(count // 20, 1)
+    fsync_each, _ = run(0, each)
+    return {
+        "seconds": seconds,
+        "items": count,
+        "fsyncs": fsyncs,
+        "no_fsync_seconds": round(no_fsync, 4),
+        "fsync_each_seconds": round(fsync_each * count / each, 4),
+    }
+
+
+@benchmark("history_append_sqlite")
+def bench_history_append_sqlite(ctx):
+    from utils.durable_log import AppendLog
+    from utils.sqlite_store import SqliteStore
+
+    snap = {
+        "timestamp": "2025-01-01 00:00:00", "cpu": 12.5, "mem": 40.1,
+        "disk": 55.0, "server": "host-0000", "score": 0.12, "interval": 5,
+    }
+    count = ctx["append_samples"]
+
+    target = os.path.join(ctx["workdir"], "append_bench.db")
+    store = SqliteStore(target, batch_size=200, flush_interval=1)
+    start = time.perf_counter()
+    for _ in range(count):
+        store.append_snapshot(snap)
+    store.close()
+    seconds = time.perf_counter() - start
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+
+    # JSONL with the same commit policy (group commit, 1s)
+    target = os.path.join(ctx["workdir"], "append_bench.jsonl")
+    log = AppendLog(target, fsync_interval=1)
+    start = time.perf_counter()
+    for _ in range(count):
+        log.append(snap)
+    log.close()
+    jsonl_seconds = time.perf_counter() - start
+    os.remove(target)
+
+    return {
+        "seconds": seconds,
+        "items": count,
+        "transactions": store.stats["transactions"],
+        "jsonl_seconds": round(jsonl_seconds, 4),
+    }
+
+
+@benchmark("history_query")
+def bench_history_query(ctx):
+    from analysis.parallel_ingest import load_history_parallel
+    from benchmarks.workload import host_names
+    from utils.sqlite_store import SqliteStore, import_jsonl, query_snapshots
+
+    target = os.path.join(ctx["workdir"], "query_bench.db")
+    store = SqliteStore(target, batch_size=5000, flush_interval=60)
+    _, import_seconds = timed(import_jsonl, store, ctx["history"], "snapshots")
+    store.close()
+
+    # one host, first hour of the workload
+    hosts = host_names(ctx["history_stats"]["hosts"])
+    window = ("2025-01-01 00:00:00", "2025-01-01 01:00:00")
+    queries = 20
+
+    start = time.perf_counter()
+    rows = 0
+    for i in range(queries):
+        rows += len(query_snapshots(
+            target, hosts[i % len(hosts)], window[0], window[1]
+        ))
+    seconds = time.perf_counter() - start
+
+    # the JSONL equivalent: load everything, then filter
+    def scan(server):
+        df = load_history_parallel(ctx["history"])
+        return df[
+            (df["server"] == server)
+            & (df["timestamp"] >= window[0]) & (df["timestamp"] < window[1])
+        ]
+
+    _, scan_seconds = timed(scan, hosts[0])
+    os.remove(target)
+
+    return {
+        "seconds": seconds,
+        "items": queries,
+        "rows": rows,
+        "import_seconds": round(import_seconds, 4),
+        "jsonl_scan_seconds_per_query": round(scan_seconds, 4),
+    }
+
+
+@benchmark("query_service")
+def bench_query_service(ctx):
+    import shutil
+    from benchmarks.workload import host_names
+    from utils.query_service import QueryService
+
+    history = os.path.join(ctx["workdir"], "query_service.jsonl")
+    events = os.path.join(ctx["workdir"], "query_service_events.jsonl")
+    shutil.copy(ctx["history"], history)
+    open(events, "w").close()
+
+    service = QueryService(history, events)
+    _, index_seconds = timed(service.refresh)
+
+    # a dashboard refresh: one fleet aggregate and a per-host range
+    hosts = host_names(ctx["history_stats"]["hosts"])
+    requests = [
+        ("/aggregate", {"metric": "cpu", "bucket": "300",
+                        "fn": "avg,max,p95", "last": "86400"}),
+        ("/range", {"server": hosts[0], "last": "3600"}),
+    ]
+
+    def refresh_dashboard():
+        for path, params in requests:
+            service.handle(path, params)
+
+    _, cold_seconds = timed(refresh_dashboard)
+    refreshes = 50
+    _, warm_seconds = timed(
+        lambda: [refresh_dashboard() for _ in range(refreshes)]
+    )
+
+    # one appended row per host, then the same refresh again
+    stamp = time.strftime(
+        "%Y-%m-%d %H:%M:%S", time.gmtime(service.history.latest + 5)
+    )
+    with open(history, "a") as f:
+        for host in hosts:
+            f.write(
+                f'{{"timestamp": "{stamp}", "cpu": 1.0, "mem": 1.0, '
+                f'"disk": 1.0, "server": "{host}"}}\n'
+            )
+    _, append_seconds = timed(refresh_dashboard)
+    os.remove(history)
+    os.remove(events)
+
+    return {
+        "seconds": warm_seconds,
+        "items": refreshes,
+        "index_seconds": round(index_seconds, 4),
+        "cold_refresh_seconds": round(cold_seconds, 4),
+        "after_append_refresh_seconds": round(append_seconds, 4),
+        "cache_hits": service.cache.hits,
+    }
+
+
+@benchmark("timeseries_buffer")
+def bench_timeseries_buffer(ctx):
+    from analysis.parallel_ingest import load_history_parallel
+    from utils.timeseries import MetricBuffer
+
+    df = load_history_parallel(ctx["history"])
+    epochs = (
+        df["timestamp"].astype("datetime64[s]").astype("int64").to_numpy()
+    )
+    records = df[["server", "cpu", "mem", "disk"]].to_dict("records")
+
+    buffer = MetricBuffer(retention=86400)
+    start = time.perf_counter()
+    for record, ts in zip(records, epochs):
+        buffer.append(record, ts=ts)
+    seconds = time.perf_counter() - start
+
+    # full-range decode of every cpu series
+    servers = buffer.servers()
+    start = time.perf_counter()
+    decoded = sum(len(buffer.range(server, "cpu")[0]) for server in servers)
+    decode_seconds = time.perf_counter() - start
+
+    stats = buffer.stats()
+    return {
+        "seconds": seconds,
+        "items": len(records),
+        "bytes": stats["bytes"],
+        "bytes_per_sample": round(stats["bytes"] / max(stats["samples"], 1), 2),
+        "decode_seconds": round(decode_seconds, 4),
+        "decoded": decoded,
+    }
+
+
+@benchmark("fleet_correlation")
+def bench_fleet_correlation(ctx):
+    from analysis.fleet_correlation import detect
+    from analysis.parallel_ingest import load_history_parallel
+
+    df = load_history_parallel(ctx["history"])
+    # the workload's injected episodes pin cpu at 85-100; they start
+    # independently per host, so few incidents should come back
+    flags = df["cpu"].to_numpy() >= 85
+    records, seconds = timed(detect, df, flags)
+    return {
+        "seconds": seconds,
+        "items": len(df),
+        "hosts": int(df["server"].nunique()),
+        "incidents": len(records),
+    }
+
+
+@benchmark("log_classification")
+def bench_log_classification(ctx):
+    legacy = load_legacy_log_classifier()
+    legacy.MODEL_FILE = os.path.join(ctx["workdir"], "log_classifier.pkl")
+
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = legacy.train_and_save_model()
+
+    df, seconds = timed(legacy.classify_logs, model, ctx["logs"])
+    return {"seconds": seconds, "items": len(df)}
+
+
+@benchmark("log_classifier_training")
+def bench_log_classifier_training(ctx):
+    from analysis.log_classifier import train_streaming
+    from benchmarks.workload import generate_logs
+
+    labelled = os.path.join(ctx["workdir"], "syslog_labelled.txt")
+    generate_logs(labelled, ctx["log_stats"]["lines"], seed=7, with_labels=True)
+
+    (model, stats), seconds = timed(train_streaming, [labelled])
+    os.remove(labelled)
+    return {
+        "seconds": seconds,
+        "items": stats["lines"],
+        "model_mb": stats["model_mb"],
+    }
+
+
+@benchmark("log_classification_sgd")
+def bench_log_classification_sgd(ctx):
+    from analysis.log_classifier import classify_logs, train_streaming
+    from benchmarks.workload import generate_logs
+
+    labelled = os.path.join(ctx["workdir"], "syslog_labelled.txt")
+    generate_logs(labelled, 20_000, seed=7, with_labels=True)
+    model, _ = train_streaming([labelled])
+    os.remove(labelled)
+
+    df, seconds = timed(classify_logs, model, ctx["logs"])
+    return {"seconds": seconds, "items": len(df)}
+
+
+@benchmark("log_classification_parallel")
+def bench_log_classification_parallel(ctx):
+    from analysis import parallel_classify
+    from analysis.log_classifier import train_streaming
+    from benchmarks.workload import generate_logs
+
+    labelled = os.path.join(ctx["workdir"], "syslog_labelled.txt")
+    generate_logs(labelled, 20_000, seed=7, with_labels=True)
+    model, _ = train_streaming([labelled])
+    os.remove(labelled)
+
+    # four files, one of them as large as the other three together
+    lines = ctx["log_stats"]["lines"]
+    paths = []
+    for i, count in enumerate((lines * 3, lines, lines, lines)):
+        path = os.path.join(ctx["workdir"], f"journal_{i}.txt")
+        generate_logs(path, count, seed=100 + i)
+        paths.append(path)
+
+    cpus = os.cpu_count() or 1
+    counts = sorted({w for w in (1, 2, 4, 8, 16, cpus) if w <= cpus})
+    total = sum(os.path.getsize(p) for p in paths)
+    # enough ranges that every worker count has work to balance
+    chunk_bytes = max(total // (4 * counts[-1]), 1024 * 1024)
+
+    parallel_classify.MIN_PARALLEL_BYTES = 0
+    scaling = {}
+    for workers in counts:
+        result = parallel_classify.classify_files(
+            model, paths, workers=workers, chunk_bytes=chunk_bytes
+        )
+        scaling[workers] = result["seconds"]
+    for path in paths:
+        os.remove(path)
+
+    return {
+        "seconds": scaling[counts[-1]],
+        "items": result["lines"],
+        "workers": counts[-1],
+        "scaling": scaling,
+        "speedup": round(scaling[1] / scaling[counts[-1]], 2),
+    }
+
+
+# Runner
+
+def _child(name, ctx, conn):
+    try:
+        result = BENCHMARKS[name](ctx)
+        result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        conn.send(result)
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_isolated(name, ctx):
+    mp = multiprocessing.get_context("fork")
+    parent, child = mp.Pipe(duplex=False)
+    proc = mp.Process(target=_child, args=(name, ctx, child))
+    proc.start()
+    child.close()
+    result = parent.recv() if parent.poll(None) else {"error": "no result"}
+    proc.join()
+
+    if "seconds" in result and result.get("items"):
+        result["items_per_sec"] = round(result["items"] / result["seconds"], 1)
+    if "seconds" in result:
+        result["seconds"] = round(result["seconds"], 4)
+    return result
+
+
+def prepare_workload(args, workdir):
+    history = os.path.join(workdir, "snapshot_history.jsonl")
+    logs = os.path.join(workdir, "syslog.txt")
+
+    print(f"Generating {args.snapshots} snapshots across {args.hosts} hosts ...")
+    history_stats, seconds = timed(
+        generate_history, history, args.snapshots, args.hosts,
+        anomaly_rate=args.anomaly_rate,
+    )
+    print(f"  done in {seconds:.1f}s ({history_stats['bytes'] / 1e6:.1f} MB)")
+
+    print(f"Generating {args.log_lines} log lines ...")
+    log_stats = generate_logs(logs, args.log_lines)
+
+    return {
+        "workdir": workdir,
+        "history": history,
+        "logs": logs,
+        "scoring_samples": args.scoring_samples,
+        "append_samples": args.append_samples,
+        "history_stats": history_stats,
+        "log_stats": log_stats,
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\n{'benchmark':<28}{'seconds':>12}{'baseline':>12}{'ratio':>8}")
+    for name, result in results["results"].items():
+        base = baseline.get("results", {}).get(name, {})
+        current = result.get("seconds")
+        previous = base.get("seconds")
+        if current is None or not previous:
+            print(f"{name:<28}{str(current):>12}{'-':>12}{'-':>8}")
+            continue
+        ratio = current / previous
+        flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:<28}{current:>12.4f}{previous:>12.4f}{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(name)
+
+    if baseline.get("params") != results["params"]:
+        print("\nNote: baseline was recorded with different workload params.")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ICLIM benchmark suite")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="full")
+    parser.add_argument("--snapshots", type=int)
+    parser.add_argument("--hosts", type=int)
+    parser.add_argument("--log-lines", type=int)
+    parser.add_argument("--anomaly-rate", type=float, default=0.01)
+    parser.add_argument("--scoring-samples", type=int, default=500)
+    parser.add_argument("--append-samples", type=int, default=20000)
+    parser.add_argument("--only", nargs="*", help="benchmark names to run")
+    parser.add_argument("--workdir",
+                        help="generate data here and keep it "
+                             "(default: a temporary directory)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline",
+                        help="default: benchmarks/baseline_<preset>.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    preset = PRESETS[args.preset]
+    args.snapshots = args.snapshots or preset["snapshots"]
+    args.hosts = args.hosts or preset["hosts"]
+    args.log_lines = args.log_lines or preset["log_lines"]
+    args.baseline = args.baseline or os.path.join(
+        BENCH_DIR, f"baseline_{args.preset}.json"
+    )
+
+    names = args.only or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        workspace = contextlib.nullcontext(args.workdir)
+    else:
+        workspace = tempfile.TemporaryDirectory()
+    with workspace as workdir:
+        ctx = prepare_workload(args, workdir)
+
+        results = {
+            "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "params": {
+                "snapshots": args.snapshots,
+                "hosts": args.hosts,
+                "log_lines": args.log_lines,
+                "anomaly_rate": args.anomaly_rate,
+                "scoring_samples": args.scoring_samples,
+                "append_samples": args.append_samples,
+            },
+            "results": {},
+        }
+
+        for name in names:
+            print(f"Running {name} ...", flush=True)
+            results["results"][name] = run_isolated(name, ctx)
+            print(f"  {results['results'][name]}")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --save-baseline to record one.")
+        return
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Synthetic workload generator
+#
+# Purpose:
+# Benchmarks need histories far larger than anything a single test VM
+# produces. This module writes snapshot_history.jsonl files in the
+# exact format the agent appends, for any number of hosts, with
+# labelled anomaly episodes injected on top of a daily baseline.
+#
+# Layout:
+# Rows are written time-major (all hosts for step 0, then step 1, ...)
+# which is what a fleet collector appending to one file looks like.
+#
+# Output:
+# <history>.jsonl          snapshots
+# <history>.labels.jsonl   one record per injected anomaly episode
+#                          {"server", "start", "end"}
+
+
+def host_names(hosts):
+    width = max(len(str(hosts - 1)), 4)
+    return [f"host-{i:0{width}d}" for i in range(hosts)]
+
+
+def labels_path(history_path):
+    root, ext = os.path.splitext(history_path)
+    return f"{root}.labels{ext or '.jsonl'}"
+
+
+def _episode_mask(starts, carry, length):
+    # starts: (steps, hosts) bool. An episode covers `length` samples
+    # from its start. `carry` holds the previous chunk's trailing
+    # starts so episodes continue across chunk boundaries.
+    stacked = np.vstack([carry, starts]).astype(np.int32)
+    csum = np.cumsum(stacked, axis=0)
+    shifted = np.zeros_like(csum)
+    shifted[length:] = csum[:-length]
+    mask = (csum - shifted) > 0
+    return mask[len(carry):]
+
+
+def generate_history(path, snapshots, hosts, anomaly_rate=0.01,
+                     episode_length=12, interval=5,
+                     start=datetime(2025, 1, 1), seed=42,
+                     chunk_steps=2000):
+    """Write a synthetic history and its episode labels. Returns stats."""
+    rng = np.random.default_rng(seed)
+    names = host_names(hosts)
+    steps = -(-snapshots // hosts)
+
+    # Per-host personality: baseline load and noise level.
+    cpu_base = rng.uniform(5, 40, hosts)
+    mem_base = rng.uniform(20, 60, hosts)
+    disk_base = rng.uniform(20, 70, hosts)
+    disk_growth = rng.uniform(0, 2e-5, hosts)
+    noise = rng.uniform(1, 5, hosts)
+
+    # Probability a sample starts an episode such that roughly
+    # `anomaly_rate` of all samples end up anomalous.
+    start_p = anomaly_rate / episode_length
+
+    carry = np.zeros((episode_length - 1, hosts), dtype=bool)
+    written = 0
+    anomalous = 0
+    episodes = 0
+
+    with open(path, "w") as out, open(labels_path(path), "w") as labels:
+        for step0 in range(0, steps, chunk_steps):
+            n = min(chunk_steps, steps - step0)
+            step_idx = np.arange(step0, step0 + n)
+            seconds = step_idx * interval
+
+            # Daily sine wave on top of each host's baseline.
+            phase = np.sin(2 * np.pi * (seconds % 86400) / 86400)[:, None]
+            cpu = cpu_base + 10 * phase + rng.normal(0, 1, (n, hosts)) * noise
+            mem = mem_base + 5 * phase + rng.normal(0, 0.5, (n, hosts)) * noise
+            disk = disk_base + disk_growth * seconds[:, None]
+
+            starts = rng.random((n, hosts)) < start_p
+            mask = _episode_mask(starts, carry, episode_length)
+            carry = starts[-(episode_length - 1):] if episode_length > 1 \
+                else carry
+
+            cpu = np.where(mask, rng.uniform(85, 100, (n, hosts)), cpu)
+            mem = np.where(mask, mem + rng.uniform(20, 40, (n, hosts)), mem)
+
+            cpu = np.clip(cpu, 0, 100).round(1)
+            mem = np.clip(mem, 0, 100).round(1)
+            disk = np.clip(disk, 0, 100).round(1)
+
+            stamps = [
+                (start + timedelta(seconds=int(s))).strftime(TIMESTAMP_FORMAT)
+                for s in seconds
+            ]
+
+            lines = []
+            for r in range(n):
+                ts = stamps[r]
+                cr, mr, dr = cpu[r].tolist(), mem[r].tolist(), disk[r].tolist()
+                limit = min(hosts, snapshots - written)
+                for h in range(limit):
+                    lines.append(
+                        f'{{"timestamp": "{ts}", "cpu": {cr[h]}, '
+                        f'"mem": {mr[h]}, "disk": {dr[h]}, '
+                        f'"server": "{names[h]}"}}\n'
+                    )
+                written += limit
+                if written >= snapshots:
+                    break
+            out.write("".join(lines))
+
+            anomalous += int(mask.sum())
+            for r, h in zip(*np.nonzero(starts)):
+                begin = start + timedelta(seconds=int(seconds[r]))
+                end = begin + timedelta(seconds=interval * (episode_length - 1))
+                labels.write(json.dumps({
+                    "server": names[h],
+                    "start": begin.strftime(TIMESTAMP_FORMAT),
+                    "end": end.strftime(TIMESTAMP_FORMAT),
+                }) + "\n")
+                episodes += 1
+
+            if written >= snapshots:
+                break
+
+    return {
+        "snapshots": written,
+        "hosts": hosts,
+        "anomalous_samples": anomalous,
+        "episodes": episodes,
+        "bytes": os.path.getsize(path),
+    }
+
+
+# Synthetic syslog lines for the log classification benchmarks.
+LOG_TEMPLATES = {
+    "info": [
+        "systemd[1]: Started {svc}.service",
+        "CRON[{pid}]: (root) CMD (run-parts /etc/cron.hourly)",
+        "httpd[{pid}]: 200 ok get /index.html",
+        "backup[{pid}]: backup completed successfully for /var/www",
+    ],
+    "warning": [
+        "kernel: clocksource watchdog on CPU{cpu}: kvm-clock retried {n} times before success",
+        "httpd[{pid}]: 404 not found get /missing/{n}",
+        "rsyslogd[{pid}]: imjournal: journal files changed, reloading",
+    ],
+    "error": [
+        "systemd[1]: {svc}.service: Main process exited, status=1/FAILURE",
+        "kernel: disk sda{cpu} running out of space: 9{cpu}% used",
+        "httpd[{pid}]: 500 internal server error get /api/v1/{svc}",
+    ],
+    "security": [
+        "sshd[{pid}]: Failed password for root from 10.0.{cpu}.{n} port {pid} ssh2",
+        "sshd[{pid}]: Invalid user admin from 10.0.{cpu}.{n}",
+        "sudo[{pid}]: pam_unix(sudo:auth): authentication failure; user={svc}",
+    ],
+}
+
+LOG_SERVICES = ["nginx", "postgres", "docker", "kubelet", "payments", "auth"]
+
+
+def generate_logs(path, lines, seed=42, with_labels=False):
+    """Write `lines` syslog-style lines. Optionally append '\\t<label>'."""
+    rng = np.random.default_rng(seed)
+    labels = list(LOG_TEMPLATES)
+    label_idx = rng.integers(0, len(labels), lines)
+    tmpl_idx = rng.integers(0, 16, lines)
+    pids = rng.integers(100, 65000, lines)
+    small = rng.integers(0, 9, lines)
+    svc_idx = rng.integers(0, len(LOG_SERVICES), lines)
+    base = datetime(2025, 1, 1)
+
+    with open(path, "w") as out:
+        buffer = []
+        for i in range(lines):
+            label = labels[label_idx[i]]
+            templates = LOG_TEMPLATES[label]
+            message = templates[tmpl_idx[i] % len(templates)].format(
+                svc=LOG_SERVICES[svc_idx[i]], pid=pids[i],
+                cpu=small[i], n=small[i] + 1,
+            )
+            stamp = (base + timedelta(seconds=i)).strftime("%b %d %H:%M:%S")
+            line = f"{stamp} node-{small[i]} {message}"
+            if with_labels:
+                line += f"\t{label}"
+            buffer.append(line + "\n")
+            if len(buffer) >= 100000:
+                out.write("".join(buffer))
+                buffer = []
+        out.write("".join(buffer))
+
+    return {"lines": lines, "bytes": os.path.getsize(path)}
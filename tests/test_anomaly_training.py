@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from analysis.anomaly_training import sample_history, train_from_history
+
+
+def write_history(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+
+
+def snapshot(day, minute, cpu, score=None):
+    return {
+        "timestamp": f"2025-01-{day:02d} 00:{minute:02d}:00",
+        "server": "host-0", "cpu": cpu, "mem": 10.0, "disk": 10.0,
+        "score": score,
+    }
+
+
+def test_drift_sample_keeps_history_and_drops_flagged_recent(tmp_path):
+    path = tmp_path / "history.jsonl"
+    write_history(
+        path,
+        [snapshot(1, m, 10.0, 0.1) for m in range(40)]
+        + [snapshot(2, m, 50.0, 0.1) for m in range(10)]
+        + [snapshot(2, m, 95.0, -0.2) for m in range(10, 20)]
+    )
+
+    df = sample_history(
+        str(path), 40, recent_since="2025-01-02 00:00:00", recent_share=0.5
+    )
+
+    assert (df["cpu"] == 10.0).sum() == 20
+    assert (df["cpu"] == 50.0).sum() == 10
+    assert (df["cpu"] == 95.0).sum() == 0
+
+
+def test_too_few_samples_leave_the_model_alone(tmp_path):
+    path = tmp_path / "history.jsonl"
+    write_history(path, [snapshot(1, m, 10.0) for m in range(10)])
+    model_path = tmp_path / "models" / "model.pkl"
+
+    with pytest.raises(ValueError):
+        train_from_history(str(path), str(model_path), min_samples=100)
+
+    assert not model_path.exists()
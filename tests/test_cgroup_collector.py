@@ -0,0 +1,44 @@
+import pytest
+
+from agents import cgroup_collector
+from agents.cgroup_collector import CgroupCollector
+from analysis.disk_forecast import DiskForecaster
+
+
+def make_cgroup(path, usage_usec=1000, memory=1024):
+    path.mkdir(parents=True)
+    (path / "cpu.stat").write_text(f"usage_usec {usage_usec}\n")
+    (path / "memory.current").write_text(f"{memory}\n")
+
+
+@pytest.fixture
+def node(tmp_path, monkeypatch):
+    for name in ("a", "b", "self"):
+        make_cgroup(tmp_path / "docker" / name)
+    monkeypatch.setattr(cgroup_collector, "own_cgroup", lambda: "/docker/self")
+    return tmp_path
+
+
+def test_siblings_refuse_a_private_cgroup_namespace(tmp_path, monkeypatch):
+    monkeypatch.setattr(cgroup_collector, "own_cgroup", lambda: "/")
+
+    with pytest.raises(OSError, match="cgroupns=host"):
+        CgroupCollector(root=str(tmp_path), targets="siblings")
+
+
+def test_sibling_disk_is_one_series_for_the_host(node):
+    collector = CgroupCollector(root=str(node), targets="siblings")
+    assert collector.paths == ["/docker/a", "/docker/b", "/docker/self"]
+
+    forecaster = DiskForecaster(min_samples=2)
+    for step in range(3):
+        snaps = [
+            dict(s, timestamp=f"2025-01-01 00:00:0{step}", disk=50.0 + step)
+            for s in collector.collect("node-1")
+        ]
+        assert {s["disk_host"] for s in snaps} == {"node-1"}
+        for snap in snaps:
+            forecaster.update(snap)
+
+    assert list(forecaster._series) == [("node-1", "/")]
+    assert len(forecaster._series[("node-1", "/")]["points"]) == 3
@@ -0,0 +1,59 @@
+from analysis.drift import DriftMonitor
+
+
+def snapshot(minute, cpu=10.0):
+    return {
+        "timestamp": f"2025-01-01 00:{minute:02d}:00", "server": "host-0",
+        "cpu": cpu, "mem": 10.0, "disk": 10.0,
+    }
+
+
+def test_window_start_is_oldest_sample_in_window():
+    drift = DriftMonitor(window=5)
+    for minute in range(8):
+        drift.observe(snapshot(minute), False, 0)
+
+    assert drift.window_start() == "2025-01-01 00:03:00"
+
+
+def test_reset_empties_window_for_new_model():
+    drift = DriftMonitor(window=4, check_every=1, cooldown=0)
+    for minute in range(4):
+        drift.observe(snapshot(minute), False, 0)
+    for minute in range(4, 8):
+        decision = drift.observe(snapshot(minute, cpu=95.0), True, 0)
+    assert decision["retrain"]
+
+    drift.reset()
+
+    assert drift.window_start() is None
+    # nothing is checked until a full window of new samples
+    assert drift.observe(snapshot(8), False, 1) is None
+
+
+def test_anomaly_rate_alone_does_not_retrain():
+    drift = DriftMonitor(window=4, check_every=1, cooldown=0)
+    for minute in range(4):
+        drift.observe(snapshot(minute), False, 0)
+    for minute in range(4, 8):
+        decision = drift.observe(snapshot(minute), True, 0)
+
+    assert not decision["retrain"]
+    assert "not retraining" in decision["reason"]
+
+
+def test_cooldown_starts_only_when_a_retrain_starts():
+    drift = DriftMonitor(window=4, check_every=1, cooldown=100)
+    for minute in range(4):
+        drift.observe(snapshot(minute), False, 0)
+    decision = drift.observe(snapshot(4, cpu=95.0), True, 0)
+    for minute in range(5, 8):
+        decision = drift.observe(snapshot(minute, cpu=95.0), True, 0)
+    # decisions not acted on leave the cooldown untouched
+    assert decision["retrain"]
+
+    drift.retrain_started(0)
+    decision = drift.observe(snapshot(8, cpu=95.0), True, 1)
+
+    assert not decision["retrain"]
+    assert decision["reason"].startswith("cooldown")
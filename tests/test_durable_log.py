@@ -0,0 +1,36 @@
+import json
+import time
+
+from utils.durable_log import AppendLog, recover
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_recover_drops_torn_tail(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text('{"seq": 0}\n{"seq": 1}\n{"seq": ')
+
+    assert recover(str(path)) == len('{"seq": ')
+    assert read_records(path) == [{"seq": 0}, {"seq": 1}]
+
+
+def test_recover_keeps_whole_record_missing_newline(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text('{"seq": 0}\n{"seq": 1}')
+
+    assert recover(str(path)) == 0
+    assert path.read_text() == '{"seq": 0}\n{"seq": 1}\n'
+
+
+def test_group_commit_syncs_without_further_appends(tmp_path):
+    log = AppendLog(str(tmp_path / "history.jsonl"), fsync_interval=0.05)
+    log.append({"seq": 0})
+    deadline = time.monotonic() + 5
+    while log.stats["fsyncs"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    log.close()
+
+    assert log.stats["fsyncs"] == 1
@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.notifier import Notifier, WebhookSink
+
+
+class StubReceiver:
+    """Local webhook receiver that records every POSTed record."""
+
+    def __init__(self, delay=0.0):
+        self.records = []
+        self.delay = delay
+        self.fail = False
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if receiver.delay:
+                    time.sleep(receiver.delay)
+                if receiver.fail:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                receiver.records.append(json.loads(body))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/alerts"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def receiver():
+    stub = StubReceiver()
+    yield stub
+    stub.close()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_delivers_to_webhook(receiver):
+    notifier = Notifier([WebhookSink(receiver.url)]).start()
+    for i in range(20):
+        notifier.notify({"seq": i})
+    assert wait_for(lambda: len(receiver.records) == 20)
+    notifier.close()
+
+    assert [r["seq"] for r in receiver.records] == list(range(20))
+    stats = notifier.metrics()
+    assert stats["enqueued"] == 20
+    assert stats["delivered"] == 20
+    assert stats["failed"] == 0
+
+
+def test_retries_until_receiver_recovers(receiver):
+    receiver.fail = True
+    notifier = Notifier(
+        [WebhookSink(receiver.url)], backoff_base=0.05, backoff_max=0.1
+    ).start()
+    notifier.notify({"seq": 0})
+    assert wait_for(lambda: notifier.metrics()["retried"] >= 2)
+    receiver.fail = False
+    assert wait_for(lambda: len(receiver.records) == 1)
+    notifier.close()
+
+    assert notifier.metrics()["delivered"] == 1
+
+
+def test_spill_replay_does_not_hold_up_live_records(tmp_path):
+    receiver = StubReceiver(delay=0.002)
+    spill = tmp_path / "spill.jsonl"
+    spill.write_text(
+        "".join(json.dumps({"spilled": i}) + "\n" for i in range(500))
+    )
+    notifier = Notifier(
+        [WebhookSink(receiver.url)], spill_file=str(spill), replay_batch=10
+    ).start()
+    try:
+        assert wait_for(lambda: len(receiver.records) >= 20)
+        notifier.notify({"live": True})
+        assert wait_for(lambda: len(receiver.records) == 501, timeout=30)
+    finally:
+        notifier.close()
+        receiver.close()
+
+    live = [i for i, r in enumerate(receiver.records) if "live" in r]
+    assert len(live) == 1
+    # delivered within about one batch of being queued, not after the
+    # rest of the spill
+    assert live[0] < 100
+    assert notifier.metrics()["replayed"] == 500
+    assert not spill.exists()
+    assert not (tmp_path / "spill.jsonl.draining").exists()
+
+
+def test_unfinished_replay_resumes_after_restart(receiver, tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    draining = tmp_path / "spill.jsonl.draining"
+    draining.write_text(json.dumps({"spilled": 0}) + "\n")
+    spill.write_text(json.dumps({"spilled": 1}) + "\n")
+
+    notifier = Notifier([WebhookSink(receiver.url)], spill_file=str(spill))
+    notifier.start()
+    assert wait_for(lambda: len(receiver.records) == 2)
+    notifier.close()
+
+    assert [r["spilled"] for r in receiver.records] == [0, 1]
+    assert not spill.exists()
+    assert not draining.exists()
+
+
+class RecordingSink:
+
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+        self.records = []
+
+    def send(self, record):
+        if self.fail:
+            raise OSError("receiver down")
+        self.records.append(record)
+
+
+def test_gave_up_records_are_spilled_for_the_failed_sinks(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    ok, down = RecordingSink("file"), RecordingSink("webhook", fail=True)
+    notifier = Notifier(
+        [ok, down], max_retries=1, backoff_base=0.01, backoff_max=0.01,
+        spill_file=str(spill)
+    ).start()
+    notifier.notify({"seq": 0})
+    assert wait_for(lambda: notifier.metrics()["spilled"] >= 1)
+    down.fail = False
+    assert wait_for(lambda: len(down.records) == 1)
+    notifier.close()
+
+    assert ok.records == [{"seq": 0}]
+    assert down.records == [{"seq": 0}]
+    assert notifier.metrics()["failed"] == 0
+
+
+def test_close_spills_pending_retries_with_their_sinks(tmp_path):
+    spill = tmp_path / "spill.jsonl"
+    ok, down = RecordingSink("file"), RecordingSink("webhook", fail=True)
+    notifier = Notifier(
+        [ok, down], backoff_base=60, spill_file=str(spill)
+    ).start()
+    notifier.notify({"seq": 0})
+    assert wait_for(lambda: notifier.metrics()["retried"] == 1)
+    notifier.close()
+
+    lines = [json.loads(line) for line in spill.read_text().splitlines()]
+    assert lines == [{"record": {"seq": 0}, "sinks": ["webhook"]}]
@@ -0,0 +1,20 @@
+import json
+
+from analysis.parallel_ingest import load_history_parallel
+
+
+def test_null_optional_fields_keep_the_row(tmp_path):
+    path = tmp_path / "history.jsonl"
+    rows = [
+        {"timestamp": "2025-01-01 00:00:00", "server": "host-0",
+         "cpu": 1.0, "mem": 2.0, "disk": 3.0, "score": 0.1, "interval": 5},
+        {"timestamp": "2025-01-01 00:00:05", "server": "host-0",
+         "cpu": 1.0, "mem": 2.0, "disk": 3.0, "score": None, "interval": None},
+    ]
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+
+    df = load_history_parallel(str(path))
+
+    assert len(df) == 2
+    assert df.attrs.get("bad_lines", 0) == 0
+    assert df["score"].isna().tolist() == [False, True]
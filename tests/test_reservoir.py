@@ -0,0 +1,34 @@
+import json
+
+from analysis.reservoir import reservoir_sample
+from utils.sqlite_store import SqliteStore
+
+
+def snapshot(hour):
+    return {
+        "timestamp": f"2025-01-01 {hour:02d}:00:00", "server": "host-0",
+        "cpu": 1.0, "mem": 2.0, "disk": 3.0,
+    }
+
+
+def test_since_skips_older_records(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text("".join(json.dumps(snapshot(h)) + "\n" for h in range(24)))
+
+    df = reservoir_sample(str(path), since="2025-01-01 18:00:00")
+
+    assert len(df) == 6
+    assert str(df["timestamp"].min()) == "2025-01-01 18:00:00"
+
+
+def test_since_applies_to_database(tmp_path):
+    path = str(tmp_path / "store.db")
+    store = SqliteStore(path, flush_interval=0)
+    for h in range(24):
+        store.append_snapshot(snapshot(h))
+    store.close()
+
+    df = reservoir_sample(path, since="2025-01-01 18:00:00")
+
+    assert len(df) == 6
+    assert str(df["timestamp"].min()) == "2025-01-01 18:00:00"
@@ -0,0 +1,61 @@
+import sqlite3
+import threading
+import time
+
+from utils.sqlite_store import SqliteStore, query_snapshots
+
+
+def snapshot(i):
+    return {
+        "timestamp": "2025-01-01 00:00:00", "server": f"host-{i % 3}",
+        "cpu": 1.0, "mem": 2.0, "disk": 3.0,
+    }
+
+
+def test_flush_interval_applies_without_further_appends(tmp_path):
+    path = str(tmp_path / "store.db")
+    store = SqliteStore(path, batch_size=1000, flush_interval=0.05)
+    store.append_snapshot(snapshot(0))
+    deadline = time.monotonic() + 5
+    while not query_snapshots(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    rows = query_snapshots(path)
+    store.close()
+
+    assert len(rows) == 1
+
+
+def test_no_rows_lost_to_concurrent_flushes(tmp_path):
+    path = str(tmp_path / "store.db")
+    store = SqliteStore(path, batch_size=50, flush_interval=0.001)
+
+    def write(count):
+        for i in range(count):
+            store.append_snapshot(snapshot(i))
+
+    writers = [threading.Thread(target=write, args=(5000,)) for _ in range(2)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    store.close()
+
+    assert len(query_snapshots(path)) == 10000
+
+
+def test_failed_flush_keeps_rows_for_the_next_one(tmp_path):
+    path = str(tmp_path / "store.db")
+    store = SqliteStore(path, batch_size=1, flush_interval=0)
+    store._conn.execute("PRAGMA busy_timeout = 10")
+    blocker = sqlite3.connect(path)
+    blocker.execute("BEGIN EXCLUSIVE")
+
+    # the flush from append fails without raising into the caller
+    store.append_snapshot(snapshot(0))
+    store.append_snapshot(snapshot(1))
+
+    blocker.rollback()
+    blocker.close()
+    store.close()
+
+    assert len(query_snapshots(path)) == 2
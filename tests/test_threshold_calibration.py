@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+
+from analysis.model_format import export_forest, load_forest, model_fingerprint
+from analysis.threshold_calibration import (
+    ThresholdFile, ThresholdTable, fill_scores, load_thresholds
+)
+
+
+def fitted(seed):
+    rng = np.random.default_rng(seed)
+    return IsolationForest(n_estimators=10, random_state=seed).fit(
+        rng.uniform(0, 100, size=(200, 3))
+    )
+
+
+def test_fingerprint_matches_compact_export(tmp_path):
+    model = fitted(0)
+    compact = load_forest(export_forest(model, str(tmp_path / "m.forest")))
+
+    assert model_fingerprint(compact) == model_fingerprint(model)
+    assert model_fingerprint(fitted(1)) != model_fingerprint(model)
+
+
+def test_thresholds_for_another_model_are_ignored(tmp_path):
+    path = str(tmp_path / "thresholds.json")
+    ThresholdTable(hosts={"host-0": -0.1}, meta={"model": "old"}).save(path)
+
+    assert load_thresholds(path, "old").threshold("host-0", 0) == -0.1
+    assert load_thresholds(path, "new").threshold("host-0", 0) == 0.0
+
+    thresholds = ThresholdFile(path, "old")
+    assert thresholds.current().threshold("host-0", 0) == -0.1
+    thresholds.fingerprint = "new"
+    assert thresholds.current().threshold("host-0", 0) == 0.0
+
+
+def test_fill_scores_rescores_rows_from_an_earlier_model():
+    model = fitted(0)
+    df = pd.DataFrame({
+        "timestamp": pd.to_datetime(
+            ["2025-01-01 00:00:00", "2025-01-02 00:00:00"]
+        ),
+        "cpu": [50.0, 50.0], "mem": [50.0, 50.0], "disk": [50.0, 50.0],
+        "score": [9.0, 9.0],
+    })
+
+    fill_scores(df, model, before=pd.Timestamp("2025-01-01 12:00:00"))
+
+    expected = model.decision_function([[50.0, 50.0, 50.0]])[0]
+    assert df["score"].tolist() == [expected, 9.0]
@@ -1,8 +1,18 @@
+import copy
 import yaml
 import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
+CONFIG_PATH = os.path.join(BASE_DIR, "config", "config.yaml")
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+class ConfigError(Exception):
+    pass
+
+
 def apply_environment_overrides(config):
     """
     Override selected configuration values using environment variables.
@@ -24,12 +34,464 @@ def apply_environment_overrides(config):
 
     return config
 
-def load_config():
-    config_path = os.path.join(BASE_DIR, "config", "config.yaml")
+# Defaults
+#
+# The values shipped in config/config.yaml. A config.yaml written for
+# an older release only sets the sections it knew about; anything it
+# lacks is taken from here, so an upgrade starts instead of failing
+# validation with every new section "missing".
+
+DEFAULTS = {
+    "app": {"interval": 5, "hostname": "auto", "reload": True},
+    "paths": {
+        "base_dir": "auto",
+        "logs_dir": "logs",
+        "model_path": "models/anomaly_model.pkl",
+        "history_file": "logs/snapshot_history.jsonl",
+        "anomaly_file": "logs/anomaly_events.jsonl",
+    },
+    "scoring": {
+        "thresholds_file": "models/thresholds.json",
+        "quantile": 0.01,
+        "min_samples": 50,
+    },
+    "cgroups": {
+        "enabled": False,
+        "root": "/sys/fs/cgroup",
+        "targets": "self",
+        "rediscover": 60,
+    },
+    "drift": {
+        "enabled": False,
+        "bins": 20,
+        "window": 720,
+        "check_every": 60,
+        "psi_threshold": 0.25,
+        "rate_factor": 3,
+        "min_rate": 0.01,
+        "cooldown": 3600,
+        "recent_share": 0.25,
+        "min_samples": 5000,
+    },
+    "attribution": {
+        "enabled": True,
+        "top_n": 5,
+        "margin": 0.02,
+        "max_processes": 2000,
+        "budget": 0.2,
+        "settle": 0.2,
+        "max_age": 30,
+    },
+    "sampling": {
+        "adaptive": False,
+        "min_interval": 1,
+        "max_interval": 30,
+        "volatility_scale": 5,
+        "backoff": 1.5,
+        "margin_scale": 0.05,
+    },
+    "model": {"format": "compact"},
+    "logging": {"level": "INFO", "format": "text"},
+    "durability": {"recover": True, "fsync_interval": 1},
+    "storage": {
+        "backend": "jsonl",
+        "database": "logs/iclim.db",
+        "batch_size": 200,
+        "flush_interval": 1,
+        "retention_days": None,
+    },
+    "buffer": {"enabled": True, "retention": 86400, "block_size": 1024},
+    "fleet": {
+        "output_file": "logs/fleet_incidents.jsonl",
+        "step": 30,
+        "window": 20,
+        "stride": 10,
+        "min_hosts": 3,
+        "corr_threshold": 0.8,
+        "fleet_fraction": 0.2,
+        "excess_factor": 3,
+    },
+    "forecast": {
+        "enabled": True,
+        "window": 21600,
+        "min_samples": 12,
+        "horizon": 86400,
+        "realert": 3600,
+        "capacity": 100,
+    },
+    "incidents": {
+        "enabled": True,
+        "realert": 300,
+        "cooldown": 60,
+        "max_open": 1024,
+    },
+    "notifier": {
+        "enabled": False,
+        "queue_size": 1000,
+        "max_retries": 5,
+        "backoff_base": 1,
+        "backoff_max": 60,
+        "spill_file": "logs/notifier_spill.jsonl",
+        "replay_batch": 100,
+        "sinks": {
+            "webhook": {
+                "enabled": False,
+                "url": "http://localhost:8080/alerts",
+                "timeout": 5,
+            },
+            "syslog": {"enabled": False, "address": "/dev/log", "port": 514},
+            "file": {"enabled": False, "path": "logs/notifications.jsonl"},
+        },
+    },
+    "metrics": {"enabled": True, "host": "0.0.0.0", "port": 9108},
+    "query": {
+        "host": "127.0.0.1",
+        "port": 9110,
+        "cache_size": 256,
+        "max_points": 100000,
+    },
+    "profiling": {
+        "enabled": True,
+        "output_dir": "logs/profiles",
+        "seconds": 30,
+        "max_seconds": 300,
+        "interval": 0.005,
+        "all_threads": False,
+        "spans": False,
+    },
+}
+
 
+def apply_defaults(config, defaults=DEFAULTS):
+    """Fill keys missing from config with their default, in place."""
+    for key, value in defaults.items():
+        if key not in config:
+            config[key] = copy.deepcopy(value)
+        elif isinstance(value, dict) and isinstance(config[key], dict):
+            apply_defaults(config[key], value)
+    return config
+
+
+def load_config(config_path=CONFIG_PATH):
     with open(config_path, "r") as f:
         config = yaml.safe_load(f)
 
+    # a non-mapping root is left for validate_config to report
+    if isinstance(config, dict):
+        config = apply_defaults(config)
     config = apply_environment_overrides(config)
 
-    return config
\ No newline at end of file
+    return config
+
+
+# Schema validation
+#
+# Each entry maps a dotted key to a check returning an error message
+# (or None). Sections not listed here are not validated.
+
+def _type(*types):
+    def check(value):
+        if isinstance(value, bool) and bool not in types:
+            return f"expected {'/'.join(t.__name__ for t in types)}"
+        if not isinstance(value, types):
+            return f"expected {'/'.join(t.__name__ for t in types)}"
+        return None
+    return check
+
+
+def _positive(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return "expected a number"
+    if value <= 0:
+        return "must be greater than 0"
+    return None
+
+
+def _non_negative(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return "expected a number"
+    if value < 0:
+        return "must not be negative"
+    return None
+
+
+def _fraction(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return "expected a number"
+    if not 0 < value < 1:
+        return "must be between 0 and 1"
+    return None
+
+
+def _optional(check):
+    def wrapped(value):
+        return None if value is None else check(value)
+    return wrapped
+
+
+def _choice(*choices):
+    def check(value):
+        if str(value).upper() not in [str(c).upper() for c in choices]:
+            return f"must be one of {', '.join(choices)}"
+        return None
+    return check
+
+
+def _port(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        return "expected int"
+    if not 0 <= value <= 65535:
+        return "must be between 0 and 65535"
+    return None
+
+
+SCHEMA = {
+    "app.interval": _positive,
+    "app.hostname": _type(str),
+    "app.reload": _type(bool),
+    "paths.logs_dir": _type(str),
+    "paths.model_path": _type(str),
+    "paths.history_file": _type(str),
+    "paths.anomaly_file": _type(str),
+    "model.format": _choice("compact", "joblib"),
+    "logging.level": _choice(*LOG_LEVELS),
+    "logging.format": _choice("text", "json"),
+    "scoring.thresholds_file": _type(str),
+    "scoring.quantile": _positive,
+    "scoring.min_samples": _positive,
+    "cgroups.enabled": _type(bool),
+    "cgroups.root": _type(str),
+    "cgroups.targets": _type(str, list),
+    "cgroups.rediscover": _positive,
+    "drift.enabled": _type(bool),
+    "drift.bins": _positive,
+    "drift.window": _positive,
+    "drift.check_every": _positive,
+    "drift.psi_threshold": _positive,
+    "drift.rate_factor": _positive,
+    "drift.min_rate": _non_negative,
+    "drift.cooldown": _non_negative,
+    "drift.recent_share": _fraction,
+    "drift.min_samples": _positive,
+    "attribution.enabled": _type(bool),
+    "attribution.top_n": _positive,
+    "attribution.margin": _type(int, float),
+    "attribution.max_processes": _positive,
+    "attribution.budget": _positive,
+    "attribution.settle": _non_negative,
+    "attribution.max_age": _positive,
+    "sampling.adaptive": _type(bool),
+    "sampling.min_interval": _positive,
+    "sampling.max_interval": _positive,
+    "sampling.volatility_scale": _positive,
+    "sampling.backoff": _positive,
+    "sampling.margin_scale": _positive,
+    "durability.recover": _type(bool),
+    "durability.fsync_interval": _optional(_non_negative),
+    "storage.backend": _choice("jsonl", "sqlite"),
+    "storage.database": _type(str),
+    "storage.batch_size": _positive,
+    "storage.flush_interval": _non_negative,
+    "storage.retention_days": _optional(_positive),
+    "buffer.enabled": _type(bool),
+    "buffer.retention": _positive,
+    "buffer.block_size": _positive,
+    "fleet.output_file": _type(str),
+    "fleet.step": _positive,
+    "fleet.window": _positive,
+    "fleet.stride": _positive,
+    "fleet.min_hosts": _positive,
+    "fleet.corr_threshold": _type(int, float),
+    "fleet.fleet_fraction": _positive,
+    "fleet.excess_factor": _positive,
+    "forecast.enabled": _type(bool),
+    "forecast.window": _positive,
+    "forecast.min_samples": _positive,
+    "forecast.horizon": _positive,
+    "forecast.realert": _non_negative,
+    "forecast.capacity": _positive,
+    "incidents.enabled": _type(bool),
+    "incidents.realert": _non_negative,
+    "incidents.cooldown": _non_negative,
+    "incidents.max_open": _positive,
+    "notifier.enabled": _type(bool),
+    "notifier.queue_size": _positive,
+    "notifier.max_retries": _non_negative,
+    "notifier.replay_batch": _positive,
+    "metrics.enabled": _type(bool),
+    "metrics.host": _type(str),
+    "metrics.port": _port,
+    "query.host": _type(str),
+    "query.port": _port,
+    "query.cache_size": _non_negative,
+    "query.max_points": _positive,
+    "profiling.enabled": _type(bool),
+    "profiling.output_dir": _type(str),
+    "profiling.seconds": _positive,
+    "profiling.max_seconds": _positive,
+    "profiling.interval": _positive,
+    "profiling.all_threads": _type(bool),
+    "profiling.spans": _type(bool),
+}
+
+
+def flatten(config, prefix=""):
+    flat = {}
+    for key, value in config.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def validate_config(config):
+    """Raise ConfigError listing every schema violation."""
+    if not isinstance(config, dict):
+        raise ConfigError("config root must be a mapping")
+
+    flat = flatten(config)
+    errors = []
+    for key, check in SCHEMA.items():
+        if key not in flat:
+            errors.append(f"{key}: missing")
+            continue
+        problem = check(flat[key])
+        if problem:
+            errors.append(f"{key}: {problem} (got {flat[key]!r})")
+
+    if not errors:
+        if flat["sampling.min_interval"] > flat["sampling.max_interval"]:
+            errors.append("sampling.min_interval: must not exceed max_interval")
+        if flat["sampling.backoff"] < 1:
+            errors.append("sampling.backoff: must be at least 1")
+        if flat["scoring.quantile"] >= 1:
+            errors.append("scoring.quantile: must be below 1")
+
+    if errors:
+        raise ConfigError("invalid configuration: " + "; ".join(errors))
+    return config
+
+
+# Hot reload
+#
+# Purpose:
+# Change interval, logging or alert tuning without restarting the
+# agent (and paying for a model reload plus a monitoring gap).
+#
+# Flow:
+# config.yaml mtime/size changed  or  SIGHUP received
+# ↓
+# Load + environment overrides + validate
+# ↓
+# Diff against the running config
+# ↓
+# SAFE_FIELDS     → applied live by the agent
+# anything else   → rejected (kept at the running value) and logged
+#
+# The check is one os.stat() per loop cycle.
+
+SAFE_FIELDS = {
+    "app.interval",
+    "app.hostname",
+    "paths.history_file",
+    "paths.anomaly_file",
+    "logging.level",
+    "logging.format",
+    "drift.check_every",
+    "drift.psi_threshold",
+    "drift.rate_factor",
+    "drift.cooldown",
+    "drift.recent_share",
+    "drift.min_samples",
+    "attribution.top_n",
+    "attribution.margin",
+    "attribution.max_processes",
+    "attribution.budget",
+    "sampling.min_interval",
+    "sampling.max_interval",
+    "sampling.volatility_scale",
+    "sampling.backoff",
+    "sampling.margin_scale",
+    "forecast.window",
+    "forecast.min_samples",
+    "forecast.horizon",
+    "forecast.realert",
+    "forecast.capacity",
+    "incidents.realert",
+    "incidents.cooldown",
+    "incidents.max_open",
+    "profiling.spans",
+}
+
+
+def _restore(config, key, old):
+    node = config
+    parts = key.split(".")
+    for part in parts[:-1]:
+        node = node.setdefault(part, {})
+    if key in old:
+        node[parts[-1]] = old[key]
+    else:
+        node.pop(parts[-1], None)
+
+
+class ConfigWatcher:
+
+    def __init__(self, config, config_path=CONFIG_PATH):
+        self.config = config
+        self.config_path = config_path
+        self._stamp = self._stat()
+        self._requested = False
+        # rejected key -> value last reported, so a pending restart-only
+        # change is reported once rather than on every reload
+        self._pending = {}
+
+    def _stat(self):
+        try:
+            st = os.stat(self.config_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    # Safe to call from a signal handler.
+    def request_reload(self, *_):
+        self._requested = True
+
+    def poll(self):
+        """
+        Return (config, applied, rejected) when a reload happened,
+        otherwise None. Raises ConfigError if the new file is invalid;
+        the running config is left untouched in that case.
+        """
+        stamp = self._stat()
+        if not self._requested and stamp == self._stamp:
+            return None
+        self._requested = False
+        self._stamp = stamp
+
+        try:
+            candidate = load_config(self.config_path)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            raise ConfigError(f"cannot load {self.config_path}: {e}")
+        validate_config(candidate)
+
+        old = flatten(self.config)
+        new = flatten(candidate)
+        applied, rejected, pending = [], [], {}
+        for key in sorted(set(old) | set(new)):
+            if old.get(key) == new.get(key):
+                continue
+            if key in SAFE_FIELDS:
+                applied.append((key, old.get(key), new.get(key)))
+                continue
+            # rejected fields keep their running value
+            _restore(candidate, key, old)
+            pending[key] = new.get(key)
+            if self._pending.get(key, old.get(key)) != new.get(key):
+                rejected.append((key, old.get(key), new.get(key)))
+        self._pending = pending
+
+        self.config = candidate
+        return candidate, applied, rejected
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Crash-safe JSONL appends
+#
+# Purpose:
+# If the agent dies in the middle of a write, snapshot_history.jsonl
+# ends in half a record and every reader that uses json.loads on each
+# line fails on it.
+#
+# Record framing:
+# A record is one JSON object followed by "\n", written with a single
+# os.write() on an O_APPEND descriptor, so a record is either complete
+# (newline-terminated and parseable) or it is the torn tail of the
+# file. The newline is the commit marker; the JSON parse is the check.
+# A final line that parses as a whole record but lost its newline is
+# the one exception: the record is complete, so recover() keeps it and
+# writes the missing newline.
+# The file stays plain JSONL, so pandas, parallel_ingest and any other
+# tool read it unchanged.
+#
+# Flow:
+# startup → recover(): walk back from the end of the file over
+#           anything that is not a complete, parseable record
+#           (half-written line, zero-filled blocks after a power
+#           loss) and truncate it away
+# ↓
+# AppendLog.append(record)   one write() per record
+# ↓
+# fsync policy (group commit):
+#   fsync_interval = None → never fsync; the OS flushes (survives a
+#                           process crash, not a power loss)
+#   fsync_interval = 0    → fsync after every record
+#   fsync_interval = N    → a background thread fsyncs every N seconds
+#                           if anything was written since the last one,
+#                           so every record written in between shares
+#                           one fsync; at most ~N seconds are at risk,
+#                           however long the gap until the next append
+#
+# recover() stops at the last good record; damage further up the file
+# is not a torn tail and is left to the tolerant readers.
+
+TAIL_BLOCK = 64 * 1024
+
+
+def _is_record(line):
+    try:
+        return isinstance(json.loads(line), dict)
+    except ValueError:
+        return False
+
+
+def recover(path):
+    """Truncate a torn or garbage tail; returns the bytes removed."""
+    if not os.path.exists(path):
+        return 0
+
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+
+    with open(path, "rb") as f:
+        start = max(size - TAIL_BLOCK, 0)
+        f.seek(start)
+        tail = f.read()
+
+    last = tail.rfind(b"\n") + 1
+    if (not tail.endswith(b"\n") and (last > 0 or start == 0)
+            and _is_record(tail[last:].strip())):
+        # whole record, only the newline was lost
+        with open(path, "ab") as f:
+            f.write(b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        logger.warning("Recovered %s: terminated the last record", path)
+        return 0
+
+    # Walk back from the end until the last complete, parseable record.
+    # `end` is the offset within `tail` just past the last byte kept.
+    end = len(tail)
+    while end > 0:
+        if tail[end - 1:end] != b"\n":
+            # unterminated: cut back to the previous newline
+            end = tail.rfind(b"\n", 0, end) + 1
+            continue
+
+        begin = tail.rfind(b"\n", 0, end - 1) + 1
+        if begin == 0 and start > 0:
+            # record reaches past the block read; keep it
+            break
+        line = tail[begin:end - 1].strip()
+        if not line or _is_record(line):
+            break
+        end = begin
+
+    new_size = start + end
+    removed = size - new_size
+    if removed:
+        with open(path, "r+b") as f:
+            f.truncate(new_size)
+            f.flush()
+            os.fsync(f.fileno())
+        logger.warning(
+            "Recovered %s: dropped %s byte(s) of torn or corrupt tail",
+            path, removed
+        )
+    return removed
+
+
+class AppendLog:
+
+    def __init__(self, path, fsync_interval=None, recover_tail=True):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if recover_tail:
+            recover(path)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.stats = {"records": 0, "fsyncs": 0}
+        self._stop = threading.Event()
+        self._syncer = None
+        if fsync_interval:
+            self._syncer = threading.Thread(
+                target=self._sync_loop, name="iclim-fsync", daemon=True
+            )
+            self._syncer.start()
+
+    def append(self, record):
+        data = (json.dumps(record) + "\n").encode()
+        written = os.write(self._fd, data)
+        while written < len(data):
+            # short write: finish it so the record stays whole
+            written += os.write(self._fd, data[written:])
+        with self._lock:
+            self.stats["records"] += 1
+            self._dirty = True
+
+        if self.fsync_interval == 0:
+            self.sync()
+
+    def sync(self):
+        # clear the flag first: a record appended during the fsync
+        # marks the log dirty again for the next one
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+        os.fsync(self._fd)
+        with self._lock:
+            self.stats["fsyncs"] += 1
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                self.sync()
+            except OSError as e:
+                logger.error("fsync of %s failed: %s", self.path, e)
+
+    def close(self):
+        if self._fd is None:
+            return
+        if self._syncer is not None:
+            self._stop.set()
+            self._syncer.join()
+            self._syncer = None
+        if self.fsync_interval is not None:
+            self.sync()
+        os.close(self._fd)
+        self._fd = None
+
+
+def log_from_config(path, config):
+    section = config["durability"]
+    return AppendLog(
+        path,
+        fsync_interval=section["fsync_interval"],
+        recover_tail=section["recover"],
+    )
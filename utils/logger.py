@@ -1,7 +1,77 @@
+import atexit
+import json
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging
+#
+# Purpose:
+# The sampling loop should only pay for building the message and
+# putting it on a queue. Layout (timestamp, level, JSON) and file/
+# console I/O happen on a QueueListener thread.
+#
+# Flow:
+# logger.info("... %s", value)
+# ↓ (dropped here if below the configured level)
+# QueueHandler: msg % args, then enqueue
+# ↓
+# QueueListener thread
+# ↓
+# FileHandler (logs/iclim.log) + StreamHandler
+#
+# Messages should use %-style arguments rather than f-strings so the
+# string is only built for records that are actually emitted.
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(message)s"
+
+_listener = None
+_handlers = []
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+# The stock QueueHandler runs the full formatter in the calling
+# thread (so the record can cross process boundaries). Here only
+# msg % args is resolved before enqueueing: the arguments may be
+# mutable (a config dict) and must be logged as they were at the
+# call. Exception text and layout are left to the listener thread.
+class _EnqueueOnlyHandler(QueueHandler):
+
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _make_formatter(fmt):
+    if fmt == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
 
 def setup_logger():
+    global _listener
+
     log_dir = "logs"
     log_file = "iclim.log"
 
@@ -11,21 +81,57 @@ def setup_logger():
     log_path = os.path.join(log_dir, log_file)
 
     logger = logging.getLogger("ICLIM")
-    logger.setLevel(logging.INFO)
 
     # Avoid duplicate handlers
     if not logger.handlers:
+        # config validation reports a bad LOG_LEVEL properly; importing
+        # a module must not fail on it
+        level = os.getenv("LOG_LEVEL", "INFO").upper()
+        invalid_level = not isinstance(logging.getLevelName(level), int)
+        logger.setLevel("INFO" if invalid_level else level)
+        logger.propagate = False
+
         file_handler = logging.FileHandler(log_path)
         console_handler = logging.StreamHandler()
 
-        formatter = logging.Formatter(
-            "%(asctime)s | %(levelname)s | %(message)s"
-        )
-
+        formatter = _make_formatter("text")
         file_handler.setFormatter(formatter)
         console_handler.setFormatter(formatter)
+        _handlers.extend([file_handler, console_handler])
+
+        log_queue = queue.Queue(-1)
+        logger.addHandler(_EnqueueOnlyHandler(log_queue))
+
+        _listener = QueueListener(
+            log_queue, file_handler, console_handler,
+            respect_handler_level=True
+        )
+        _listener.start()
+        # drain whatever is still queued when the process exits
+        atexit.register(_stop_listener)
+
+        if invalid_level:
+            logger.warning(
+                "Unknown LOG_LEVEL %r, logging at INFO",
+                os.getenv("LOG_LEVEL")
+            )
+
+    return logger
+
+
+# Apply the logging section of config.yaml (level, text/json format).
+# Called once the config has been loaded.
+def configure_logging(config):
+    logger = setup_logger()
+    section = config["logging"]
+
+    level = str(section.get("level", "INFO")).upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"Unknown logging level: {section.get('level')}")
+    logger.setLevel(level)
 
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+    formatter = _make_formatter(section.get("format", "text"))
+    for handler in _handlers:
+        handler.setFormatter(formatter)
 
-    return logger
\ No newline at end of file
+    return logger
@@ -0,0 +1,312 @@
+import ipaddress
+import json
+import math
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Agent self-instrumentation
+#
+# Purpose:
+# Expose how long the agent spends collecting, scoring and writing,
+# in the Prometheus text format, on a small HTTP endpoint.
+#
+# Hot path:
+# Metrics are only ever updated from the sampling loop thread, so
+# observe()/inc() are plain attribute and list updates with no lock.
+# The scrape thread reads the same values; under the GIL each read is
+# consistent on its own, and a scrape that lands mid-update is at most
+# one sample behind, which Prometheus tolerates by design.
+#
+# Flow:
+# main() loop ── observe()/inc() ──> registry
+#                                       │
+# GET /metrics ── render() ─────────────┘
+#
+# With a profiler (utils/profiler.py) the same endpoint also serves
+#   GET /profile?seconds=N  samples for N seconds, answers with the
+#                           collapsed stacks (409 while one runs)
+#   GET /spans              per-phase span totals as JSON
+# Those two answer loopback clients only (403 otherwise), whatever
+# address the endpoint binds to: a profile costs CPU and writes files.
+#
+# With the in-memory metric buffer (utils/timeseries.py):
+#   GET /range?seconds=N[&server=S][&metric=M]
+#   GET /range?start=T[&end=T][&server=S][&metric=M]   (epoch seconds)
+#                           recent samples as JSON, decoded from memory
+#                           without touching the history on disk;
+#                           server defaults to the only one buffered
+# Loopback clients only as well: it is raw per-host history, not
+# aggregate metrics.
+
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self):
+        return [f"{self.name} {_format_value(self.value)}"]
+
+
+class Gauge:
+
+    kind = "gauge"
+
+    # A gauge either holds a value set by the loop or pulls one from
+    # `source` at scrape time (e.g. the notifier queue depth).
+    def __init__(self, name, help_text, source=None):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.source = source
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        value = self.source() if self.source is not None else self.value
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.bounds = tuple(sorted(buckets))
+        # one slot per bound plus the +Inf overflow slot
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Context manager for timing a block:
+    #   with histogram.time(): ...
+    def time(self):
+        return _Timer(self)
+
+    def render(self):
+        counts = list(self.counts)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            lines.append(
+                f'{self.name}_bucket{{le="{_format_value(bound)}"}} '
+                f"{cumulative}"
+            )
+        lines.append(f"{self.name}_sum {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class _Timer:
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name, help_text, source=None):
+        return self._register(Gauge(name, help_text, source))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _is_loopback(address):
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+def _make_handler(registry, profiler=None, recent=None):
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/metrics":
+                self._send(
+                    registry.render(),
+                    "text/plain; version=0.0.4; charset=utf-8"
+                )
+            elif (url.path in ("/profile", "/spans") and profiler is not None
+                    and not _is_loopback(self.client_address[0])):
+                self.send_error(403, "profiling is only served to localhost")
+            elif url.path == "/profile" and profiler is not None:
+                self._profile(parse_qs(url.query))
+            elif url.path == "/spans" and profiler is not None:
+                summary = (
+                    profiler.tracer.summary()
+                    if profiler.tracer is not None else {}
+                )
+                self._send(json.dumps(summary), "application/json")
+            elif url.path == "/range" and recent is not None:
+                if not _is_loopback(self.client_address[0]):
+                    self.send_error(
+                        403, "recent samples are only served to localhost"
+                    )
+                    return
+                self._range(parse_qs(url.query))
+            else:
+                self.send_error(404)
+
+        def _range(self, query):
+            bounds = {}
+            for name in ("seconds", "start", "end"):
+                if name not in query:
+                    continue
+                try:
+                    bounds[name] = float(query[name][0])
+                except ValueError:
+                    bounds[name] = math.nan
+                if not math.isfinite(bounds[name]) or bounds[name] < 0:
+                    self.send_error(400, f"{name} must be a number >= 0")
+                    return
+            if ("seconds" in bounds) == ("start" in bounds):
+                self.send_error(400, "give either seconds or start")
+                return
+
+            servers = recent.servers()
+            server = query.get("server", [None])[0]
+            if server is None and len(servers) == 1:
+                server = servers[0]
+            if server not in servers:
+                self.send_error(
+                    400, f"server must be one of {', '.join(servers)}"
+                )
+                return
+            metrics = query.get("metric", recent.metrics)
+            unknown = [m for m in metrics if m not in recent.metrics]
+            if unknown:
+                self.send_error(
+                    400, f"metric must be one of {', '.join(recent.metrics)}"
+                )
+                return
+
+            start = bounds.get("start")
+            end = bounds.get("end")
+            if start is None:
+                start = time.time() - bounds["seconds"]
+            series = {}
+            for metric in metrics:
+                timestamps, values = recent.range(server, metric, start, end)
+                series[metric] = {
+                    "timestamps": timestamps.tolist(),
+                    "values": values.tolist(),
+                }
+            self._send(
+                json.dumps({"server": server, "series": series}),
+                "application/json"
+            )
+
+        def _profile(self, query):
+            seconds = None
+            if "seconds" in query:
+                try:
+                    seconds = float(query["seconds"][0])
+                except ValueError:
+                    seconds = None
+                if seconds is None or not math.isfinite(seconds) \
+                        or seconds <= 0:
+                    self.send_error(400, "seconds must be a positive number")
+                    return
+            result = profiler.run(seconds)
+            if result is None:
+                self.send_error(409, "a profiling session is already running")
+                return
+            path, text = result
+            self._send(
+                text, "text/plain; charset=utf-8", {"X-Profile-Path": path}
+            )
+
+        def _send(self, text, content_type, headers=None):
+            body = text.encode("utf-8")
+            self.send_response(200)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # keep scrapes out of the agent log
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+def start_metrics_server(registry, host="127.0.0.1", port=9108,
+                         profiler=None, recent=None):
+    server = ThreadingHTTPServer(
+        (host, port), _make_handler(registry, profiler, recent)
+    )
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name="iclim-metrics", daemon=True
+    )
+    thread.start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,363 @@
+import heapq
+import json
+import os
+import queue
+import random
+import socket
+import threading
+import time
+import urllib.request
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Alert dispatch
+#
+# Purpose:
+# Anomaly records need to reach webhooks and syslog without ever
+# stalling the sampling loop. The loop only does a non-blocking put
+# onto a bounded queue; a single worker thread drains it.
+#
+# Flow:
+# notify(record)
+# ↓
+# Bounded queue ── full ──> spill file (JSONL on disk)
+# ↓
+# Worker thread
+# ↓
+# Sinks (webhook / syslog / file)
+# ↓ failure
+# Retry heap (exponential backoff) ── gave up ──> spill file
+#
+# Spilled records are replayed by the worker once the queue has room
+# again, so an outage at the receiver costs disk space, not alerts.
+# Each spill line keeps the sinks the record still has to reach
+# ({"record": ..., "sinks": [...]}), so a replay does not send it again
+# to sinks that already took it; plain record lines go to every sink.
+# Without a spill file, records that gave up are counted failed.
+# Replay runs `replay_batch` records at a time with the live queue
+# checked between batches, so a large spill never holds up new alerts.
+# stats is written from the caller (notify) and the worker, and guarded
+# by a lock; read it through metrics().
+
+
+# Sinks
+#
+# A sink is anything with a `name` and a `send(record)` method that
+# raises on failure. Failures are retried by the notifier.
+
+class WebhookSink:
+
+    name = "webhook"
+
+    def __init__(self, url, timeout=5, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json"}
+        self.headers.update(headers or {})
+
+    def send(self, record):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(record).encode("utf-8"),
+            headers=self.headers,
+            method="POST",
+        )
+        # urlopen raises HTTPError for 4xx/5xx responses
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class SyslogSink:
+
+    name = "syslog"
+
+    # Facility local0, severity warning.
+    PRIORITY = 16 * 8 + 4
+
+    def __init__(self, address="/dev/log", port=514, ident="iclim"):
+        self.ident = ident
+        if address.startswith("/"):
+            self.target = address
+            self.family = socket.AF_UNIX
+        else:
+            self.target = (address, port)
+            self.family = socket.AF_INET
+        self._sock = None
+
+    def send(self, record):
+        message = f"<{self.PRIORITY}>{self.ident}: {json.dumps(record)}"
+        if self._sock is None:
+            self._sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        try:
+            self._sock.sendto(message.encode("utf-8"), self.target)
+        except OSError:
+            self._sock.close()
+            self._sock = None
+            raise
+
+
+class FileSink:
+
+    name = "file"
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+class Notifier:
+
+    def __init__(self, sinks, queue_size=1000, max_retries=5,
+                 backoff_base=1.0, backoff_max=60.0, spill_file=None,
+                 replay_batch=100):
+        self.sinks = list(sinks)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.spill_file = spill_file
+        self.replay_batch = replay_batch
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._retries = []
+        self._retry_seq = 0
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # open spill file being replayed, or None
+        self._draining = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {
+            "enqueued": 0,
+            "delivered": 0,
+            "retried": 0,
+            "failed": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "latency_last": 0.0,
+            "latency_max": 0.0,
+            "latency_sum": 0.0,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="iclim-notifier", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    # Called from the sampling loop. Never blocks on the network.
+    def notify(self, record):
+        item = (record, time.monotonic(), [s.name for s in self.sinks], 0)
+        try:
+            self._queue.put_nowait(item)
+            self._count("enqueued")
+        except queue.Full:
+            self._spill(record)
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _spill(self, record, sinks=None):
+        if not self.spill_file:
+            self._count("failed")
+            return
+        if sinks is None:
+            sinks = [s.name for s in self.sinks]
+        line = json.dumps({"record": record, "sinks": list(sinks)})
+        with self._spill_lock:
+            with open(self.spill_file, "a") as f:
+                f.write(line + "\n")
+        self._count("spilled")
+
+    def _replay_spill(self):
+        """Replay up to replay_batch spilled records.
+
+        Returns True while the spill has records left to replay.
+        """
+        if self._draining is None:
+            if not self.spill_file:
+                return False
+            draining = self.spill_file + ".draining"
+            # a replay cut short by a restart is finished first
+            if not os.path.exists(draining):
+                with self._spill_lock:
+                    if not os.path.exists(self.spill_file):
+                        return False
+                    os.replace(self.spill_file, draining)
+            self._draining = open(draining, "r")
+
+        replayed = 0
+        while replayed < self.replay_batch:
+            line = self._draining.readline()
+            if not line:
+                self._draining.close()
+                os.remove(self._draining.name)
+                self._draining = None
+                return False
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            pending = [s.name for s in self.sinks]
+            if isinstance(record, dict) and set(record) == {"record", "sinks"}:
+                pending = [name for name in record["sinks"] if name in pending]
+                record = record["record"]
+            replayed += 1
+            self._count("replayed")
+            self._deliver((record, time.monotonic(), pending, 0))
+        return True
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return delay + random.uniform(0, delay * 0.1)
+
+    def _deliver(self, item):
+        record, enqueued_at, pending, attempt = item
+        remaining = []
+
+        for sink in self.sinks:
+            if sink.name not in pending:
+                continue
+            try:
+                sink.send(record)
+            except Exception as e:
+                logger.debug("Notifier sink %s failed: %s", sink.name, e)
+                remaining.append(sink.name)
+
+        if not remaining:
+            latency = time.monotonic() - enqueued_at
+            with self._stats_lock:
+                self.stats["delivered"] += 1
+                self.stats["latency_last"] = latency
+                self.stats["latency_sum"] += latency
+                if latency > self.stats["latency_max"]:
+                    self.stats["latency_max"] = latency
+            return
+
+        if attempt >= self.max_retries:
+            logger.warning(
+                "Notifier gave up after %s attempts (sinks: %s)%s",
+                attempt + 1, ", ".join(remaining),
+                "; spilled for replay" if self.spill_file else ""
+            )
+            self._spill(record, remaining)
+            return
+
+        # Keep the retry heap as bounded as the queue; overflow spills.
+        if len(self._retries) >= self._queue.maxsize:
+            self._spill(record, remaining)
+            return
+
+        self._count("retried")
+        self._retry_seq += 1
+        heapq.heappush(
+            self._retries,
+            (time.monotonic() + self._backoff(attempt), self._retry_seq,
+             (record, enqueued_at, remaining, attempt + 1))
+        )
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            now = time.monotonic()
+            while self._retries and self._retries[0][0] <= now:
+                _, _, item = heapq.heappop(self._retries)
+                self._deliver(item)
+
+            timeout = 0.5
+            if self._retries:
+                timeout = min(timeout, max(self._retries[0][0] - now, 0))
+            elif self._draining is not None:
+                # replay in progress: take live records between batches
+                timeout = 0
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                if not self._retries:
+                    self._replay_spill()
+                continue
+
+            self._deliver(item)
+            self._queue.task_done()
+
+        # the rest of an unfinished replay stays in the .draining file
+        # and is picked up on the next start
+        if self._draining is not None:
+            self._draining.close()
+            self._draining = None
+
+        # retries not yet due are spilled so they survive a restart
+        while self._retries:
+            _, _, item = heapq.heappop(self._retries)
+            self._spill(item[0], item[2])
+
+    # Stop the worker after the queue has drained. The worker spills
+    # its pending retries itself on the way out, so nothing else ever
+    # touches the retry heap.
+    def close(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(
+                    "Notifier still delivering after %ss; pending retries "
+                    "are spilled when it finishes", timeout
+                )
+
+    def metrics(self):
+        with self._stats_lock:
+            snapshot = dict(self.stats)
+        delivered = snapshot["delivered"]
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["retry_depth"] = len(self._retries)
+        snapshot["latency_avg"] = (
+            snapshot["latency_sum"] / delivered if delivered else 0.0
+        )
+        return snapshot
+
+
+def notifier_from_config(config, base_dir):
+    section = config["notifier"]
+    sinks_config = section["sinks"]
+    sinks = []
+
+    webhook = sinks_config["webhook"]
+    if webhook["enabled"]:
+        sinks.append(
+            WebhookSink(webhook["url"], timeout=webhook["timeout"])
+        )
+
+    syslog = sinks_config["syslog"]
+    if syslog["enabled"]:
+        sinks.append(
+            SyslogSink(syslog["address"], port=syslog["port"])
+        )
+
+    file_sink = sinks_config["file"]
+    if file_sink["enabled"]:
+        sinks.append(FileSink(os.path.join(base_dir, file_sink["path"])))
+
+    spill_file = None
+    if section["spill_file"]:
+        spill_file = os.path.join(base_dir, section["spill_file"])
+
+    return Notifier(
+        sinks,
+        queue_size=section["queue_size"],
+        max_retries=section["max_retries"],
+        backoff_base=section["backoff_base"],
+        backoff_max=section["backoff_max"],
+        spill_file=spill_file,
+        replay_batch=section["replay_batch"],
+    ).start()
@@ -0,0 +1,246 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# On-demand profiling
+#
+# Purpose:
+# When the agent's CPU use spikes in production, show where the time
+# goes inside the main loop without restarting it under a profiler.
+#
+# Stack sampler:
+# SIGUSR2 or GET /profile?seconds=N (on the metrics endpoint)
+# ↓
+# sampler thread, every `interval` seconds:
+#   sys._current_frames() → stack of the main thread (or every thread)
+#   → "thread;outer (file:line);...;inner (file:line)" += 1
+# ↓ after N seconds
+# <output_dir>/profile-<time>.collapsed
+#   one "stack count" line per distinct stack: the input format of
+#   flamegraph.pl, speedscope and inferno
+#
+# The sampled threads keep running; the only cost is the sampler
+# thread taking the GIL for a stack walk every `interval` (about 1 %
+# at 5 ms). Samples are wall-clock: a loop waiting in clock.sleep()
+# shows up as time.sleep, so idle and busy time are both visible.
+# One session runs at a time.
+#
+# Spans:
+# with tracer.span("score"): ...
+# Disabled, span() returns a shared no-op context manager, so a span
+# costs one method call and an attribute check. Enabled (config, or
+# for the length of a profiling session), each span adds its duration
+# to per-phase totals, reported by summary() and written next to the
+# profile as <profile>.spans.
+
+DEFAULT_INTERVAL = 0.005
+
+
+class _NoopSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Tracer:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        # phase -> [count, total seconds, max seconds]
+        self._phases = {}
+
+    def span(self, name):
+        if not self.enabled:
+            return _NOOP
+        return _Span(self, name)
+
+    def record(self, name, seconds):
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = [0, 0.0, 0.0]
+        phase[0] += 1
+        phase[1] += seconds
+        if seconds > phase[2]:
+            phase[2] = seconds
+
+    def summary(self):
+        return {
+            name: {
+                "count": count,
+                "total": round(total, 6),
+                "avg": round(total / count, 6) if count else 0.0,
+                "max": round(peak, 6),
+            }
+            for name, (count, total, peak) in list(self._phases.items())
+        }
+
+    def reset(self):
+        self._phases = {}
+
+
+def _label(code, labels):
+    label = labels.get(code)
+    if label is None:
+        label = labels[code] = (
+            f"{code.co_name} "
+            f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        )
+    return label
+
+
+def collapse(counts):
+    """Collapsed-stack text ("stack count" per line), hottest first."""
+    return "".join(
+        f"{stack} {count}\n" for stack, count in counts.most_common()
+    )
+
+
+class StackSampler:
+
+    def __init__(self, output_dir, interval=DEFAULT_INTERVAL, seconds=30,
+                 max_seconds=300, all_threads=False, tracer=None):
+        self.output_dir = output_dir
+        self.interval = interval
+        # session length when none is asked for, and the cap on asks
+        self.seconds = seconds
+        self.max_seconds = max_seconds
+        self.all_threads = all_threads
+        self.tracer = tracer
+        self.target = threading.main_thread().ident
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    def sample(self, seconds):
+        """Sample stacks for `seconds`. Returns (Counter, samples taken)."""
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        labels = {}
+        counts = Counter()
+        taken = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frames = sys._current_frames()
+            if not self.all_threads:
+                frame = frames.get(self.target)
+                frames = {self.target: frame} if frame is not None else {}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame.f_code, labels))
+                    frame = frame.f_back
+                stack.append(names.get(ident) or str(ident))
+                stack.reverse()
+                counts[";".join(stack)] += 1
+            taken += 1
+            time.sleep(self.interval)
+        return counts, taken
+
+    def run(self, seconds=None):
+        """One profiling session; blocks for `seconds`.
+
+        Returns (path written, collapsed text), or None when a session
+        is already running.
+        """
+        if seconds is None:
+            seconds = self.seconds
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError(f"seconds must be positive, got {seconds!r}")
+        seconds = min(seconds, self.max_seconds)
+        with self._lock:
+            if self._running:
+                return None
+            self._running = True
+
+        # spans are recorded for the session unless always on
+        traced = self.tracer is not None and not self.tracer.enabled
+        if traced:
+            self.tracer.reset()
+            self.tracer.enabled = True
+        try:
+            logger.info("Profiling for %ss", seconds)
+            counts, taken = self.sample(seconds)
+        finally:
+            if traced:
+                self.tracer.enabled = False
+            self._running = False
+
+        text = collapse(counts)
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(
+            self.output_dir,
+            f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed"
+        )
+        with open(path, "w") as f:
+            f.write(text)
+        if self.tracer is not None:
+            with open(path[:-len(".collapsed")] + ".spans", "w") as f:
+                for name, phase in sorted(self.tracer.summary().items()):
+                    f.write(
+                        f"{name} count={phase['count']} "
+                        f"total={phase['total']}s avg={phase['avg']}s "
+                        f"max={phase['max']}s\n"
+                    )
+        logger.info(
+            "Profile written to %s (%s samples, %s distinct stacks)",
+            path, taken, len(counts)
+        )
+        return path, text
+
+    def start(self, seconds=None):
+        """run() on a background thread; False when one is running."""
+        if self._running:
+            return False
+        threading.Thread(
+            target=self.run, args=(seconds,), name="iclim-profiler",
+            daemon=True
+        ).start()
+        return True
+
+
+def profiler_from_config(config, base_dir):
+    section = config["profiling"]
+    tracer = Tracer(enabled=section["spans"])
+    sampler = StackSampler(
+        os.path.join(base_dir, section["output_dir"]),
+        interval=section["interval"],
+        seconds=section["seconds"],
+        max_seconds=section["max_seconds"],
+        all_threads=section["all_threads"],
+        tracer=tracer,
+    )
+    return sampler, tracer
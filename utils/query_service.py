@@ -0,0 +1,766 @@
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from analysis.parallel_ingest import OPTIONAL, _loads, _parse_lines
+from utils.logger import setup_logger
+from utils.sqlite_store import is_database
+
+logger = setup_logger()
+
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+METRICS = ("cpu", "mem", "disk", "score")
+
+AGGREGATES = ("count", "avg", "min", "max", "p95")
+
+# 9999-12-31 23:59:59; anything beyond is not a timestamp
+MAX_EPOCH = 253402300799
+
+# Read-side query API
+#
+# Purpose:
+# Dashboards and scripts each parse snapshot_history.jsonl and
+# anomaly_events.jsonl themselves, in full, on every refresh. This
+# serves range, aggregate and top-anomaly queries over both files
+# from memory, over local HTTP/JSON.
+#
+# Flow:
+# snapshot_history.jsonl / anomaly_events.jsonl
+# ↓ tail: every request stats the files; only bytes past the last
+#   offset are read, up to the last complete line
+# ↓ (a file that shrank or was replaced is re-read from the start)
+# index:
+#   history: per server, columns (epoch seconds, cpu, mem, disk, score)
+#            in arrays that grow by doubling, kept sorted by time
+#   events:  (epoch seconds, score, server, row) columns + the records
+# ↓
+# query: searchsorted on the time column, numpy for the rest
+# ↓
+# LRU result cache: (endpoint, parameters) → response body
+#
+# Cache invalidation:
+# Each cached response is tagged with the file, the server (or all)
+# and the end of its time range. An append to that file drops the
+# entries for the servers it touched whose range reaches the new
+# rows; open-ended ranges (no `end`, or `last`) always do. Closed
+# ranges in the past stay cached.
+#
+# Endpoints (GET, JSON):
+#   /servers
+#   /range?server=&start=&end=&last=&metrics=cpu,mem
+#   /aggregate?metric=cpu&bucket=300&fn=avg,max,p95&server=&start=&end=&last=
+#   /top?limit=10&source=history|events&server=&start=&end=&last=
+#   /events?event=&server=&start=&end=&last=&limit=
+#   /stats
+# start/end: "YYYY-MM-DD HH:MM:SS" or epoch seconds. last=N: the N
+# seconds up to the newest indexed row. server omitted: every server.
+#
+# Timestamps are naive, as written by the agent; epoch seconds here
+# treat them as UTC.
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _epoch(value):
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is not None:
+        if not math.isfinite(number) or abs(number) > MAX_EPOCH:
+            raise QueryError(f"out of range: {value!r}")
+        return int(number)
+    try:
+        parsed = np.datetime64(value.replace(" ", "T"), "s")
+    except ValueError:
+        raise QueryError(f"not a timestamp: {value!r}") from None
+    if np.isnat(parsed):
+        raise QueryError(f"not a timestamp: {value!r}")
+    return int(parsed.astype(np.int64))
+
+
+def _int(params, name, default):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise QueryError(f"{name} must be an integer") from None
+    if value < 0:
+        raise QueryError(f"{name} must not be negative")
+    return value
+
+
+def _format(epochs):
+    if not len(epochs):
+        return []
+    text = np.datetime_as_string(epochs.astype("datetime64[s]"), unit="s")
+    return np.char.replace(text, "T", " ").tolist()
+
+
+def _values(array):
+    # JSON has no NaN
+    values = array.tolist()
+    if np.isnan(array).any():
+        return [None if v != v else v for v in values]
+    return values
+
+
+class Columns:
+
+    def __init__(self, dtypes):
+        self.dtypes = dtypes
+        self._arrays = {
+            name: np.empty(0, dtype=dtype) for name, dtype in dtypes.items()
+        }
+        self.size = 0
+
+    def add(self, columns):
+        """Append rows (dict of equal-length arrays); keeps time order."""
+        n = len(columns["ts"])
+        if n == 0:
+            return
+        arrays = self._arrays
+        if self.size + n > len(arrays["ts"]):
+            capacity = max(2 * (self.size + n), 1024)
+            for name, dtype in self.dtypes.items():
+                grown = np.empty(capacity, dtype=dtype)
+                grown[:self.size] = arrays[name][:self.size]
+                arrays[name] = grown
+        end = self.size + n
+        for name in self.dtypes:
+            arrays[name][self.size:end] = columns[name]
+        unordered = (
+            self.size and columns["ts"].min() < arrays["ts"][self.size - 1]
+        ) or np.any(np.diff(columns["ts"]) < 0)
+        self.size = end
+        if unordered:
+            # new arrays: views handed out earlier must not change
+            order = np.argsort(arrays["ts"][:end], kind="stable")
+            self._arrays = {
+                name: np.concatenate([values[:end][order], values[end:]])
+                for name, values in arrays.items()
+            }
+
+    def view(self):
+        """Read-only snapshot; later appends never modify it."""
+        return {name: values[:self.size] for name, values in self._arrays.items()}
+
+
+class TailReader:
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._inode = None
+
+    def read(self):
+        """(reset, complete lines appended since the last call)."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            reset = self.offset > 0
+            self.offset = 0
+            self._inode = None
+            return reset, b""
+        reset = st.st_ino != self._inode or st.st_size < self.offset
+        if reset:
+            self.offset = 0
+            self._inode = st.st_ino
+        if st.st_size == self.offset:
+            return reset, b""
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(st.st_size - self.offset)
+        # a torn last line waits for its newline
+        cut = data.rfind(b"\n") + 1
+        self.offset += cut
+        return reset, data[:cut]
+
+
+class HistoryIndex:
+
+    DTYPES = {
+        "ts": np.int64, "cpu": np.float64, "mem": np.float64,
+        "disk": np.float64, "score": np.float64,
+    }
+
+    def __init__(self, path):
+        self.tail = TailReader(path)
+        self.series = {}
+        self.bad = 0
+        self.latest = None
+
+    def refresh(self):
+        """Index appended rows. Returns (reset, {server: earliest new ts})."""
+        reset, data = self.tail.read()
+        if reset:
+            self.series = {}
+            self.bad = 0
+            self.latest = None
+        if not data:
+            return reset, {}
+
+        ts, cpu, mem, disk, *optional, codes, vocab, bad = _parse_lines(data)
+        self.bad += bad
+        if not len(ts):
+            return reset, {}
+        ts = ts // 1_000_000_000
+        codes = np.asarray(codes, dtype=np.int32)
+        columns = {
+            "ts": ts, "cpu": np.asarray(cpu), "mem": np.asarray(mem),
+            "disk": np.asarray(disk),
+            "score": np.asarray(optional[OPTIONAL.index("score")]),
+        }
+        appended = {}
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(vocab) + 1))
+        for code, server in enumerate(vocab):
+            rows = order[bounds[code]:bounds[code + 1]]
+            if not len(rows):
+                continue
+            series = self.series.get(server)
+            if series is None:
+                series = self.series[server] = Columns(self.DTYPES)
+            series.add({name: values[rows] for name, values in columns.items()})
+            appended[server] = int(ts[rows].min())
+        newest = int(ts.max())
+        self.latest = newest if self.latest is None else max(self.latest, newest)
+        return reset, appended
+
+    def rows(self):
+        return sum(s.size for s in self.series.values())
+
+
+class EventIndex:
+
+    DTYPES = {
+        "ts": np.int64, "score": np.float64, "server": np.int32,
+        "row": np.int64,
+    }
+
+    def __init__(self, path):
+        self.tail = TailReader(path)
+        self._reset()
+
+    def _reset(self):
+        self.columns = Columns(self.DTYPES)
+        self.records = []
+        self.servers = {}
+        self.bad = 0
+        self.latest = None
+
+    def refresh(self):
+        reset, data = self.tail.read()
+        if reset:
+            self._reset()
+        if not data:
+            return reset, {}
+
+        ts, scores, codes, rows = [], [], [], []
+        appended = {}
+        for line in data.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                record = _loads(line)
+                epoch = _epoch(record["timestamp"])
+                score = record.get("score")
+                score = np.nan if score is None else float(score)
+            except (ValueError, KeyError, TypeError):
+                self.bad += 1
+                continue
+            server = record.get("server")
+            code = self.servers.setdefault(server, len(self.servers))
+            ts.append(epoch)
+            scores.append(score)
+            codes.append(code)
+            rows.append(len(self.records))
+            self.records.append(record)
+            appended[server] = min(appended.get(server, epoch), epoch)
+
+        if ts:
+            self.columns.add({
+                "ts": np.array(ts, dtype=np.int64),
+                "score": np.array(scores),
+                "server": np.array(codes, dtype=np.int32),
+                "row": np.array(rows, dtype=np.int64),
+            })
+            newest = max(ts)
+            self.latest = (
+                newest if self.latest is None else max(self.latest, newest)
+            )
+        return reset, appended
+
+
+class ResultCache:
+
+    def __init__(self, size=256):
+        self.size = size
+        # key -> (source, server, end, body)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def put(self, key, source, server, end, body):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (source, server, end, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, source, appended):
+        """Drop entries that rows appended to `source` fall into."""
+        if not appended:
+            return
+        earliest = min(appended.values())
+        with self._lock:
+            stale = []
+            for key, (src, server, end, _) in self._entries.items():
+                if src != source:
+                    continue
+                if server is None:
+                    first = earliest
+                elif server in appended:
+                    first = appended[server]
+                else:
+                    continue
+                if end is None or end >= first:
+                    stale.append(key)
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self, source=None):
+        with self._lock:
+            if source is None:
+                self._entries.clear()
+                return
+            for key in [k for k, e in self._entries.items() if e[0] == source]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class QueryService:
+
+    def __init__(self, history_file, events_file, cache_size=256,
+                 max_points=100_000):
+        self.history = HistoryIndex(history_file)
+        self.events = EventIndex(events_file)
+        self.cache = ResultCache(cache_size)
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        # bumped on every change to either index; a response computed
+        # before a change is not cached after it
+        self.generation = 0
+
+    def refresh(self):
+        """Index what was appended; returns the current generation."""
+        with self._lock:
+            for source, index in (
+                ("history", self.history), ("events", self.events)
+            ):
+                reset, appended = index.refresh()
+                if reset:
+                    self.cache.clear(source)
+                else:
+                    self.cache.invalidate(source, appended)
+                if reset or appended:
+                    self.generation += 1
+            return self.generation
+
+    # Parameters
+
+    def _window(self, params, latest):
+        start = params.get("start")
+        end = params.get("end")
+        start = None if start is None else _epoch(start)
+        end = None if end is None else _epoch(end)
+        if "last" in params:
+            if latest is None:
+                return None, None
+            start = (end if end is not None else latest) - _epoch(
+                params["last"]
+            )
+        return start, end
+
+    def _server_series(self, params):
+        with self._lock:
+            series = self.history.series
+            server = params.get("server")
+            if server is not None:
+                if server not in series:
+                    raise QueryError(f"unknown server: {server!r}")
+                return {server: series[server].view()}
+            return {name: s.view() for name, s in sorted(series.items())}
+
+    def _latest(self, views):
+        last = [int(v["ts"][-1]) for v in views.values() if len(v["ts"])]
+        return max(last) if last else None
+
+    @staticmethod
+    def _cut(view, start, end):
+        ts = view["ts"]
+        lo = 0 if start is None else np.searchsorted(ts, start, "left")
+        hi = len(ts) if end is None else np.searchsorted(ts, end, "right")
+        return {name: values[lo:hi] for name, values in view.items()}
+
+    # Queries
+
+    def servers(self, params):
+        views = self._server_series({})
+        return {
+            "servers": [
+                {
+                    "server": server,
+                    "rows": len(view["ts"]),
+                    "first": _format(view["ts"][:1])[0],
+                    "last": _format(view["ts"][-1:])[0],
+                }
+                for server, view in views.items() if len(view["ts"])
+            ]
+        }
+
+    def range(self, params):
+        metrics = params.get("metrics", "cpu,mem,disk,score").split(",")
+        for metric in metrics:
+            if metric not in METRICS:
+                raise QueryError(f"unknown metric: {metric!r}")
+        views = self._server_series(params)
+        start, end = self._window(params, self._latest(views))
+
+        budget = self.max_points
+        series = []
+        truncated = False
+        for server, view in views.items():
+            part = self._cut(view, start, end)
+            if not len(part["ts"]):
+                continue
+            if len(part["ts"]) > budget:
+                part = {k: v[:budget] for k, v in part.items()}
+                truncated = True
+            budget -= len(part["ts"])
+            if len(part["ts"]):
+                entry = {"server": server, "timestamp": _format(part["ts"])}
+                for metric in metrics:
+                    entry[metric] = _values(part[metric])
+                series.append(entry)
+        return {
+            "points": self.max_points - budget,
+            "truncated": truncated,
+            "series": series,
+        }
+
+    def aggregate(self, params):
+        metric = params.get("metric", "cpu")
+        if metric not in METRICS:
+            raise QueryError(f"unknown metric: {metric!r}")
+        bucket = _int(params, "bucket", 60)
+        if bucket == 0:
+            raise QueryError("bucket must be positive")
+        functions = params.get("fn", "count,avg,max,p95").split(",")
+        for fn in functions:
+            if fn not in AGGREGATES:
+                raise QueryError(f"unknown aggregate: {fn!r}")
+
+        views = self._server_series(params)
+        start, end = self._window(params, self._latest(views))
+        parts = [self._cut(v, start, end) for v in views.values()]
+        ts = np.concatenate([p["ts"] for p in parts] or [np.zeros(0, np.int64)])
+        values = np.concatenate([p[metric] for p in parts] or [np.zeros(0)])
+        keep = ~np.isnan(values)
+        ts, values = ts[keep], values[keep]
+
+        # one sort by (bucket, value): every group is a contiguous,
+        # ordered run, so min/max/percentiles are index lookups
+        ids = ts // bucket
+        if {"min", "max", "p95"} & set(functions):
+            order = np.lexsort((values, ids))
+        else:
+            order = np.argsort(ids, kind="stable")
+        ids, values = ids[order], values[order]
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) \
+            if len(ids) else np.zeros(0, dtype=np.int64)
+        counts = np.diff(np.r_[starts, len(ids)])
+
+        result = {
+            "metric": metric,
+            "bucket": bucket,
+            "server": params.get("server"),
+            "timestamp": _format(ids[starts] * bucket),
+        }
+        for fn in functions:
+            if fn == "count":
+                result[fn] = counts.tolist()
+            elif fn == "avg":
+                sums = np.add.reduceat(values, starts) if len(starts) \
+                    else np.zeros(0)
+                result[fn] = np.round(sums / counts, 4).tolist()
+            elif fn == "min":
+                result[fn] = values[starts].tolist()
+            elif fn == "max":
+                result[fn] = values[starts + counts - 1].tolist()
+            elif fn == "p95":
+                # nearest rank
+                rank = np.ceil(0.95 * counts).astype(np.int64) - 1
+                result[fn] = values[starts + rank].tolist()
+        return result
+
+    def top(self, params):
+        limit = _int(params, "limit", 10)
+        if params.get("source", "history") == "events":
+            return self._top_events(params, limit)
+
+        views = self._server_series(params)
+        start, end = self._window(params, self._latest(views))
+        rows = []
+        for server, view in views.items():
+            part = self._cut(view, start, end)
+            scores = part["score"]
+            if not len(scores):
+                continue
+            # lowest scores first; NaN (unscored rows) sorts last
+            k = min(limit, len(scores))
+            if k == 0:
+                continue
+            idx = np.argpartition(np.nan_to_num(scores, nan=np.inf), k - 1)[:k]
+            idx = idx[~np.isnan(scores[idx])]
+            for i, ts in zip(idx.tolist(), _format(part["ts"][idx])):
+                rows.append({
+                    "timestamp": ts, "server": server,
+                    "cpu": float(part["cpu"][i]), "mem": float(part["mem"][i]),
+                    "disk": float(part["disk"][i]),
+                    "score": float(part["score"][i]),
+                })
+        rows.sort(key=lambda r: r["score"])
+        return {"source": "history", "anomalies": rows[:limit]}
+
+    def _events_view(self, params):
+        with self._lock:
+            view = self.events.columns.view()
+            records = self.events.records
+            code = None
+            if params.get("server") is not None:
+                code = self.events.servers.get(params["server"], -1)
+        start, end = self._window(
+            params, int(view["ts"][-1]) if len(view["ts"]) else None
+        )
+        part = self._cut(view, start, end)
+        if code is not None:
+            part = {k: v[part["server"] == code] for k, v in part.items()}
+        return part, records
+
+    def _top_events(self, params, limit):
+        part, records = self._events_view(params)
+        scored = ~np.isnan(part["score"])
+        rows, scores = part["row"][scored], part["score"][scored]
+        order = np.argsort(scores, kind="stable")[:limit]
+        return {
+            "source": "events",
+            "anomalies": [records[r] for r in rows[order].tolist()],
+        }
+
+    def event_list(self, params):
+        limit = _int(params, "limit", 1000)
+        part, records = self._events_view(params)
+        selected = [records[r] for r in part["row"].tolist()]
+        if params.get("event") is not None:
+            selected = [r for r in selected if r.get("event") == params["event"]]
+        # newest first
+        return {"events": selected[::-1][:limit]}
+
+    def stats(self, params):
+        with self._lock:
+            return {
+                "history_rows": self.history.rows(),
+                "history_servers": len(self.history.series),
+                "history_bad_lines": self.history.bad,
+                "events": len(self.events.records),
+                "events_bad_lines": self.events.bad,
+                "cache_entries": len(self.cache),
+                "cache_hits": self.cache.hits,
+                "cache_misses": self.cache.misses,
+            }
+
+    # Dispatch
+
+    ROUTES = {
+        "/servers": "servers",
+        "/range": "range",
+        "/aggregate": "aggregate",
+        "/top": "top",
+        "/events": "event_list",
+        "/stats": "stats",
+    }
+
+    def handle(self, path, params):
+        """JSON body (bytes) for one routed request; raises QueryError."""
+        method = getattr(self, self.ROUTES[path])
+        generation = self.refresh()
+        if path == "/stats":
+            return _dumps(method(params))
+
+        key = (path, tuple(sorted(params.items())))
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+
+        body = _dumps(method(params))
+        source = "events" if (
+            path == "/events" or params.get("source") == "events"
+        ) else "history"
+        end = None
+        if "end" in params and "last" not in params:
+            end = _epoch(params["end"])
+        with self._lock:
+            if generation == self.generation:
+                self.cache.put(key, source, params.get("server"), end, body)
+        return body
+
+
+def _make_handler(service):
+
+    class QueryHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if url.path not in service.ROUTES:
+                body, status = b'{"error": "not found"}', 404
+            else:
+                try:
+                    body = service.handle(url.path, params)
+                    status = 200
+                except QueryError as e:
+                    body = json.dumps({"error": str(e)}).encode("utf-8")
+                    status = 400
+                except Exception as e:
+                    logger.exception("Query %s failed", self.path)
+                    body = json.dumps(
+                        {"error": f"{type(e).__name__}: {e}"}
+                    ).encode("utf-8")
+                    status = 500
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+
+def start_query_server(service, host="127.0.0.1", port=9110):
+    server = ThreadingHTTPServer((host, port), _make_handler(service))
+    server.daemon_threads = True
+    return server
+
+
+SQLITE_UNSUPPORTED = (
+    "storage.backend is sqlite: the query service indexes the JSONL "
+    "history and event files only. Query the database with "
+    "utils.sqlite_store.query_snapshots/query_events, or pass JSONL "
+    "files with --history and --events."
+)
+
+
+def service_from_config(config, base_dir=BASE_DIR):
+    if config["storage"]["backend"] == "sqlite":
+        raise ValueError(SQLITE_UNSUPPORTED)
+    section = config["query"]
+    return QueryService(
+        os.path.join(base_dir, config["paths"]["history_file"]),
+        os.path.join(base_dir, config["paths"]["anomaly_file"]),
+        cache_size=section["cache_size"],
+        max_points=section["max_points"],
+    )
+
+
+def main():
+    from utils.config_loader import load_config
+
+    config = load_config()
+
+    parser = argparse.ArgumentParser(
+        description="Serve history and event queries over local HTTP/JSON."
+    )
+    parser.add_argument("--history", help="JSONL history (default: config)")
+    parser.add_argument("--events", help="JSONL events (default: config)")
+    parser.add_argument("--host", default=config["query"]["host"])
+    parser.add_argument("--port", type=int, default=config["query"]["port"])
+    args = parser.parse_args()
+
+    # the agent writes no JSONL under the sqlite backend; serving the
+    # stale files would look like an empty fleet
+    if config["storage"]["backend"] == "sqlite" and not (
+            args.history and args.events):
+        parser.error(SQLITE_UNSUPPORTED)
+    if is_database(args.history or "") or is_database(args.events or ""):
+        parser.error(SQLITE_UNSUPPORTED)
+    history = args.history or os.path.join(
+        BASE_DIR, config["paths"]["history_file"]
+    )
+    events = args.events or os.path.join(
+        BASE_DIR, config["paths"]["anomaly_file"]
+    )
+
+    service = QueryService(
+        history, events,
+        cache_size=config["query"]["cache_size"],
+        max_points=config["query"]["max_points"],
+    )
+    started = time.perf_counter()
+    service.refresh()
+    stats = service.stats({})
+    print(
+        f"Indexed {stats['history_rows']} snapshot(s) from "
+        f"{stats['history_servers']} server(s) and {stats['events']} "
+        f"event(s) in {time.perf_counter() - started:.1f}s"
+    )
+
+    server = start_query_server(service, args.host, args.port)
+    print(f"Query API listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+DATABASE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+# SQLite storage backend
+#
+# Purpose:
+# The JSONL files have no index: "anomalies for host X last Tuesday"
+# is a full scan. One SQLite database holds the same snapshots and
+# event records with indexes on (server, timestamp).
+#
+# Flow:
+# append_snapshot / append_event   buffered in memory
+# ↓
+# flush when `batch_size` rows are buffered (from append), and every
+# `flush_interval` seconds from a background thread while anything is
+# buffered (flush_interval 0: on every append): one transaction,
+# executemany per table (one commit, one WAL fsync, for the whole batch)
+# ↓
+# snapshots(timestamp, server, cpu, mem, disk, score, interval, extra)
+# events(timestamp, server, event, record)
+#   index (server, timestamp) for per-host range queries
+#   index (timestamp) for retention and fleet-wide ranges
+# ↓
+# every hour, if retention_days is set: delete older rows
+#
+# WAL mode lets the training loaders and ad-hoc queries read while the
+# agent writes. synchronous=NORMAL commits without an fsync per
+# transaction; a process crash loses nothing that was committed, a
+# power loss at most the last few commits (same trade-off as the JSONL
+# group commit). Rows still buffered in memory are lost on a crash;
+# the flush thread keeps that to about flush_interval seconds of rows
+# even when appends stop.
+#
+# A failed flush (e.g. "database is locked") puts its rows back in the
+# buffers, ahead of newer ones, and is retried on the next flush; past
+# MAX_BUFFERED rows the oldest are dropped (stats["dropped"]). Errors
+# are logged, never raised into the sampling loop.
+#
+# Offline tools (training, calibration, fleet correlation, replay)
+# read whichever of the store or the JSONL history history_source()
+# names for the configured backend.
+#
+# Snapshot fields beyond the fixed columns (cgroup, io rates, ...) are
+# kept as JSON in `extra`; events keep their whole record as JSON.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    server TEXT,
+    cpu REAL,
+    mem REAL,
+    disk REAL,
+    score REAL,
+    interval REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_server_time
+    ON snapshots (server, timestamp);
+CREATE INDEX IF NOT EXISTS snapshots_time ON snapshots (timestamp);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    server TEXT,
+    event TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_server_time ON events (server, timestamp);
+CREATE INDEX IF NOT EXISTS events_time ON events (timestamp);
+"""
+
+SNAPSHOT_COLUMNS = (
+    "timestamp", "server", "cpu", "mem", "disk", "score", "interval"
+)
+
+PRUNE_EVERY = 3600
+
+MAX_BUFFERED = 100_000
+
+
+def is_database(path):
+    return path.endswith(DATABASE_SUFFIXES)
+
+
+def connect(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _snapshot_row(record):
+    extra = {k: v for k, v in record.items() if k not in SNAPSHOT_COLUMNS}
+    return tuple(record.get(k) for k in SNAPSHOT_COLUMNS) + (
+        json.dumps(extra) if extra else None,
+    )
+
+
+def _event_row(record):
+    return (
+        record.get("timestamp"),
+        record.get("server"),
+        record.get("event"),
+        json.dumps(record),
+    )
+
+
+def _snapshot_record(row):
+    record = {k: v for k, v in zip(SNAPSHOT_COLUMNS, row) if v is not None}
+    if row[-1]:
+        record.update(json.loads(row[-1]))
+    return record
+
+
+def _range(server, start, end):
+    clauses = []
+    params = []
+    if server is not None:
+        clauses.append("server = ?")
+        params.append(server)
+    if start is not None:
+        clauses.append("timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("timestamp < ?")
+        params.append(end)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+
+class SqliteStore:
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0,
+                 retention_days=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        self._snapshots = []
+        self._events = []
+        self._last_prune = None
+        self.stats = {
+            "records": 0, "transactions": 0, "pruned": 0, "dropped": 0
+        }
+        self._stop = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="iclim-store-flush",
+                daemon=True
+            )
+            self._flusher.start()
+
+    def _buffered(self, table, row):
+        # the buffer is looked up under the lock: flush() swaps it
+        with self._lock:
+            getattr(self, table).append(row)
+            due = (
+                len(self._snapshots) + len(self._events) >= self.batch_size
+                or not self.flush_interval
+            )
+        if due:
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error("Flush to %s failed: %s", self.path, e)
+
+    def _restore(self, snapshots, events):
+        # called with the lock held, after a failed transaction
+        self._snapshots = snapshots + self._snapshots
+        self._events = events + self._events
+        excess = len(self._snapshots) + len(self._events) - MAX_BUFFERED
+        if excess > 0:
+            dropped = min(excess, len(self._snapshots))
+            del self._snapshots[:dropped]
+            del self._events[:excess - dropped]
+            self.stats["dropped"] += excess
+            logger.error(
+                "Dropped the %s oldest buffered row(s) for %s", excess,
+                self.path
+            )
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error("Flush to %s failed: %s", self.path, e)
+
+    def append_snapshot(self, record):
+        self._buffered("_snapshots", _snapshot_row(record))
+
+    def append_event(self, record):
+        self._buffered("_events", _event_row(record))
+
+    def flush(self):
+        with self._lock:
+            snapshots, self._snapshots = self._snapshots, []
+            events, self._events = self._events, []
+            if snapshots or events:
+                try:
+                    with self._conn:
+                        if snapshots:
+                            self._conn.executemany(
+                                "INSERT INTO snapshots (timestamp, server, "
+                                "cpu, mem, disk, score, interval, extra) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                snapshots
+                            )
+                        if events:
+                            self._conn.executemany(
+                                "INSERT INTO events (timestamp, server, "
+                                "event, record) VALUES (?, ?, ?, ?)",
+                                events
+                            )
+                except sqlite3.Error:
+                    self._restore(snapshots, events)
+                    raise
+                self.stats["records"] += len(snapshots) + len(events)
+                self.stats["transactions"] += 1
+
+        if self.retention_days is not None and (
+            self._last_prune is None
+            or time.monotonic() - self._last_prune >= PRUNE_EVERY
+        ):
+            self.prune(self.retention_days)
+
+    def prune(self, days):
+        """Delete snapshots and events older than `days`; returns rows removed."""
+        cutoff = (datetime.now() - timedelta(days=days)).strftime(
+            TIMESTAMP_FORMAT
+        )
+        with self._lock:
+            with self._conn:
+                removed = self._conn.execute(
+                    "DELETE FROM snapshots WHERE timestamp < ?", (cutoff,)
+                ).rowcount
+                removed += self._conn.execute(
+                    "DELETE FROM events WHERE timestamp < ?", (cutoff,)
+                ).rowcount
+            self._last_prune = time.monotonic()
+        self.stats["pruned"] += removed
+        if removed:
+            logger.info(
+                "Retention: removed %s row(s) older than %s from %s",
+                removed, cutoff, self.path
+            )
+        return removed
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._flusher is not None:
+            self._stop.set()
+            self._flusher.join()
+            self._flusher = None
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logger.error(
+                "Final flush to %s failed, %s buffered row(s) lost: %s",
+                self.path, len(self._snapshots) + len(self._events), e
+            )
+        self._conn.close()
+        self._conn = None
+
+
+# Same append()/close()/path surface as utils.durable_log.AppendLog,
+# so the agent writes to either backend the same way.
+class StoreLog:
+
+    def __init__(self, store, table):
+        self.store = store
+        self.path = store.path
+        self.append = (
+            store.append_snapshot if table == "snapshots"
+            else store.append_event
+        )
+
+    def close(self):
+        self.store.flush()
+
+
+def store_from_config(path, config):
+    section = config["storage"]
+    return SqliteStore(
+        path,
+        batch_size=section["batch_size"],
+        flush_interval=section["flush_interval"],
+        retention_days=section["retention_days"],
+    )
+
+
+def history_source(config, base_dir):
+    """Where the agent's snapshots live for the configured backend."""
+    if config["storage"]["backend"] == "sqlite":
+        return os.path.join(base_dir, config["storage"]["database"])
+    return os.path.join(base_dir, config["paths"]["history_file"])
+
+
+# Readers open their own connection, so they can run next to the agent.
+
+def query_snapshots(path, server=None, start=None, end=None):
+    """Snapshot records, oldest first; start/end are timestamp strings."""
+    where, params = _range(server, start, end)
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT timestamp, server, cpu, mem, disk, score, interval, extra "
+            "FROM snapshots" + where + " ORDER BY timestamp",
+            params
+        ).fetchall()
+    finally:
+        conn.close()
+    return [_snapshot_record(row) for row in rows]
+
+
+def query_events(path, server=None, start=None, end=None, event=None):
+    """Event records, oldest first; optionally one event type only."""
+    where, params = _range(server, start, end)
+    if event is not None:
+        where += (" AND" if where else " WHERE") + " event = ?"
+        params.append(event)
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT record FROM events" + where + " ORDER BY timestamp",
+            params
+        ).fetchall()
+    finally:
+        conn.close()
+    return [json.loads(row[0]) for row in rows]
+
+
+def load_snapshots(path, server=None, start=None, end=None):
+    """Snapshots as a DataFrame (cpu/mem/disk plus the fixed columns)."""
+    import pandas as pd
+
+    where, params = _range(server, start, end)
+    conn = sqlite3.connect(path)
+    try:
+        df = pd.read_sql_query(
+            "SELECT timestamp, server, cpu, mem, disk, score, interval "
+            "FROM snapshots" + where + " ORDER BY timestamp",
+            conn, params=params
+        )
+    finally:
+        conn.close()
+    return df.dropna(axis=1, how="all")
+
+
+def import_jsonl(store, filename, table):
+    """Copy an existing JSONL history or event file into the store."""
+    append = (
+        store.append_snapshot if table == "snapshots" else store.append_event
+    )
+    count = bad = 0
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                append(json.loads(line))
+            except json.JSONDecodeError:
+                bad += 1
+                continue
+            count += 1
+    store.flush()
+    if bad:
+        logger.warning("Skipped %s invalid JSON line(s) in %s", bad, filename)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Maintain the SQLite snapshot/event store."
+    )
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--import-history", help="JSONL snapshot history")
+    parser.add_argument("--import-events", help="JSONL anomaly events")
+    parser.add_argument(
+        "--retention-days", type=float,
+        help="delete rows older than this many days"
+    )
+    args = parser.parse_args()
+
+    store = SqliteStore(args.database, batch_size=5000, flush_interval=60)
+    if args.import_history:
+        count = import_jsonl(store, args.import_history, "snapshots")
+        logger.info("Imported %s snapshot(s) from %s", count, args.import_history)
+    if args.import_events:
+        count = import_jsonl(store, args.import_events, "events")
+        logger.info("Imported %s event(s) from %s", count, args.import_events)
+    if args.retention_days is not None:
+        store.prune(args.retention_days)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
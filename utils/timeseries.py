@@ -0,0 +1,352 @@
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+METRICS = ("cpu", "mem", "disk", "score")
+
+# Compressed in-memory time series
+#
+# Purpose:
+# Keep the last day of every host's metrics in memory, so windowed
+# computations, dashboards and the query endpoint never re-read the
+# history from disk. 24h of 1-second samples is 86 400 points per
+# series; compressed it is a few hundred KB per host.
+#
+# Encoding (Gorilla, Pelkonen et al. 2015), per block:
+# timestamps: first one in 64 bits, then delta-of-delta
+#   0                    → '0'
+#   [-64, 63]            → '10'   + 7 bits
+#   [-256, 255]          → '110'  + 9 bits
+#   [-2048, 2047]        → '1110' + 12 bits
+#   anything else        → '1111' + 32 bits
+#   (a steady interval costs one bit per sample)
+# values: first one in 64 bits, then XOR with the previous value
+#   same value           → '0'
+#   fits previous window → '10' + the meaningful bits
+#   otherwise            → '11' + 5 bits leading zeros
+#                               + 6 bits length + the meaningful bits
+#
+# Flow:
+# append(ts, value) → open block (bit writer)
+# ↓ `block_size` samples
+# sealed block: immutable bytes + first/last timestamp + count
+# ↓
+# ring: sealed blocks older than `retention` seconds are dropped
+#
+# range(start, end) only decodes blocks that overlap [start, end]; the
+# bit readers work on byte slices, and values are rebuilt as one
+# uint64 array viewed as float64.
+
+_FLOAT = struct.Struct(">d")
+_UINT = struct.Struct(">Q")
+
+# (prefix, prefix bits, value bits) per delta-of-delta range
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+)
+
+
+def _float_bits(value):
+    return _UINT.unpack(_FLOAT.pack(value))[0]
+
+
+class BitWriter:
+
+    def __init__(self):
+        self.buf = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value, n):
+        self._acc = (self._acc << n) | (value & ((1 << n) - 1))
+        self._bits += n
+        while self._bits >= 8:
+            self._bits -= 8
+            self.buf.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self):
+        if self._bits:
+            return bytes(self.buf) + bytes(
+                [(self._acc << (8 - self._bits)) & 0xFF]
+            )
+        return bytes(self.buf)
+
+    @property
+    def nbytes(self):
+        return len(self.buf) + (1 if self._bits else 0)
+
+
+class BitReader:
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def bit(self):
+        pos = self.pos
+        self.pos = pos + 1
+        return (self.data[pos >> 3] >> (7 - (pos & 7))) & 1
+
+    def read(self, n):
+        pos = self.pos
+        start = pos >> 3
+        end = (pos + n + 7) >> 3
+        self.pos = pos + n
+        chunk = int.from_bytes(self.data[start:end], "big")
+        return (chunk >> (end * 8 - pos - n)) & ((1 << n) - 1)
+
+
+class BlockEncoder:
+
+    def __init__(self):
+        self.writer = BitWriter()
+        self.count = 0
+        self.first = None
+        self.last = None
+        self._delta = 0
+        self._value = 0
+        self._leading = -1
+        self._trailing = 0
+
+    def append(self, ts, value):
+        w = self.writer
+        bits = _float_bits(value)
+
+        if self.count == 0:
+            w.write(ts, 64)
+            w.write(bits, 64)
+            self.first = ts
+        else:
+            delta = ts - self.last
+            dod = delta - self._delta
+            self._delta = delta
+            if dod == 0:
+                w.write(0, 1)
+            else:
+                for prefix, prefix_bits, value_bits in _DOD_BUCKETS:
+                    limit = 1 << (value_bits - 1)
+                    if -limit <= dod < limit:
+                        w.write(prefix, prefix_bits)
+                        w.write(dod, value_bits)
+                        break
+                else:
+                    w.write(0b1111, 4)
+                    w.write(dod, 32)
+
+            xor = bits ^ self._value
+            if xor == 0:
+                w.write(0, 1)
+            else:
+                leading = min(64 - xor.bit_length(), 31)
+                trailing = (xor & -xor).bit_length() - 1
+                if (self._leading >= 0 and leading >= self._leading
+                        and trailing >= self._trailing):
+                    w.write(0b10, 2)
+                    length = 64 - self._leading - self._trailing
+                    w.write(xor >> self._trailing, length)
+                else:
+                    length = 64 - leading - trailing
+                    w.write(0b11, 2)
+                    w.write(leading, 5)
+                    # 64 meaningful bits do not fit in 6 bits; 0 means 64
+                    w.write(length & 63, 6)
+                    w.write(xor >> trailing, length)
+                    self._leading = leading
+                    self._trailing = trailing
+
+        self._value = bits
+        self.last = ts
+        self.count += 1
+
+
+def _signed(value, bits):
+    if value >= 1 << (bits - 1):
+        return value - (1 << bits)
+    return value
+
+
+def decode_block(data, count):
+    """Timestamps (int64) and values (float64) of one encoded block."""
+    r = BitReader(data)
+    timestamps = [0] * count
+    values = [0] * count
+    if count == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    ts = r.read(64)
+    bits = r.read(64)
+    timestamps[0] = ts
+    values[0] = bits
+    delta = 0
+    leading = trailing = 0
+
+    for i in range(1, count):
+        if r.bit() == 0:
+            dod = 0
+        elif r.bit() == 0:
+            dod = _signed(r.read(7), 7)
+        elif r.bit() == 0:
+            dod = _signed(r.read(9), 9)
+        elif r.bit() == 0:
+            dod = _signed(r.read(12), 12)
+        else:
+            dod = _signed(r.read(32), 32)
+        delta += dod
+        ts += delta
+        timestamps[i] = ts
+
+        if r.bit():
+            if r.bit():
+                leading = r.read(5)
+                length = r.read(6) or 64
+                trailing = 64 - leading - length
+            else:
+                length = 64 - leading - trailing
+            bits ^= r.read(length) << trailing
+        values[i] = bits
+
+    return (
+        np.array(timestamps, dtype=np.int64),
+        np.array(values, dtype=np.uint64).view(np.float64),
+    )
+
+
+class SeriesBuffer:
+
+    def __init__(self, retention=86400, block_size=1024):
+        self.retention = retention
+        self.block_size = block_size
+        # (first ts, last ts, count, bytes)
+        self._blocks = deque()
+        self._open = BlockEncoder()
+        self._last = None
+
+    def append(self, ts, value):
+        if self._last is not None and ts < self._last:
+            # out of order (clock stepped back); blocks stay sorted
+            return False
+        self._last = ts
+        self._open.append(ts, value)
+        if self._open.count >= self.block_size:
+            block = self._open
+            self._blocks.append(
+                (block.first, block.last, block.count, block.writer.getvalue())
+            )
+            self._open = BlockEncoder()
+        cutoff = ts - self.retention
+        while self._blocks and self._blocks[0][1] < cutoff:
+            self._blocks.popleft()
+        return True
+
+    def blocks(self, start=None, end=None):
+        """Encoded blocks overlapping [start, end], open block included."""
+        chosen = [
+            (data, count) for first, last, count, data in self._blocks
+            if (start is None or last >= start)
+            and (end is None or first <= end)
+        ]
+        block = self._open
+        if block.count and (start is None or block.last >= start) and (
+            end is None or block.first <= end
+        ):
+            chosen.append((block.writer.getvalue(), block.count))
+        return chosen
+
+    @property
+    def nbytes(self):
+        return sum(len(b[3]) for b in self._blocks) + self._open.writer.nbytes
+
+    def __len__(self):
+        return sum(b[2] for b in self._blocks) + self._open.count
+
+
+def decode_range(blocks, start=None, end=None):
+    """Decode (data, count) blocks and cut them to [start, end]."""
+    if not blocks:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    parts = [decode_block(data, count) for data, count in blocks]
+    timestamps = np.concatenate([p[0] for p in parts])
+    values = np.concatenate([p[1] for p in parts])
+    lo = 0 if start is None else np.searchsorted(timestamps, start, "left")
+    hi = len(timestamps) if end is None else np.searchsorted(
+        timestamps, end, "right"
+    )
+    return timestamps[lo:hi], values[lo:hi]
+
+
+class MetricBuffer:
+
+    def __init__(self, metrics=METRICS, retention=86400, block_size=1024):
+        self.metrics = metrics
+        self.retention = retention
+        self.block_size = block_size
+        # (server, metric) -> SeriesBuffer
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def append(self, snapshot, ts=None):
+        """Add one snapshot; ts (epoch seconds) defaults to its timestamp."""
+        if ts is None:
+            ts = datetime.strptime(
+                snapshot["timestamp"], TIMESTAMP_FORMAT
+            ).timestamp()
+        ts = int(ts)
+        server = snapshot.get("server")
+        with self._lock:
+            for metric in self.metrics:
+                value = snapshot.get(metric)
+                if value is None:
+                    continue
+                series = self._series.get((server, metric))
+                if series is None:
+                    series = self._series[(server, metric)] = SeriesBuffer(
+                        self.retention, self.block_size
+                    )
+                series.append(ts, float(value))
+
+    def range(self, server, metric, start=None, end=None):
+        """(timestamps, values) of one series within [start, end]
+        (epoch seconds, inclusive); decoding runs outside the lock."""
+        with self._lock:
+            series = self._series.get((server, metric))
+            if series is None:
+                return decode_range([])
+            blocks = series.blocks(start, end)
+        return decode_range(blocks, start, end)
+
+    def window(self, server, seconds, now=None):
+        """Every metric of `server` over the last `seconds`."""
+        start = (time.time() if now is None else now) - seconds
+        return {
+            metric: self.range(server, metric, start)
+            for metric in self.metrics
+        }
+
+    def servers(self):
+        with self._lock:
+            return sorted({server for server, _ in self._series})
+
+    def stats(self):
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "samples": sum(len(s) for s in self._series.values()),
+                "bytes": sum(s.nbytes for s in self._series.values()),
+            }
+
+
+def buffer_from_config(config):
+    section = config["buffer"]
+    return MetricBuffer(
+        retention=section["retention"],
+        block_size=section["block_size"],
+    )